@@ -17,4 +17,4 @@ class ACOSettings():
     start_node: int
     goal_nodes: list[int]
     target_length: float
-
+    seed: int | None = None # Seed for the ants' random choices (None = different every time). Runs with the same seed replay exactly
@@ -1,83 +1,102 @@
-import networkx as nx
 from .ACOSettings import ACOSettings
+from .AntRandom import UniformStream
+from .CompiledGraph import CompiledGraph
+from .HeuristicTables import HeuristicTables
 import numpy as np
-import itertools
 
 
-class RunResult:
-    def __init__(self, route, total_length, newly_traveled_length, traveled_edges):
-        self.route = route
-        self.total_length = total_length
-        self.newly_traveled_length = newly_traveled_length
-        self.traveled_edges = traveled_edges
-
 class Ant:
-    def __init__(self, network_graph: nx.MultiGraph, settings: ACOSettings):
-        self.network_graph = network_graph
-        self.finish_nodes = network_graph.graph["finish_nodes"]
+    def __init__(self, compiled_graph: CompiledGraph, settings: ACOSettings, pheromone: np.ndarray, heuristic_tables: HeuristicTables | None = None,
+                 rng: np.random.Generator | None = None):
+        """
+        An ant walks the colony's compiled graph.
+        The pheromone array (indexed by edge id) and the static heuristic tables are shared with the colony,
+          which keeps them up to date.
+        The rng is used for walks that aren't given their own (see AntRandom.ant_rng).
+        """
+        self.compiled_graph = compiled_graph
+        self.rng = rng or np.random.default_rng()
+        self.pheromone = pheromone
+        self.heuristic_tables = heuristic_tables or HeuristicTables(compiled_graph, settings)
         self.update_settings(settings)
-        self.traveled_edges = set()
+        self.traveled_mask = np.zeros(compiled_graph.num_edges, dtype=bool)
         self.total_length = 0
         self.newly_traveled_length = 0
-    
+        # How many times this ant weighed up its options on its last walk (for the colony's instruments)
+        self.desireability_evaluations = 0
+
     def update_settings(self, settings: ACOSettings):
         self.settings = settings
-        self.goal_locs = [self.network_graph.nodes[node]["proj_pos"] for node in self.settings.goal_nodes]
         self.gohome_trigger = self.settings.gohome_start_coeff * self.settings.target_length
 
-    def edge_sort(self, edge):
-        return (edge[0], edge[1], edge[2]) if edge[0] < edge[1] else (edge[1], edge[0], edge[2])
-
     def run(self):
-        current_node = self.settings.start_node
-        self.route = [current_node]
-        self.traveled_edges = set()
+        graph = self.compiled_graph
+        route, edge_path, total_length, newly_traveled_length = self.walk(graph.node_index[self.settings.start_node])
+        return graph.make_result(route, edge_path, total_length, newly_traveled_length)
+
+    def walk(self, start_node: int, rng: np.random.Generator | None = None):
+        """
+        Does the actual walking from the given start node index, making its choices with the given rng (or the ant's own).
+        Only touches the compiled graph's arrays (no networkx nodes), so it can run in worker processes.
+        Returns the route (node indices), edge path (edge ids), total length, and newly traveled length.
+        """
+        graph = self.compiled_graph
+        uniforms = UniformStream(rng or self.rng)
+        current_node = start_node
+        route = [current_node]
+        edge_path = []
+        self.traveled_mask = np.zeros(graph.num_edges, dtype=bool)
         self.total_length = 0
-        while current_node not in self.finish_nodes:
-            outgoing_edges = list(self.network_graph.edges(current_node, data=True, keys=True))
+        self.newly_traveled_length = 0
+        self.desireability_evaluations = 0
+        while not graph.is_finish_node[current_node]:
+            outgoing_slots = np.arange(graph.offsets[current_node], graph.offsets[current_node + 1])
 
-            if(len(self.route) <= 2):
+            if(len(route) <= 2):
                 # If we're just starting out, don't allow our poor ant to immediately finish
-                outgoing_edges = list(filter(lambda edge: edge[1] not in self.finish_nodes, outgoing_edges))
+                outgoing_slots = outgoing_slots[~graph.slot_is_finish[outgoing_slots]]
 
-            if len(outgoing_edges) == 1:
+            if len(outgoing_slots) == 1:
                 # If we go down a dead end, the only way out is back the way we came!
                 # We can skip the desireability calculation in this case.
-                chosen_edge = outgoing_edges[0]
-                traveled = self.traveled(chosen_edge)
+                chosen_slot = outgoing_slots[0]
+                traveled = self.traveled(chosen_slot)
             else:
-                desireabilities, traveled_lads = self.desireabilities(outgoing_edges)
-                desireabilities = desireabilities / np.sum(desireabilities)
-                chosen_ind = np.random.choice(len(outgoing_edges), 1, p=desireabilities)
-                chosen_edge = outgoing_edges[chosen_ind[0]]
-                traveled = traveled_lads[chosen_ind[0]]
-            
-            current_node = chosen_edge[1]
-            self.route.append(current_node)
-            self.traveled_edges.add(self.edge_sort(chosen_edge))
-            length = chosen_edge[3]['length']
-            self.total_length += length
-            self.newly_traveled_length += 0 if traveled else length
-
-        return RunResult(self.route, self.total_length, self.newly_traveled_length, self.traveled_edges)
-    
-    def traveled(self, edge):
-        return edge[3]['traveled'] or self.edge_sort(edge) in self.traveled_edges
-        
-    def desireabilities(self, edges):
+                desireabilities, traveled_lads = self.desireabilities(outgoing_slots)
+                self.desireability_evaluations += 1
+                # Search a uniform against the cumulative desireabilities (no need to normalize them first)
+                cdf = np.cumsum(desireabilities)
+                chosen_ind = min(int(np.searchsorted(cdf, uniforms.next() * cdf[-1], side='right')), len(outgoing_slots) - 1)
+                chosen_slot = outgoing_slots[chosen_ind]
+                traveled = traveled_lads[chosen_ind]
+
+            current_node = graph.neighbors[chosen_slot]
+            edge = graph.edge_ids[chosen_slot]
+            route.append(current_node)
+            edge_path.append(edge)
+            self.traveled_mask[edge] = True
+            self.total_length += graph.slot_length[chosen_slot]
+            self.newly_traveled_length += 0 if traveled else graph.slot_untraveled_length[chosen_slot]
+
+        return np.array(route, dtype=np.int64), np.array(edge_path, dtype=np.int64), float(self.total_length), float(self.newly_traveled_length)
+
+    def traveled(self, slot):
+        return self.compiled_graph.slot_traveled[slot] or self.traveled_mask[self.compiled_graph.edge_ids[slot]]
+
+    def desireabilities(self, slots):
         """
-        Calculates the desireability of an edge for the ant.
+        Calculates the desireability of the given outgoing slots (edges) for the ant.
         Includes pheromone and heuristic information.
         """
-        end_nodes = [self.network_graph.nodes[edge[1]] for edge in edges]
-        heuristics = np.zeros(shape=(len(edges),), dtype=float)
+        graph = self.compiled_graph
+        heuristics = np.zeros(shape=(len(slots),), dtype=float)
 
         directional = self.settings.directional_coeff > 0
         gohome = self.settings.gohome_boost > 0 and self.total_length > self.gohome_trigger
 
         if gohome or directional:
-            to_goal = np.array([end_node['shortest_path_to_goal'] for end_node in end_nodes])
-            lengths = np.array([edge[3]['length'] for edge in edges])
+            to_goal = graph.slot_to_goal[slots]
+            lengths = graph.slot_length[slots]
             # Add a boost for going towards/away from the goal
             # The correct direction is based purely on traveled distance and distance remaining to goal.
             if directional:
@@ -89,7 +108,9 @@ class Ant:
                 remaining_dists = np.maximum(self.settings.target_length - self.total_length - lengths, 0)
                 dist_diffs = np.abs(remaining_dists - to_goal)
                 # Normalize diffs for relative comparison
-                dist_diffs_norm = (dist_diffs - np.mean(dist_diffs)) / np.std(dist_diffs)
+                # (if every option is equally good, e.g. on a perfectly regular grid, there's nothing to normalize)
+                dist_diffs_std = np.std(dist_diffs)
+                dist_diffs_norm = (dist_diffs - np.mean(dist_diffs)) / dist_diffs_std if dist_diffs_std > 0 else np.zeros(len(dist_diffs))
                 # Smack it with a sigmoid (https://eelslap.com/)
                 # Leave out the negative sign because we want this to be a decreasing function (more diff = less desireable)
                 dist_diffs_sig = 1 / (1 + np.exp(dist_diffs_norm * self.settings.directional_choosiness))
@@ -102,20 +123,18 @@ class Ant:
                 shortened_diffs = to_goal - (self.gohome_trigger - self.total_length - lengths)
                 heuristics += (shortened_diffs-np.max(shortened_diffs))**2 * self.settings.gohome_boost
 
+        edges = graph.edge_ids[slots]
         # The lads that have traveled
-        traveled_lads = np.array([self.traveled(edge) for edge in edges])
-        # Add a boost for deadend-ier nodes (except for traveled deadends)
-        heuristics += np.array([end_node['deadendness'] for end_node in end_nodes]) * self.settings.deadendness_coeff * traveled_lads
-        # Add a constant boost factor for finish nodes
-        heuristics += np.array([end_node['is_finish_node'] for end_node in end_nodes]) * self.settings.finish_boost
-        # TODO: Consider precomputing these factors that are constant to given node, traveled status, and settings 
-        # (deadendness, is_finish_node, etc) 
-        
+        traveled_lads = graph.slot_traveled[slots] | self.traveled_mask[edges]
+        # Add the precomputed boosts that only depend on the edge, its traveled status, and the settings
+        # (deadendness for traveled deadends, and a constant boost factor for finish nodes)
+        heuristics += self.heuristic_tables.static_heuristics(slots, traveled_lads)
+
         # Add other heuristics here
 
-        pheromones = np.array([edge[3]['pheromone'] for edge in edges])
+        pheromones = self.pheromone[edges]
 
         desireabilities = pheromones**self.settings.pheromone_weight * \
             heuristics**self.settings.heuristic_weight * \
             (1 - traveled_lads * self.settings.traveled_discount)
-        return desireabilities, traveled_lads
\ No newline at end of file
+        return desireabilities, traveled_lads
@@ -1,71 +1,166 @@
+from dataclasses import replace
+
 import networkx as nx
 import numpy as np
-import multiprocessing
 
-from .Ant import Ant, RunResult
+from instrumentation.Instruments import NULL_INSTRUMENTS, Instruments
+from map_data.ChainContraction import apply_traveled_changes, contract_chains, original_nodes, untraveled_length
+from .Ant import Ant
+from .AntPool import AntPool
+from .AntRandom import ant_rng
+from .AntSwarm import AntSwarm
 from .ACOSettings import ACOSettings
-
-def run_ant(ant):
-    return ant.run()
+from .CompiledGraph import CompiledGraph
+from .DeadendnessProvider import BetweennessDeadendness, DeadendnessProvider
+from .HeuristicTables import HeuristicTables
+from .LocalSearch import LocalSearch
+from .RunResult import RunResult
 
 class AntColony():
-    def __init__(self, network_graph: nx.MultiGraph, initial_settings: ACOSettings):
+    def __init__(self, network_graph: nx.MultiGraph, initial_settings: ACOSettings, mode="sequential",
+                 deadendness: DeadendnessProvider | None = None, instruments: Instruments | None = None, contract: bool = False):
         """
         Construct a new Ant Colony for holding the network graph and settings.
         Warning: the provided network graph is modified in place to include all sorts of attributes.
+        The mode picks how run_iteration runs the ants: "sequential", "vectorized", or "pool".
+        The deadendness provider picks how deadendness is measured (sampled betweenness by default).
+        Pass in some Instruments to get timings, counters, and per-iteration stats (see run_iteration).
+        With contract, the ants walk a graph with its pass-through chains contracted into super-edges (see map_data.ChainContraction),
+          keeping the start and goal nodes. It's faster on long chains, but the ants can't turn around partway along a chain,
+          so the routes (and their scores) can come out different. RunResults are still in terms of the original graph.
         """
         print("Ant Colony Algo Init")
+        self.instruments = instruments or NULL_INSTRUMENTS
+        self.run_modes = {
+            "sequential": self.run_sequential,
+            "vectorized": self.run_vectorized,
+            "pool": self.run_pool,
+        }
+        assert mode in self.run_modes, f"Unknown run mode {mode}"
+        self.mode = mode
+        self.pool = None
+        self.finish_nodes = set()
+        # Counts the times the ants have been sent out; together with the seed's entropy, it picks each ant's random stream
+        self.iteration = 0
         # Copy and unfreeze the input graph for modification
         self.network_graph = nx.MultiGraph(network_graph)
+        # With contraction, the uncontracted graph is kept around to contract again when the start or goals move
+        self.original_graph = None
+        if contract:
+            self.original_graph = self.network_graph
+            self.network_graph = contract_chains(self.original_graph, keep=[initial_settings.start_node, *initial_settings.goal_nodes])
 
-        print("Precomputing betweenness centrality")
         # Betweenness is used as a measure of how isolated a node is in the graph.
         # Isolated regions (like dead ends) tend to be overlooked by the algorithm
         #   because you generally have to travel them twice, in and out.
         # Deadendness is here to counteract that force and make sure you hit 
         #   dead ends the first time you go by them.
-        k=min(1000, len(self.network_graph.nodes))
-        self.betweenness_centrality = nx.betweenness_centrality(self.network_graph, weight='length', k=k)
-        nx.set_node_attributes(self.network_graph, self.betweenness_centrality, 'betweenness_centrality')
+        # If the graph already carries a betweenness_centrality (say, cached with the map), that gets used as-is.
+        nodes = self.network_graph.nodes
+        if deadendness is None and all('betweenness_centrality' in nodes[node] for node in nodes):
+            self.betweenness_centrality = dict(nodes(data='betweenness_centrality'))
+        else:
+            deadendness = deadendness or BetweennessDeadendness()
+            print(f"Precomputing {deadendness.name} deadendness")
+            with self.instruments.timer("deadendness"):
+                self.betweenness_centrality = deadendness.centrality(self.network_graph)
+            nx.set_node_attributes(self.network_graph, self.betweenness_centrality, 'betweenness_centrality')
+        nx.set_node_attributes(self.network_graph, {node: 1/1000*betweenness for node, betweenness in self.betweenness_centrality.items()}, 'deadendness')
+        if self.original_graph is not None:
+            # So nodes that come back out of a chain (when the start or goals move) keep what was worked out for them
+            for name in ('betweenness_centrality', 'deadendness'):
+                nx.set_node_attributes(self.original_graph, dict(self.network_graph.nodes(data=name, default=0)), name)
 
-        self.update_settings(initial_settings)
+        self.update_settings(initial_settings, initial=True)
 
         print("Ant Colony Algo Init Done")
 
-    def update_settings(self, new_settings: ACOSettings, initial=True):
+    def update_settings(self, new_settings: ACOSettings, initial=False):
+        """
+        Apply new settings, only redoing the precomputation that they actually affect.
+        Tweaking coefficients just rebuilds the affected heuristic tables; pheromones and ants are kept.
+        """
         print("Updating Settings and doing some precomputation")
-        reset_pheromones = initial
-        deadendness = {node: 1/1000*betweenness for node, betweenness in self.betweenness_centrality.items()}
-        nx.set_node_attributes(self.network_graph, deadendness, 'deadendness')
+        # Keep our own copy, so settings that are tweaked in place still register as changes next time
+        new_settings = replace(new_settings)
+        if initial or new_settings.seed != self.settings.seed:
+            # Without a seed, this comes up with some fresh entropy (which could be used to replay the run later)
+            self.entropy = np.random.SeedSequence(new_settings.seed).entropy
+            self.iteration = 0
 
-        # Add some fake nodes to the graph to represent "finishing" as an action
-        # This way, each ant can decide whether to finish at a goal node or keep going.
-        if initial or new_settings.goal_nodes != self.settings.goal_nodes:
-            # Find the lengths of shortest paths from any goal to any node in the graph.
-            # (Used as a more-accurate heuristic for the ant's goal-directedness)
-            lengths = nx.multi_source_dijkstra_path_length(self.network_graph, new_settings.goal_nodes, weight='length')
-            nx.set_node_attributes(self.network_graph, lengths, 'shortest_path_to_goal')
-            
-            # Deal with finish nodes
-            self.setup_finish_nodes(new_settings, initial)
-            # Changing finish nodes involves permuting the graph, so we need to reset pheromones
-            reset_pheromones = True
-
-        if initial or new_settings.num_ants != self.settings.num_ants:
-            # Instantiate some ants!
-            self.ants = [Ant(self.network_graph, new_settings) for _ in range(new_settings.num_ants)]
-
-        if reset_pheromones:
-            self.reset()
+        recontract = not initial and self.original_graph is not None and \
+            any(node not in self.network_graph for node in [new_settings.start_node, *new_settings.goal_nodes])
+        if recontract:
+            # The new start or goals were contracted away into a chain, so contract again keeping them
+            self.remove_finish_nodes()
+            self.network_graph = contract_chains(self.original_graph, keep=[new_settings.start_node, *new_settings.goal_nodes])
+
+        if initial or recontract or new_settings.goal_nodes != self.settings.goal_nodes:
+            self.setup_goals(new_settings)
+        else:
+            with self.instruments.timer("heuristic_tables"):
+                rebuilt = self.heuristic_tables.update(new_settings)
+            if rebuilt:
+                print(f"Rebuilt heuristic tables: {', '.join(rebuilt)}")
+            self.ants = self.ants[:new_settings.num_ants]
+            for ant in self.ants:
+                ant.update_settings(new_settings)
+            self.swarm.update_settings(new_settings)
+
+        # Instantiate some (more) ants!
+        while len(self.ants) < new_settings.num_ants:
+            self.ants.append(Ant(self.compiled_graph, new_settings, self.pheromone, self.heuristic_tables))
         self.settings = new_settings
         print("Settings updated")
 
-    def setup_finish_nodes(self, new_settings, initial):
-        if not initial:
-            for finish_node in self.finish_nodes:
-                self.network_graph.remove_node(finish_node)
-        node_count = self.network_graph.number_of_nodes()
-        self.finish_nodes = set()
+    def setup_goals(self, settings: ACOSettings):
+        """
+        Redo everything that depends on the goal nodes (or the shape of the graph).
+        This recompiles the graph, so pheromones are reset.
+        """
+        # Find the lengths of shortest paths from any goal to any node in the graph.
+        # (Used as a more-accurate heuristic for the ant's goal-directedness)
+        with self.instruments.timer("shortest_paths"):
+            lengths = nx.multi_source_dijkstra_path_length(self.network_graph, settings.goal_nodes, weight='length')
+        nx.set_node_attributes(self.network_graph, lengths, 'shortest_path_to_goal')
+
+        # Add some fake nodes to the graph to represent "finishing" as an action
+        # This way, each ant can decide whether to finish at a goal node or keep going.
+        self.setup_finish_nodes(settings)
+        # Changing finish nodes involves permuting the graph, so we need to recompile and reset pheromones
+        self.compile(settings)
+        self.reset()
+
+    def compile(self, settings: ACOSettings):
+        """
+        Compile the (fully attributed) network graph into flat arrays for the ants to walk,
+          and rebuild everything that depends on them.
+        Pheromones start over from scratch.
+        """
+        with self.instruments.timer("compile"):
+            self.compiled_graph = CompiledGraph(self.network_graph)
+        with self.instruments.timer("heuristic_tables"):
+            self.heuristic_tables = HeuristicTables(self.compiled_graph, settings)
+        # Pheromones live in a flat array indexed by edge id
+        self.pheromone = np.ones(self.compiled_graph.num_edges, dtype=float)
+        if self.mode == "pool":
+            # The pool's workers read the compiled graph and pheromones straight out of shared memory
+            self.close()
+            self.pool = AntPool(self.compiled_graph, self.pheromone)
+            self.pheromone = self.pool.pheromone
+        # The ants hold on to the old arrays, so out with the old ants
+        self.ants = []
+        # A whole swarm of ants, for the vectorized mode
+        self.swarm = AntSwarm(self.compiled_graph, settings, self.pheromone, self.heuristic_tables)
+        # Built the first time somebody asks for a local search
+        self.local_searcher = None
+
+    def setup_finish_nodes(self, new_settings):
+        self.remove_finish_nodes()
+        # Finish nodes get labels past any of the graph's own (integer) nodes, so they can't collide.
+        # That includes the nodes contracted away into chains, which show up again when routes are expanded.
+        nodes = original_nodes(self.network_graph) if self.network_graph.graph.get("contracted") else self.network_graph.nodes
+        node_count = max((node for node in nodes if isinstance(node, int)), default=-1) + 1
         for goal_node in new_settings.goal_nodes:
             self.network_graph.add_node(node_count, **self.network_graph.nodes[goal_node])
             self.network_graph.add_edge(goal_node, node_count, length=0, traveled=False)
@@ -74,21 +169,83 @@ class AntColony():
         self.network_graph.graph["finish_nodes"] = self.finish_nodes
         nx.set_node_attributes(self.network_graph, {node: (node in self.finish_nodes) for node in self.network_graph.nodes}, 'is_finish_node')
 
-    def reset(self):
-        nx.set_edge_attributes(self.network_graph, 1, 'pheromone')
+    def remove_finish_nodes(self):
+        self.network_graph.remove_nodes_from(self.finish_nodes)
+        self.finish_nodes = set()
+
+    def apply_map_update(self, update):
+        """
+        Patch the colony with a refreshed Wandrer export (see map_data.MapUpdate.update_map),
+          redoing only the precomputation that depends on what actually changed.
+        """
+        print(f"Applying {update}")
+        if not update.structural():
+            # Only traveled statuses flipped. The heuristic tables, finish nodes, and shortest paths
+            #   don't depend on those, so just patch the traveled flags and keep everything else (pheromones included).
+            if self.original_graph is not None:
+                # The update is in terms of original edges, which live on as segments of the super-edges
+                update.apply(self.original_graph)
+                changed_keys = apply_traveled_changes(self.network_graph, update.traveled_changed)
+            else:
+                update.apply(self.network_graph)
+                changed_keys = {(u, v, key) for u, v, key, _ in update.traveled_changed}
+            edge_index = self.compiled_graph.edge_index
+            edges = sorted({edge_index[key] for key in changed_keys if key in edge_index})
+            if edges:
+                edge_data = [self.network_graph.edges[self.compiled_graph.edge_keys[e]] for e in edges]
+                self.compiled_graph.set_traveled(edges, [data['traveled'] for data in edge_data], [untraveled_length(data) for data in edge_data])
+            if self.pool is not None:
+                self.pool.refresh_graph()
+        else:
+            # Edges came or went, so the graph needs recompiling (along with the goal precomputation).
+            # The pheromones of edges that are still around are kept; new edges start fresh.
+            old_edge_index = self.compiled_graph.edge_index
+            old_pheromone = self.pheromone.copy()
+            # The finish nodes go first, so their labels can't clash with any new nodes
+            self.remove_finish_nodes()
+            if self.original_graph is not None:
+                # (Super-edges whose chains changed get new keys, so they start fresh too)
+                update.apply(self.original_graph)
+                self.network_graph = contract_chains(self.original_graph, keep=[self.settings.start_node, *self.settings.goal_nodes])
+            else:
+                update.apply(self.network_graph)
+            # New nodes don't have a betweenness centrality (deadendness) yet, so they get none
+            self.setup_goals(self.settings)
+            for e, key in enumerate(self.compiled_graph.edge_keys):
+                if key in old_edge_index:
+                    self.pheromone[e] = old_pheromone[old_edge_index[key]]
+            while len(self.ants) < self.settings.num_ants:
+                self.ants.append(Ant(self.compiled_graph, self.settings, self.pheromone, self.heuristic_tables))
+        print("Map update applied")
+
+    def reset(self, level: float = 1):
+        # In place, since the ants (and maybe some worker processes) share this array
+        self.pheromone.fill(level)
 
     def run_pool(self):
         # Run all the ants in parallel
-        # Ah, the joys of sidestepping the GIL... 
-        # our dandy graph will be copied to each process, but I'm sure we'll have plenty of memory
-        with multiprocessing.Pool() as pool:
-            results = pool.map(Ant.run, self.ants)
-        # TODO: As usual with parallelism, I need to see if this even helps!
-        return results
-    
+        # Ah, the joys of sidestepping the GIL...
+        # The graph lives in shared memory, so only the settings go out and only the routes come back
+        return self.pool.run(self.settings, len(self.ants), self.entropy, self.iteration)
+
+    def close(self):
+        """Shut down the worker pool (if any)"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool = None
+
     def run_sequential(self):
-        results = [ant.run() for ant in self.ants]
-        return results
+        graph = self.compiled_graph
+        start_node = graph.node_index[self.settings.start_node]
+        walks = [ant.walk(start_node, ant_rng(self.entropy, self.iteration, i)) for i, ant in enumerate(self.ants)]
+        return [graph.make_result(*walk) for walk in walks]
+
+    def run_vectorized(self):
+        # All the ants step together, so the per-step overhead is paid once per colony instead of once per ant
+        graph = self.compiled_graph
+        rngs = [ant_rng(self.entropy, self.iteration, i) for i in range(len(self.ants))]
+        walks = self.swarm.walk(graph.node_index[self.settings.start_node], len(self.ants), rngs)
+        return [graph.make_result(*walk) for walk in walks]
 
     def score(self, route_result: RunResult):
         """Every good optimisation algorithm needs a good objective function."""
@@ -96,17 +253,59 @@ class AntColony():
         # I'll add deadend, regions, etc later.
         return route_result.newly_traveled_length
 
+    def run_ants(self):
+        """Send every ant out once (however the mode says to) and return their RunResults"""
+        with self.instruments.timer("run_ants"):
+            results = self.run_modes[self.mode]()
+        self.iteration += 1
+        if self.instruments.enabled:
+            self.instruments.count("ant_steps", sum(len(result.edge_path) for result in results))
+            # (Pool workers don't report back how many choices they made)
+            if self.mode == "sequential":
+                self.instruments.count("desireability_evaluations", sum(ant.desireability_evaluations for ant in self.ants))
+            elif self.mode == "vectorized":
+                self.instruments.count("desireability_evaluations", self.swarm.desireability_evaluations)
+        return results
+
+    def local_search(self, route_result: RunResult):
+        """A touched-up copy of a route (see LocalSearch), which never scores worse"""
+        if self.local_searcher is None:
+            self.local_searcher = LocalSearch(self.compiled_graph)
+        graph = self.compiled_graph
+        walk = self.local_searcher.improve(graph.node_index[self.settings.start_node], route_result.edge_path, self.settings.target_length)
+        return graph.make_result(*walk)
+
+    def record_iteration(self, results: list[RunResult], scores: np.ndarray, **extra):
+        """Send an iteration's stats (scores, and route lengths vs the target) to the instruments, if they're on"""
+        if not self.instruments.enabled or len(results) == 0:
+            return
+        lengths = np.array([result.total_length for result in results], dtype=float)
+        self.instruments.emit("aco_iteration", iteration=self.iteration, num_ants=len(results),
+                              best_score=float(scores.max()), mean_score=float(scores.mean()), std_score=float(scores.std()),
+                              mean_length=float(lengths.mean()), min_length=float(lengths.min()), max_length=float(lengths.max()),
+                              target_length=self.settings.target_length, **extra)
+
+    def evaporate(self):
+        # In place, since the ants (and maybe some worker processes) share this array
+        self.pheromone *= (1-self.settings.evaporation)
+
+    def deposit(self, results: list[RunResult], amounts):
+        """Deposit each amount once on every edge its route traveled"""
+        if results:
+            edges = [result.edge_ids for result in results]
+            np.add.at(self.pheromone, np.concatenate(edges), np.repeat(np.asarray(amounts, dtype=float), [len(e) for e in edges]))
+
     def run_iteration(self):
-        results = self.run_sequential()
-        scores = [self.score(result) for result in results]
-
-        # Evaporation!
-        for edge in self.network_graph.edges:
-            self.network_graph.edges[edge]['pheromone'] *= (1-self.settings.evaporation)
-        
-        # Insert elitism here... for now, just apply a simple pheromone update
-        for result, score in zip(results, scores):
-            for edge in result.traveled_edges:
-                self.network_graph.edges[edge]['pheromone'] += score
+        results = self.run_ants()
+        scores = np.array([self.score(result) for result in results], dtype=float)
+
+        with self.instruments.timer("pheromone_update"):
+            # Evaporation!
+            self.evaporate()
+
+            # A simple pheromone update: each ant deposits its score once on every edge it traveled
+            # (ColonyOptimizer does elitist and Max-Min updates instead)
+            self.deposit(results, scores)
 
+        self.record_iteration(results, scores)
         return results
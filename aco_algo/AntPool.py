@@ -0,0 +1,105 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+import weakref
+
+import numpy as np
+
+from .ACOSettings import ACOSettings
+from .Ant import Ant
+from .AntRandom import ant_rng
+from .CompiledGraph import CompiledGraph
+from .HeuristicTables import HeuristicTables
+
+# Per-process state for pool workers, set up once by init_worker
+worker_graph = None
+worker_pheromone = None
+worker_tables = None
+worker_blocks = []
+
+
+def share_array(array: np.ndarray):
+    """Copy an array into a new shared memory block. Returns the block and a view of the array living in it."""
+    block = SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return block, shared
+
+def attach_array(spec):
+    """Attach to an array shared by share_array, given its (block name, dtype, shape)"""
+    name, dtype, shape = spec
+    # The parent owns (and unlinks) the block. Workers share the parent's resource tracker,
+    #   so attaching here doesn't hand the cleanup to anyone else.
+    block = SharedMemory(name=name)
+    worker_blocks.append(block) # Keep the block open as long as the worker lives
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+def init_worker(graph_specs, pheromone_spec):
+    global worker_graph, worker_pheromone
+    worker_graph = CompiledGraph.from_arrays({name: attach_array(spec) for name, spec in graph_specs.items()})
+    worker_pheromone = attach_array(pheromone_spec)
+
+def run_ants(settings: ACOSettings, start_node: int, ants: range, entropy: int, iteration: int):
+    """
+    Runs a batch of ants in a worker. Only the compact route/edge arrays make the trip back to the parent.
+    Each ant gets the same random stream it would get in any other mode (see AntRandom.ant_rng).
+    """
+    global worker_tables
+    # Each worker keeps its own heuristic tables, which only need rebuilding when the settings change
+    if worker_tables is None:
+        worker_tables = HeuristicTables(worker_graph, settings)
+    else:
+        worker_tables.update(settings)
+    ant = Ant(worker_graph, settings, worker_pheromone, worker_tables)
+    return [ant.walk(start_node, ant_rng(entropy, iteration, i)) for i in ants]
+
+def release(pool, blocks):
+    pool.terminate()
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class AntPool():
+    def __init__(self, compiled_graph: CompiledGraph, pheromone: np.ndarray, processes: int | None = None):
+        """
+        A persistent pool of worker processes for running ants in parallel.
+        The (read-only) compiled graph arrays and the pheromone array are put in shared memory once,
+          so nothing big is pickled per task. The pool stays alive across iterations.
+        Pheromone updates should be written to self.pheromone (in place), which the workers see directly.
+        """
+        self.compiled_graph = compiled_graph
+        self.processes = processes or multiprocessing.cpu_count()
+        self.blocks = []
+
+        graph_specs = {}
+        self.graph_arrays = {}
+        for name, array in compiled_graph.arrays().items():
+            block, self.graph_arrays[name] = share_array(array)
+            self.blocks.append(block)
+            graph_specs[name] = (block.name, array.dtype, array.shape)
+        block, self.pheromone = share_array(pheromone)
+        self.blocks.append(block)
+        pheromone_spec = (block.name, pheromone.dtype, pheromone.shape)
+
+        self.pool = multiprocessing.Pool(self.processes, initializer=init_worker, initargs=(graph_specs, pheromone_spec))
+        # Make sure the workers and shared memory get cleaned up, even if close() is never called
+        self.finalizer = weakref.finalize(self, release, self.pool, self.blocks)
+
+    def run(self, settings: ACOSettings, num_ants: int, entropy: int, iteration: int):
+        graph = self.compiled_graph
+        start_node = graph.node_index[settings.start_node]
+        # Split the ants into one batch per worker to keep the task overhead down
+        batches = [range(batch[0], batch[-1] + 1) for batch in np.array_split(np.arange(num_ants), self.processes) if len(batch) > 0]
+        walks = self.pool.starmap(run_ants, [(settings, start_node, batch, entropy, iteration) for batch in batches])
+        return [graph.make_result(*walk) for batch in walks for walk in batch]
+
+    def refresh_graph(self):
+        """
+        Copy the compiled graph's arrays back into shared memory after it's been patched in place
+          (e.g. traveled statuses changing). The shapes have to stay the same - otherwise, make a new pool.
+        """
+        for name, array in self.compiled_graph.arrays().items():
+            self.graph_arrays[name][...] = array
+
+    def close(self):
+        self.finalizer()
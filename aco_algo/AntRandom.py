@@ -0,0 +1,46 @@
+import numpy as np
+
+# How many uniforms an ant pulls from its generator at a time
+UNIFORM_BATCH = 256
+
+
+def ant_rng(entropy: int, iteration: int, ant: int):
+    """
+    The random generator for one ant's walk in one iteration.
+    It only depends on the colony's entropy and the (iteration, ant) pair, not on which process (or mode) runs the ant,
+      so a seeded colony replays the same walks whether it runs sequentially, vectorized, or in a pool.
+    """
+    return np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(iteration, ant)))
+
+
+class UniformStream():
+    """Uniforms from a Generator, pulled in batches so that each draw is an array lookup instead of a Generator call"""
+    def __init__(self, rng: np.random.Generator):
+        self.rng = rng
+        self.uniforms = rng.random(UNIFORM_BATCH)
+        self.index = 0
+
+    def next(self):
+        if self.index == UNIFORM_BATCH:
+            self.uniforms = self.rng.random(UNIFORM_BATCH)
+            self.index = 0
+        uniform = self.uniforms[self.index]
+        self.index += 1
+        return uniform
+
+
+class UniformStreams():
+    """One UniformStream per ant, for a whole swarm at once (one row of uniforms per ant)"""
+    def __init__(self, rngs: list[np.random.Generator]):
+        self.rngs = rngs
+        self.uniforms = np.array([rng.random(UNIFORM_BATCH) for rng in rngs]).reshape(len(rngs), UNIFORM_BATCH)
+        self.index = np.zeros(len(rngs), dtype=np.int64)
+
+    def next(self, ants: np.ndarray):
+        """Draw the next uniform for each of the given ants"""
+        for ant in ants[self.index[ants] == UNIFORM_BATCH]:
+            self.uniforms[ant] = self.rngs[ant].random(UNIFORM_BATCH)
+            self.index[ant] = 0
+        uniforms = self.uniforms[ants, self.index[ants]]
+        self.index[ants] += 1
+        return uniforms
@@ -0,0 +1,184 @@
+from .ACOSettings import ACOSettings
+from .AntRandom import UniformStreams
+from .CompiledGraph import CompiledGraph
+from .HeuristicTables import HeuristicTables
+import numpy as np
+
+
+class AntSwarm:
+    def __init__(self, compiled_graph: CompiledGraph, settings: ACOSettings, pheromone: np.ndarray, heuristic_tables: HeuristicTables | None = None):
+        """
+        A whole colony's worth of ants, advanced together in lockstep.
+        Instead of each ant doing a tiny NumPy computation per step (which is basically all overhead),
+          the positions, lengths, and traveled edges of every ant are kept in arrays and each step
+          evaluates desireabilities and samples the next edge for all unfinished ants at once.
+        Follows the same rules as Ant.run, so the results are interchangeable.
+        """
+        self.compiled_graph = compiled_graph
+        self.pheromone = pheromone
+        self.heuristic_tables = heuristic_tables or HeuristicTables(compiled_graph, settings)
+        self.desireability_evaluations = 0
+        self.update_settings(settings)
+
+    def update_settings(self, settings: ACOSettings):
+        self.settings = settings
+        self.gohome_trigger = self.settings.gohome_start_coeff * self.settings.target_length
+
+    def run(self, num_ants: int | None = None):
+        graph = self.compiled_graph
+        return [graph.make_result(*walk) for walk in self.walk(graph.node_index[self.settings.start_node], num_ants)]
+
+    def walk(self, start_node: int, num_ants: int | None = None, rngs: list[np.random.Generator] | None = None):
+        """
+        Does the actual walking from the given start node index, like Ant.walk (but for all the ants at once).
+        Each ant makes its choices with its own rng (see AntRandom.ant_rng), drawing one uniform per choice just like Ant.walk.
+        Returns a (route, edge path, total length, newly traveled length) tuple per ant, in node indices and edge ids.
+        """
+        graph = self.compiled_graph
+        num_ants = self.settings.num_ants if num_ants is None else num_ants
+        if rngs is None:
+            rngs = [np.random.default_rng(seed) for seed in np.random.SeedSequence().spawn(num_ants)]
+        self.uniforms = UniformStreams(rngs)
+        # How many desireability rows the last walk worked out (for the colony's instruments)
+        self.desireability_evaluations = 0
+
+        self.positions = np.full(num_ants, start_node, dtype=np.int64)
+        self.total_lengths = np.zeros(num_ants, dtype=float)
+        self.newly_traveled_lengths = np.zeros(num_ants, dtype=float)
+        self.num_steps = np.zeros(num_ants, dtype=np.int64)
+        # One row of traveled flags per ant (a bitset over edge ids)
+        self.traveled_mask = np.zeros((num_ants, graph.num_edges), dtype=bool)
+
+        # The ants that haven't finished yet, and a log of (ant, node, edge) for every step taken
+        active = np.arange(num_ants) if not graph.is_finish_node[start_node] else np.arange(0)
+        step_log = []
+        while len(active) > 0:
+            slots, valid = self.outgoing_slots(active)
+            num_options = valid.sum(axis=1)
+            edges = graph.edge_ids[slots]
+            traveled_lads = (graph.slot_traveled[slots] | self.traveled_mask[active[:, None], edges]) & valid
+
+            # If we go down a dead end, the only way out is back the way we came!
+            # Those ants skip the desireability calculation and sampling.
+            choices = np.argmax(valid, axis=1)
+            choosy = np.flatnonzero(num_options > 1)
+            self.desireability_evaluations += len(choosy)
+            if len(choosy) > 0:
+                desireabilities = self.desireabilities(active[choosy], slots[choosy], valid[choosy], traveled_lads[choosy])
+                choices[choosy] = self.sample(desireabilities, self.uniforms.next(active[choosy]), valid[choosy])
+
+            rows = np.arange(len(active))
+            chosen_slots = slots[rows, choices]
+            chosen_edges = edges[rows, choices]
+            traveled = traveled_lads[rows, choices]
+            lengths = graph.slot_length[chosen_slots]
+
+            self.positions[active] = graph.neighbors[chosen_slots]
+            self.traveled_mask[active, chosen_edges] = True
+            self.total_lengths[active] += lengths
+            self.newly_traveled_lengths[active] += np.where(traveled, 0, graph.slot_untraveled_length[chosen_slots])
+            self.num_steps[active] += 1
+            step_log.append((active, self.positions[active], chosen_edges))
+
+            # Finished ants are masked out of the next step
+            active = active[~graph.is_finish_node[self.positions[active]]]
+
+        return self.walks(start_node, step_log)
+
+    def outgoing_slots(self, active: np.ndarray):
+        """
+        Returns a (num_active, max_degree) matrix of outgoing slots for the given ants, padded with slot 0,
+          and a matching mask of which entries are real (and allowed) options.
+        """
+        graph = self.compiled_graph
+        positions = self.positions[active]
+        starts = graph.offsets[positions]
+        degrees = graph.offsets[positions + 1] - starts
+        columns = np.arange(degrees.max())
+        valid = columns[None, :] < degrees[:, None]
+        slots = np.where(valid, starts[:, None] + columns[None, :], 0)
+
+        # If we're just starting out, don't allow our poor ants to immediately finish
+        starting = self.num_steps[active] <= 1
+        if np.any(starting):
+            valid &= ~(graph.slot_is_finish[slots] & starting[:, None])
+        return slots, valid
+
+    def desireabilities(self, ants: np.ndarray, slots: np.ndarray, valid: np.ndarray, traveled_lads: np.ndarray):
+        """
+        Batched version of Ant.desireabilities. Each row is one ant's outgoing options.
+        Padding entries get a desireability of 0.
+        """
+        graph = self.compiled_graph
+        heuristics = np.zeros(shape=slots.shape, dtype=float)
+        total_lengths = self.total_lengths[ants][:, None]
+
+        directional = self.settings.directional_coeff > 0
+        gohome = self.settings.gohome_boost > 0 and np.any(total_lengths > self.gohome_trigger)
+
+        if gohome or directional:
+            to_goal = graph.slot_to_goal[slots]
+            lengths = graph.slot_length[slots]
+            # See Ant.desireabilities for the reasoning behind these boosts.
+            # The mean and std are taken over each ant's real options only.
+            # Padding entries can produce nans/infs here, but they're masked out at the end.
+            with np.errstate(invalid='ignore', divide='ignore', over='ignore'):
+                if directional:
+                    remaining_dists = np.maximum(self.settings.target_length - total_lengths - lengths, 0)
+                    dist_diffs = np.abs(remaining_dists - to_goal)
+                    num_options = valid.sum(axis=1, keepdims=True)
+                    mean = np.where(valid, dist_diffs, 0).sum(axis=1, keepdims=True) / num_options
+                    std = np.sqrt(np.where(valid, (dist_diffs - mean)**2, 0).sum(axis=1, keepdims=True) / num_options)
+                    dist_diffs_norm = np.where(std > 0, (dist_diffs - mean) / std, 0)
+                    dist_diffs_sig = 1 / (1 + np.exp(dist_diffs_norm * self.settings.directional_choosiness))
+                    heuristics += dist_diffs_sig * self.settings.directional_coeff
+
+                if gohome:
+                    # Only ants that are past the trigger get the boost
+                    going_home = total_lengths > self.gohome_trigger
+                    shortened_diffs = to_goal - (self.gohome_trigger - total_lengths - lengths)
+                    max_diffs = np.where(valid, shortened_diffs, -np.inf).max(axis=1, keepdims=True)
+                    heuristics += np.where(going_home, (shortened_diffs - max_diffs)**2 * self.settings.gohome_boost, 0)
+
+        heuristics += self.heuristic_tables.static_heuristics(slots, traveled_lads)
+
+        pheromones = self.pheromone[graph.edge_ids[slots]]
+
+        desireabilities = pheromones**self.settings.pheromone_weight * \
+            heuristics**self.settings.heuristic_weight * \
+            (1 - traveled_lads * self.settings.traveled_discount)
+        return np.where(valid, desireabilities, 0)
+
+    def sample(self, desireabilities: np.ndarray, uniforms: np.ndarray, valid: np.ndarray):
+        """
+        Batched categorical sampling: one uniform per row, searched against the row's cumulative desireabilities.
+        valid masks out the padding (and disallowed) options, like the slots Ant.walk leaves out.
+        """
+        cdf = np.cumsum(desireabilities, axis=1)
+        # The first option whose cumulative desireability passes the uniform, like the np.searchsorted in Ant.walk
+        above = cdf > uniforms[:, None] * cdf[:, -1:]
+        # If none do (say, every option has a desireability of 0), fall back to the last valid option,
+        #   same as Ant.walk's clamp to its last outgoing slot. Never a padding slot or a masked-out finish.
+        last_options = valid.shape[1] - 1 - np.argmax(valid[:, ::-1], axis=1)
+        return np.where(above.any(axis=1), np.argmax(above, axis=1), last_options)
+
+    def walks(self, start_node: int, step_log: list):
+        """Untangle the step log into one walk per ant"""
+        num_ants = len(self.positions)
+        if step_log:
+            ants = np.concatenate([step[0] for step in step_log])
+            nodes = np.concatenate([step[1] for step in step_log])
+            edges = np.concatenate([step[2] for step in step_log])
+        else:
+            ants = nodes = edges = np.zeros(0, dtype=np.int64)
+        # A stable sort keeps each ant's steps in order
+        order = np.argsort(ants, kind='stable')
+        splits = np.cumsum(self.num_steps)[:-1]
+        ant_nodes = np.split(nodes[order], splits)
+        ant_edges = np.split(edges[order], splits)
+
+        walks = []
+        for i in range(num_ants):
+            route = np.concatenate(([start_node], ant_nodes[i]))
+            walks.append((route, ant_edges[i], float(self.total_lengths[i]), float(self.newly_traveled_lengths[i])))
+        return walks
@@ -0,0 +1,162 @@
+import time
+
+import numpy as np
+
+from .AntColony import AntColony
+from .OptimizerSettings import OptimizerSettings
+from .RunResult import RunResult
+
+
+class ColonyOptimizer():
+    def __init__(self, colony: AntColony, settings: OptimizerSettings | None = None):
+        """
+        Drives an AntColony iteration by iteration with a Max-Min Ant System style update
+          (see https://staff.washington.edu/paymana/swarm/stutzle99-eaecs.pdf):
+        only the best routes deposit pheromone, pheromones are kept between a max and a min
+          so no edge is ever completely ruled out, and the pheromones start over when the colony stagnates.
+        Keeps track of the best route found, and decides when it's not worth running any more iterations.
+        With settings.local_search, each iteration's best few routes are touched up (see LocalSearch) before they're compared and deposited,
+          and the time that takes is reported in the iteration stats separately from the ants'.
+        """
+        self.colony = colony
+        self.settings = settings or OptimizerSettings()
+        assert self.settings.deposit in ("all", "iteration_best", "global_best", "elitist"), f"Unknown deposit strategy {self.settings.deposit}"
+        self.reset()
+
+    def reset(self):
+        """Forget the best route and start the pheromones over"""
+        self.best_result: RunResult | None = None
+        self.best_score = float("-inf")
+        # The best score after each iteration
+        self.history = []
+        self.iteration = 0
+        self.last_improvement = 0
+        self.restarts = 0
+        self.restart_iteration = 0
+        self.start_time = time.monotonic()
+        self.colony.reset(self.pheromone_max())
+
+    def pheromone_max(self):
+        # Deposits are scaled so that the best route so far deposits 1.
+        # Evaporating and depositing that every iteration converges to 1/evaporation.
+        return 1 / self.colony.settings.evaporation
+
+    def pheromone_min(self):
+        """
+        The lower bound from the paper: low enough that a converged colony builds the best route with probability p_best,
+          where each of the route's n choices is between avg options.
+        """
+        pheromone_max = self.pheromone_max()
+        if self.best_result is None or len(self.best_result.edge_path) == 0:
+            return 0
+        # Roads don't branch much, so the average number of options is just the average degree
+        avg_options = np.mean(np.diff(self.colony.compiled_graph.offsets))
+        if avg_options <= 1:
+            return 0
+        p_dec = self.settings.p_best ** (1 / len(self.best_result.edge_path))
+        return min(pheromone_max * (1 - p_dec) / ((avg_options - 1) * p_dec), pheromone_max)
+
+    def step(self):
+        """Run one iteration of the colony and update the pheromones. Returns the ants' RunResults."""
+        colony = self.colony
+        results = colony.run_ants()
+        scores = np.array([colony.score(result) for result in results], dtype=float)
+        self.iteration += 1
+        local_search_stats = self.local_search(results, scores) if self.settings.local_search > 0 else {}
+
+        if len(results) > 0:
+            iteration_best = int(np.argmax(scores))
+            if scores[iteration_best] > self.best_score:
+                self.best_result = results[iteration_best]
+                self.best_score = float(scores[iteration_best])
+                self.last_improvement = self.iteration
+
+        with colony.instruments.timer("pheromone_update"):
+            colony.evaporate()
+            if self.best_score > 0:
+                depositors, amounts = self.depositors(results, scores)
+                colony.deposit(depositors, np.asarray(amounts) / self.best_score)
+            if self.settings.bounded:
+                np.clip(colony.pheromone, self.pheromone_min(), self.pheromone_max(), out=colony.pheromone)
+
+        stagnation = self.settings.stagnation_iterations
+        if stagnation and self.iteration - max(self.last_improvement, self.restart_iteration) >= stagnation:
+            # Stuck! Start the pheromones over, but keep the best route around
+            colony.reset(self.pheromone_max())
+            self.restarts += 1
+            self.restart_iteration = self.iteration
+
+        self.history.append(self.best_score)
+        colony.record_iteration(results, scores, global_best_score=self.best_score, restarts=self.restarts, **local_search_stats)
+        return results
+
+    def local_search(self, results: list[RunResult], scores: np.ndarray):
+        """Touch up the iteration's best routes in place (results and scores both). Returns the stage's stats."""
+        start = time.perf_counter()
+        gain = 0
+        with self.colony.instruments.timer("local_search"):
+            for i in np.argsort(-scores)[:self.settings.local_search].tolist():
+                improved = self.colony.local_search(results[i])
+                score = self.colony.score(improved)
+                if score > scores[i]:
+                    gain += score - scores[i]
+                    results[i] = improved
+                    scores[i] = score
+        return {"local_search_time": time.perf_counter() - start, "local_search_gain": float(gain)}
+
+    def inject(self, result: RunResult):
+        """
+        Hand the colony a route that was found somewhere else (like another island, see IslandColonies).
+        It deposits pheromone like the global best would, and becomes the global best if it beats ours.
+        """
+        colony = self.colony
+        score = colony.score(result)
+        if score > self.best_score:
+            self.best_result = result
+            self.best_score = float(score)
+            self.last_improvement = self.iteration
+        if self.best_score > 0:
+            colony.deposit([result], [score / self.best_score])
+        if self.settings.bounded:
+            np.clip(colony.pheromone, self.pheromone_min(), self.pheromone_max(), out=colony.pheromone)
+
+    def depositors(self, results: list[RunResult], scores: np.ndarray):
+        """The routes that get to deposit pheromone this iteration, and how much (in raw score) each deposits"""
+        deposit = self.settings.deposit
+        if deposit == "all" or len(results) == 0:
+            return results, scores
+        iteration_best = int(np.argmax(scores))
+        if deposit == "iteration_best":
+            return [results[iteration_best]], [scores[iteration_best]]
+        if deposit == "global_best":
+            return [self.best_result], [self.best_score]
+        # Elitist
+        return [results[iteration_best], self.best_result], [scores[iteration_best], self.best_score * self.settings.elitist_weight]
+
+    def converged(self):
+        """Whether the best route has stopped getting (meaningfully) better"""
+        window = self.settings.convergence_iterations
+        if window <= 0 or len(self.history) <= window:
+            return False
+        if self.best_score <= 0:
+            # Nothing new within reach (say, everything's traveled), so there's no relative threshold to go by.
+            # Not improving at all over the window counts as converged, or this would never stop.
+            return self.history[-1] <= self.history[-1 - window]
+        improvement = self.history[-1] - self.history[-1 - window]
+        return improvement < self.settings.convergence_threshold * self.best_score
+
+    def done(self):
+        """Whether it's time to stop: converged, or out of iterations or time"""
+        settings = self.settings
+        if settings.max_iterations is not None and self.iteration >= settings.max_iterations:
+            return True
+        if settings.time_budget is not None and time.monotonic() - self.start_time >= settings.time_budget:
+            return True
+        return self.converged()
+
+    def run(self):
+        """Iterate until done, then return the best route found. The time budget counts from here."""
+        self.start_time = time.monotonic()
+        while not self.done():
+            self.step()
+        return self.best_result
@@ -0,0 +1,149 @@
+import networkx as nx
+import numpy as np
+
+from map_data.ChainContraction import orient_chain, untraveled_length
+from .RunResult import RunResult
+
+
+class CompiledGraph():
+    """
+    A compact, array-backed (CSR) copy of the colony's network graph.
+    The networkx graph is still the source of truth - this is just a read-only snapshot that ants can walk
+      without poking at attribute dicts on every single step.
+
+    Nodes and edges are renumbered with contiguous indices:
+    - node_ids[i] is the networkx node for node index i
+    - edge_keys[e] is the networkx (u, v, key) tuple for edge id e
+    - The outgoing "slots" of node i are offsets[i]:offsets[i+1]. Each slot is one half of an undirected edge,
+        with neighbors[slot] being the node at the other end and edge_ids[slot] being the (shared) edge id.
+    Slots are laid out in the same order that network_graph.edges(node) would return them.
+    """
+    def __init__(self, network_graph: nx.MultiGraph):
+        self.node_ids = np.empty(network_graph.number_of_nodes(), dtype=object)
+        self.node_ids[:] = list(network_graph.nodes)
+        self.node_index = {node: i for i, node in enumerate(self.node_ids)}
+        self.num_nodes = len(self.node_ids)
+
+        self.edge_keys = list(network_graph.edges(keys=True))
+        self.num_edges = len(self.edge_keys)
+        # Look up edge ids by (u, v, key), in either direction
+        self.edge_index = {}
+        for e, (u, v, k) in enumerate(self.edge_keys):
+            self.edge_index[(u, v, k)] = e
+            self.edge_index[(v, u, k)] = e
+
+        # Build the CSR arrays in adjacency order
+        self.offsets = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        neighbors, edge_ids = [], []
+        for i, node in enumerate(self.node_ids):
+            for nbr, keydict in network_graph.adj[node].items():
+                for key in keydict:
+                    neighbors.append(self.node_index[nbr])
+                    edge_ids.append(self.edge_index[(node, nbr, key)])
+            self.offsets[i + 1] = len(neighbors)
+        self.neighbors = np.array(neighbors, dtype=np.int64)
+        self.edge_ids = np.array(edge_ids, dtype=np.int64)
+
+        # Edge attributes (indexed by edge id)
+        edge_data = [data for _, _, _, data in network_graph.edges(keys=True, data=True)]
+        self.length = np.array([data['length'] for data in edge_data], dtype=float)
+        self.traveled = np.array([data['traveled'] for data in edge_data], dtype=bool)
+        # Super-edges from a contracted graph can be part traveled, so the new length an edge is worth is kept separately
+        self.untraveled_length = np.array([untraveled_length(data) for data in edge_data], dtype=float)
+        # The original nodes and edges behind each super-edge (None for plain edges), for expanding routes back out
+        self.edge_chains = [data.get('chain_nodes') for data in edge_data]
+        self.edge_chain_edges = [data.get('chain_edges') for data in edge_data]
+        self.contracted = any(chain is not None for chain in self.edge_chains)
+
+        # Node attributes (indexed by node index)
+        # Nodes that can't reach a goal don't get a shortest path, so they're infinitely far away.
+        nodes = network_graph.nodes
+        self.shortest_path_to_goal = np.array([nodes[n].get('shortest_path_to_goal', np.inf) for n in self.node_ids], dtype=float)
+        self.deadendness = np.array([nodes[n].get('deadendness', 0) for n in self.node_ids], dtype=float)
+        self.is_finish_node = np.array([nodes[n].get('is_finish_node', False) for n in self.node_ids], dtype=bool)
+
+        self.build_slot_attributes()
+
+    # The arrays an ant needs to walk the graph (everything except the networkx node/edge labels)
+    walk_arrays = ["offsets", "neighbors", "edge_ids", "length", "traveled", "untraveled_length", "shortest_path_to_goal", "deadendness", "is_finish_node",
+                   "slot_length", "slot_traveled", "slot_untraveled_length", "slot_to_goal", "slot_deadendness", "slot_is_finish"]
+
+    def arrays(self):
+        """Returns the walkable arrays by name, e.g. for putting them in shared memory"""
+        return {name: getattr(self, name) for name in self.walk_arrays}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]):
+        """
+        Rebuild a walkable compiled graph from the output of arrays().
+        The result has no networkx labels, so it can walk but it can't make RunResults.
+        """
+        graph = cls.__new__(cls)
+        for name in cls.walk_arrays:
+            setattr(graph, name, arrays[name])
+        graph.node_ids = None
+        graph.node_index = None
+        graph.edge_keys = None
+        graph.edge_index = None
+        graph.edge_chains = None
+        graph.edge_chain_edges = None
+        graph.contracted = False
+        graph.num_nodes = len(graph.offsets) - 1
+        graph.num_edges = len(graph.length)
+        return graph
+
+    def build_slot_attributes(self):
+        """
+        Gather the per-edge and per-node attributes into per-slot arrays,
+        so a step only needs one slice per attribute instead of a double lookup.
+        """
+        self.slot_length = self.length[self.edge_ids]
+        self.slot_traveled = self.traveled[self.edge_ids]
+        self.slot_untraveled_length = self.untraveled_length[self.edge_ids]
+        self.slot_to_goal = self.shortest_path_to_goal[self.neighbors]
+        self.slot_deadendness = self.deadendness[self.neighbors]
+        self.slot_is_finish = self.is_finish_node[self.neighbors]
+
+    def set_traveled(self, edges, traveled, untraveled_length=None):
+        """
+        Patch the traveled status of some edges (by edge id) in place.
+        Super-edges can be part traveled, so pass their untraveled lengths (see ChainContraction.apply_traveled_changes);
+          without them, edges count as all traveled or all untraveled.
+        """
+        self.traveled[edges] = traveled
+        self.untraveled_length[edges] = np.where(traveled, 0, self.length[edges]) if untraveled_length is None else untraveled_length
+        self.slot_traveled[:] = self.traveled[self.edge_ids]
+        self.slot_untraveled_length[:] = self.untraveled_length[self.edge_ids]
+
+    def outgoing(self, node: int):
+        """Returns the slice of slots going out from the given node index"""
+        return slice(self.offsets[node], self.offsets[node + 1])
+
+    def nodes_to_ids(self, route):
+        """Map a sequence of node indices back to networkx nodes"""
+        return self.node_ids[np.asarray(route, dtype=np.int64)].tolist()
+
+    def edges_to_keys(self, edges):
+        """Map a collection of edge ids back to networkx (u, v, key) tuples (the original edges, for a contracted graph)"""
+        if not self.contracted:
+            return {self.edge_keys[e] for e in edges}
+        keys = set()
+        for e in edges:
+            keys.update(self.edge_chain_edges[e] or [self.edge_keys[e]])
+        return keys
+
+    def route_to_ids(self, route, edge_path):
+        """Map a walk back to networkx nodes, expanding any super-edges into the original nodes along them"""
+        nodes = self.nodes_to_ids(route)
+        if not self.contracted:
+            return nodes
+        expanded = nodes[:1]
+        for tail, head, e in zip(nodes, nodes[1:], np.asarray(edge_path).tolist()):
+            chain = self.edge_chains[e]
+            expanded.extend(orient_chain(chain, tail) if chain is not None else [head])
+        return expanded
+
+    def make_result(self, route, edge_path, total_length, newly_traveled_length):
+        """Package up a walk (in node indices and edge ids) as a RunResult in networkx terms"""
+        return RunResult(self.route_to_ids(route, edge_path), total_length, newly_traveled_length,
+                         self.edges_to_keys(np.unique(edge_path)), edge_path)
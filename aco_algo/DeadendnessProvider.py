@@ -0,0 +1,136 @@
+from multiprocessing import Pool
+import os
+import random
+
+import networkx as nx
+import numpy as np
+
+# The graph being sampled, in each worker process (set by init_worker)
+worker_graph = None
+
+
+class DeadendnessProvider():
+    """
+    Something that measures how much of a graph's traffic goes through each node, for deadendness.
+    Providers return a betweenness-centrality-like value per node (normalized like nx.betweenness_centrality),
+      which the colony then scales into deadendness.
+    The name identifies the provider (and its parameters) for caching, see MapData.cached_node_values.
+    """
+    name = None
+
+    def centrality(self, graph: nx.MultiGraph) -> dict:
+        raise NotImplementedError()
+
+
+class BetweennessDeadendness(DeadendnessProvider):
+    def __init__(self, k=1000, seed=None, processes=None):
+        """
+        Sampled betweenness centrality (the original deadendness measure), with shortest paths from k sampled sources.
+        The sources are split up between worker processes, since each source's shortest paths are independent.
+        Pass a seed to make the sampling (and so the result) reproducible.
+        """
+        self.k = k
+        self.seed = seed
+        self.processes = processes or os.cpu_count()
+        self.name = f"betweenness-k{k}" + (f"-seed{seed}" if seed is not None else "")
+
+    def centrality(self, graph: nx.MultiGraph):
+        nodes = list(graph.nodes)
+        n = len(nodes)
+        if n <= 2:
+            return {node: 0.0 for node in nodes}
+        k = min(self.k, n)
+        sources = random.Random(self.seed).sample(nodes, k) if k < n else nodes
+
+        batches = [sources[i::self.processes] for i in range(self.processes) if sources[i::self.processes]]
+        if len(batches) == 1:
+            init_worker(graph)
+            partials = [source_betweenness(sources)]
+        else:
+            with Pool(len(batches), initializer=init_worker, initargs=(graph,)) as pool:
+                partials = pool.map(source_betweenness, batches)
+
+        # betweenness_centrality_subset counts each pair once; rescale to nx's normalization,
+        #   and extrapolate from the k sampled sources to all n of them
+        scale = 2 / ((n - 1) * (n - 2)) * n / k
+        return {node: sum(partial[node] for partial in partials) * scale for node in nodes}
+
+
+class StructuralDeadendness(DeadendnessProvider):
+    """
+    A betweenness stand-in computed in near-linear time from the graph's bridges.
+    Cutting a bridge splits its component in two, and every path between the two halves has to cross it
+      (through both of its ends). So for each node, we count the pairs of nodes on different sides of its bridges.
+    That's a lower bound on (unweighted) betweenness that's exact on tree-like bits of the graph, which is
+      exactly where dead ends live. Nodes without a bridge (inside a block of the street grid) get 0.
+    """
+    name = "structural"
+
+    def centrality(self, graph: nx.MultiGraph):
+        nodes = list(graph.nodes)
+        n = len(nodes)
+        if n <= 2:
+            return {node: 0.0 for node in nodes}
+        node_index = {node: i for i, node in enumerate(nodes)}
+        bridges = list(nx.bridges(graph))
+
+        # The 2-edge-connected components are whatever's left connected once the bridges are cut
+        cut = nx.Graph(graph)
+        cut.remove_edges_from(bridges)
+        component = np.empty(n, dtype=np.int64)
+        component_sizes = []
+        for c, members in enumerate(nx.connected_components(cut)):
+            component[[node_index[node] for node in members]] = c
+            component_sizes.append(len(members))
+
+        # The components and bridges form a forest (the bridge tree).
+        # Count the nodes below each component, and in each tree as a whole.
+        bridge_tree = nx.Graph()
+        bridge_tree.add_nodes_from(range(len(component_sizes)))
+        bridge_tree.add_edges_from((component[node_index[u]], component[node_index[v]]) for u, v in bridges)
+        parent = np.full(len(component_sizes), -1, dtype=np.int64)
+        below = np.array(component_sizes, dtype=np.int64)
+        tree_size = np.empty(len(component_sizes), dtype=np.int64)
+        for tree in nx.connected_components(bridge_tree):
+            root = next(iter(tree))
+            for child, child_parent in nx.dfs_predecessors(bridge_tree, root).items():
+                parent[child] = child_parent
+            order = list(nx.dfs_postorder_nodes(bridge_tree, root))
+            for c in order:
+                if parent[c] >= 0:
+                    below[parent[c]] += below[c]
+            tree_size[order] = below[root]
+
+        # For each end of each bridge, the number of nodes on the far side of it
+        u_index = np.array([node_index[u] for u, _ in bridges], dtype=np.int64)
+        v_index = np.array([node_index[v] for _, v in bridges], dtype=np.int64)
+        u_component, v_component = component[u_index], component[v_index]
+        v_is_child = parent[v_component] == u_component
+        child = np.where(v_is_child, v_component, u_component)
+        child_side = below[child]
+        parent_side = tree_size[child] - child_side
+        beyond_u = np.where(v_is_child, child_side, parent_side)
+        beyond_v = np.where(v_is_child, parent_side, child_side)
+
+        # With sides of sizes c_1..c_m across a node's bridges (and r nodes left on its own side),
+        #   the pairs that must pass through it are those on different sides: sum(c_i*c_j, i<j) + r*sum(c_i)
+        beyond_sum = np.zeros(n)
+        beyond_sum_squares = np.zeros(n)
+        np.add.at(beyond_sum, u_index, beyond_u)
+        np.add.at(beyond_sum, v_index, beyond_v)
+        np.add.at(beyond_sum_squares, u_index, beyond_u.astype(float) ** 2)
+        np.add.at(beyond_sum_squares, v_index, beyond_v.astype(float) ** 2)
+        rest = tree_size[component] - 1 - beyond_sum
+        pairs = (beyond_sum ** 2 - beyond_sum_squares) / 2 + beyond_sum * rest
+
+        # Normalized like nx.betweenness_centrality (by the number of pairs not including the node)
+        return dict(zip(nodes, (pairs / ((n - 1) * (n - 2) / 2)).tolist()))
+
+
+def init_worker(graph: nx.MultiGraph):
+    global worker_graph
+    worker_graph = graph
+
+def source_betweenness(sources: list):
+    """The (unnormalized) betweenness contributed by the shortest paths from a batch of sources"""
+    return nx.betweenness_centrality_subset(worker_graph, sources, list(worker_graph.nodes), normalized=False, weight='length')
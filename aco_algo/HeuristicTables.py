@@ -0,0 +1,46 @@
+from dataclasses import replace
+
+import numpy as np
+
+from .ACOSettings import ACOSettings
+from .CompiledGraph import CompiledGraph
+
+
+class HeuristicTables():
+    def __init__(self, compiled_graph: CompiledGraph, settings: ACOSettings):
+        """
+        Per-slot heuristic terms that only depend on the graph and the settings (not on where an ant has been).
+        Precomputing these leaves the ants with just the dynamic terms (directional, gohome, self-traveled) per step.
+        Each table is only rebuilt when a setting it depends on changes.
+        """
+        self.compiled_graph = compiled_graph
+        self.settings = None
+        self.update(settings)
+
+    def changed(self, settings: ACOSettings, *fields: str):
+        return self.settings is None or any(getattr(settings, field) != getattr(self.settings, field) for field in fields)
+
+    def update(self, settings: ACOSettings):
+        """Rebuild whichever tables are affected by the new settings. Returns the names of the rebuilt tables."""
+        graph = self.compiled_graph
+        rebuilt = []
+        if self.changed(settings, "deadendness_coeff"):
+            # A boost for deadend-ier nodes
+            self.deadendness_term = graph.slot_deadendness * settings.deadendness_coeff
+            rebuilt.append("deadendness_term")
+        if self.changed(settings, "finish_boost"):
+            # A constant boost factor for finish nodes
+            self.finish_term = graph.slot_is_finish * settings.finish_boost
+            rebuilt.append("finish_term")
+        if rebuilt:
+            # The combined static heuristic for each slot, depending on whether its edge has been traveled.
+            # The deadendness boost only applies to traveled edges (see Ant.desireabilities)
+            self.static_traveled = self.finish_term + self.deadendness_term
+            self.static_untraveled = self.finish_term
+        # Keep our own copy, so settings that are tweaked in place still register as changes next time
+        self.settings = replace(settings)
+        return rebuilt
+
+    def static_heuristics(self, slots: np.ndarray, traveled_lads: np.ndarray):
+        """Look up the static heuristic for the given slots (any shape) and their traveled status"""
+        return np.where(traveled_lads, self.static_traveled[slots], self.static_untraveled[slots])
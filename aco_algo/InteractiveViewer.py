@@ -1,38 +1,72 @@
-from matplotlib import pyplot as plt
+import threading
+import time
+
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.collections import LineCollection
+from matplotlib.figure import Figure
 import matplotlib.cm as mplcm
 import numpy as np
-import networkx as nx
-import osmnx as ox
-from PIL import Image, ImageTk
 import tkinter as tk
 
-from .ACOSettings import ACOSettings
-from .Ant import Ant, RunResult
 from .AntColony import AntColony
+from .ColonyOptimizer import ColonyOptimizer
+from .CompiledGraph import CompiledGraph
+from .RunResult import RunResult
+
+
+class Snapshot:
+    def __init__(self, compiled_graph: CompiledGraph, pheromone: np.ndarray, results: list[RunResult], iteration: int, best_score: float | None):
+        """What the viewer needs to draw one frame, copied out of the colony so the worker can carry on"""
+        self.compiled_graph = compiled_graph
+        self.pheromone = pheromone
+        self.edge_paths = [result.edge_path for result in results]
+        self.iteration = iteration
+        self.best_score = best_score
 
 
 class InteractiveViewer:
-    def __init__(self, colony: AntColony):
+    def __init__(self, colony: AntColony, optimizer: ColonyOptimizer | None = None, fps: float = 10):
+        """
+        A Tk window showing the colony's pheromones and latest routes, with play/pause/step/reset controls.
+        The colony runs in a background thread and publishes a Snapshot after every iteration.
+        The window only draws the latest snapshot, at most fps times a second, so iterations aren't held up by drawing.
+        The drawing is one persistent figure: the edges are a LineCollection whose colors come from the pheromones,
+          and the routes are another LineCollection on top whose segments are swapped out in place.
+        With an optimizer, iterations go through it (instead of the colony's plain update) and playing stops once it's done.
+        """
         self.colony = colony
-        self.graph = colony.network_graph
-        # self.fig = plt.figure()
-        # self.ax = self.fig.add_subplot(111)
-        # self.ax.set_title('ACO Algorithm')
+        self.optimizer = optimizer
+        self.frame_interval = 1 / fps
         self.pher_cmap = mplcm.get_cmap("viridis")
         self.route_cmap = mplcm.get_cmap("rainbow")
 
+        # The worker runs iterations while playing (or while there are steps to take), holding the lock while it does
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition()
+        self.playing = False
+        self.pending_steps = 0
+        self.closing = False
+        self.snapshot: Snapshot | None = None
+        self.drawn_snapshot: Snapshot | None = None
+        self.segments_graph: CompiledGraph | None = None
+
         self.window = tk.Tk()
         self.window.rowconfigure(0, minsize=800, weight=1)
         self.window.columnconfigure(0, minsize=800, weight=1)
         self.window.columnconfigure(1, minsize=200, weight=1)
 
-        # convert to tkinter compatible image
-        self.imgtk = ImageTk.PhotoImage(image=Image.fromarray(np.zeros((800,800,3), dtype=np.uint8)))
-        # put the image on a label
-        self.image_label = tk.Label(self.window, image=self.imgtk)
-        self.image_label.image = self.imgtk # Prevent garbage collection
+        self.fig = Figure(figsize=(8, 8), facecolor="black")
+        self.ax = self.fig.add_axes([0, 0, 1, 1])
+        self.ax.set_facecolor("black")
+        self.ax.set_axis_off()
+        self.ax.set_aspect("equal")
+        self.edge_lines = LineCollection([], cmap=self.pher_cmap, linewidths=1)
+        self.route_lines = LineCollection([], linewidths=2, alpha=0.7)
+        self.ax.add_collection(self.edge_lines)
+        self.ax.add_collection(self.route_lines)
 
-        self.image_label.grid(row=0, column=0, sticky="nsew")
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.window)
+        self.canvas.get_tk_widget().grid(row=0, column=0, sticky="nsew")
 
         self.frm_controls = tk.Frame(self.window, relief="raised", bd=2)
         self.frm_controls.grid(row=0, column=1, sticky="nsew")
@@ -41,69 +75,135 @@ class InteractiveViewer:
         self.btn_reset = tk.Button(self.frm_controls, text="Reset", command=self.reset)
         self.btn_reset.grid(row=0, column=0, sticky="ew", padx=5, pady=5)
 
-        self.playing = False
         self.btn_toggle = tk.Button(self.frm_controls, text="Play", command=self.toggle)
         self.btn_toggle.grid(row=0, column=1, sticky="ew", padx=5, pady=5)
 
         self.btn_step = tk.Button(self.frm_controls, text="Step", command=self.step)
         self.btn_step.grid(row=0, column=2, sticky="ew", padx=5, pady=5)
 
+        self.status = tk.StringVar(value="")
+        self.lbl_status = tk.Label(self.frm_controls, textvariable=self.status, justify="left", anchor="w")
+        self.lbl_status.grid(row=1, column=0, columnspan=3, sticky="ew", padx=5, pady=5)
+
         # Set up app exit stuff
         self.window.bind('<Escape>', lambda e: self.window.quit())
+        self.window.protocol("WM_DELETE_WINDOW", self.window.quit)
+
+        self.worker = threading.Thread(target=self.work, daemon=True)
+        self.iteration_times = []
+        self.publish([])
 
     def reset(self):
-        self.colony.reset()
-        self.show_frame()
+        with self.lock:
+            if self.optimizer is not None:
+                self.optimizer.reset()
+            else:
+                self.colony.reset()
+            self.publish([])
 
     def toggle(self):
-        self.playing = not self.playing
-        if self.playing:
-            self.btn_toggle.configure(text="Pause")
-            self.run_iteration()
-        else:
-            self.btn_toggle.configure(text="Play")
+        with self.wakeup:
+            self.playing = not self.playing
+            self.wakeup.notify()
+        self.btn_toggle.configure(text="Pause" if self.playing else "Play")
 
     def step(self):
         # Ignore steps if we're already playing as fast as we can.
         if not self.playing:
-            self.run_iteration()
+            with self.wakeup:
+                self.pending_steps += 1
+                self.wakeup.notify()
+
+    def work(self):
+        """The worker thread: run iterations whenever there's something to do, publishing a snapshot after each"""
+        while True:
+            with self.wakeup:
+                while not (self.playing or self.pending_steps > 0 or self.closing):
+                    self.wakeup.wait()
+                if self.closing:
+                    return
+                self.pending_steps = max(self.pending_steps - 1, 0)
+            with self.lock:
+                self.run_iteration()
 
     def run_iteration(self):
-        results = self.colony.run_iteration()
-        self.show_frame(results)
-        # Repeat the same process after every 10 seconds
-        if self.playing:
-            self.image_label.after(10, self.run_iteration)
-
-    def show_frame(self, results: list[RunResult] | None =None):
-        pheromones = np.array(list(nx.get_edge_attributes(self.graph, "pheromone").values()))
-        params = {
-            "node_size": 0,
-            "edge_color": self.pher_cmap(pheromones),
-            "bgcolor": "black",
-            "show": False,
-        }
-        if results:
-            routes = [result.route for result in results]
-            route_colors = [self.route_cmap(i/len(routes)) for i in range(len(routes))]
-            # To HTML (to avoid some error warnings)
-            route_colors = [f"#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}" for r,g,b,_ in route_colors]
-            fig, ax = ox.plot_graph_routes(self.graph, routes, **params, route_colors=route_colors)
+        if self.optimizer is not None:
+            results = self.optimizer.step()
+            if self.optimizer.done():
+                # The Tk side notices and flips the button back
+                self.playing = False
         else:
-            fig, ax = ox.plot_graph(self.graph, **params)
-        fig.canvas.draw()
-
-        # convert canvas to image
-        im = Image.frombytes('RGB', fig.canvas.get_width_height(),fig.canvas.tostring_rgb())
-        
-        # Convert captured image to photoimage
-        self.imgtk = ImageTk.PhotoImage(image=im)
-    
-        # Displaying photoimage in the label
-        self.image_label.image = self.imgtk # Prevent garbage collection
-        # Configure image in the label
-        self.image_label.configure(image=self.imgtk)
+            results = self.colony.run_iteration()
+        self.iteration_times.append(time.monotonic())
+        self.publish(results)
+
+    def publish(self, results: list[RunResult]):
+        # Swapping in a whole new snapshot is atomic, so the drawing side never sees half of one
+        best_score = self.optimizer.best_score if self.optimizer is not None and self.optimizer.best_result is not None else None
+        self.snapshot = Snapshot(self.colony.compiled_graph, self.colony.pheromone.copy(), results, self.colony.iteration, best_score)
+
+    def edge_segments(self, compiled_graph: CompiledGraph):
+        """The line segments of every edge (in edge id order), following their geometries where they have them"""
+        graph = self.colony.network_graph
+        nodes = graph.nodes
+        segments = []
+        for u, v, key in compiled_graph.edge_keys:
+            geometry = graph.edges[u, v, key].get("geometry")
+            if geometry is not None:
+                segments.append(np.asarray(geometry.coords)[:, :2])
+            else:
+                segments.append(np.array([(nodes[u]["x"], nodes[u]["y"]), (nodes[v]["x"], nodes[v]["y"])]))
+        return segments
+
+    def show_frame(self):
+        """Draw the latest snapshot (if it's new), updating the persistent line collections in place"""
+        snapshot = self.snapshot
+        if snapshot is None or snapshot is self.drawn_snapshot:
+            return
+        if snapshot.compiled_graph is not self.segments_graph:
+            # The graph was recompiled (new goals or a map update), so the edges are in a new order
+            self.segments = self.edge_segments(snapshot.compiled_graph)
+            self.edge_lines.set_segments(self.segments)
+            self.segments_graph = snapshot.compiled_graph
+            points = np.concatenate(self.segments) if self.segments else np.zeros((1, 2))
+            self.ax.set_xlim(points[:, 0].min(), points[:, 0].max())
+            self.ax.set_ylim(points[:, 1].min(), points[:, 1].max())
+
+        pheromones = snapshot.pheromone
+        self.edge_lines.set_array(pheromones)
+        self.edge_lines.set_clim(0, max(pheromones.max(), 1e-12) if len(pheromones) else 1)
+
+        routes = snapshot.edge_paths
+        self.route_lines.set_segments([self.segments[e] for edge_path in routes for e in edge_path])
+        self.route_lines.set_color([self.route_cmap(i / len(routes)) for i, edge_path in enumerate(routes) for _ in edge_path])
+
+        self.canvas.draw_idle()
+        self.drawn_snapshot = snapshot
+
+        # Iterations per second, over the last couple of seconds
+        now = time.monotonic()
+        self.iteration_times = [t for t in self.iteration_times if now - t < 2]
+        status = f"Iteration {snapshot.iteration}\n{len(self.iteration_times) / 2:.1f} iterations/s"
+        if snapshot.best_score is not None:
+            status += f"\nBest score: {snapshot.best_score:.0f}"
+        self.status.set(status)
+
+    def refresh(self):
+        """The Tk side's loop: draw whatever's new, then come back in a frame's time"""
+        if not self.playing and self.btn_toggle.cget("text") == "Pause":
+            # The worker stopped playing on its own (the optimizer is done)
+            self.btn_toggle.configure(text="Play")
+        self.show_frame()
+        self.window.after(int(self.frame_interval * 1000), self.refresh)
 
     def run(self):
-        self.window.after(10, self.run_iteration)
-        self.window.mainloop()
\ No newline at end of file
+        # Start off with one iteration, so there's something to look at
+        self.pending_steps = 1
+        self.worker.start()
+        self.window.after(10, self.refresh)
+        self.window.mainloop()
+        with self.wakeup:
+            self.closing = True
+            self.wakeup.notify()
+        self.worker.join()
+        self.window.destroy()
@@ -0,0 +1,248 @@
+from dataclasses import fields, replace
+import multiprocessing
+import time
+import weakref
+
+import networkx as nx
+import numpy as np
+
+from instrumentation.Instruments import NULL_INSTRUMENTS
+from .ACOSettings import ACOSettings
+from .AntColony import AntColony
+from .AntPool import attach_array, share_array
+from .AntRandom import ant_rng
+from .AntSwarm import AntSwarm
+from .ColonyOptimizer import ColonyOptimizer
+from .CompiledGraph import CompiledGraph
+from .DeadendnessProvider import DeadendnessProvider
+from .HeuristicTables import HeuristicTables
+from .LocalSearch import LocalSearch
+from .OptimizerSettings import OptimizerSettings
+from .RunResult import RunResult
+
+# The coefficients that islands get their own (perturbed) versions of
+perturbed_fields = ["pheromone_weight", "heuristic_weight", "traveled_discount", "deadendness_coeff", "directional_coeff",
+                    "directional_choosiness", "finish_boost", "gohome_boost"]
+
+
+class Island():
+    """
+    The colony of one island, living in its own process.
+    It walks a (shared, read-only) compiled graph with an AntSwarm and keeps its own pheromones.
+    It has just enough of AntColony's interface for a ColonyOptimizer to drive it.
+    Its RunResults are in node indices and edge ids, since the worker's compiled graph has no networkx labels.
+    """
+    def __init__(self, compiled_graph: CompiledGraph, settings: ACOSettings, start_node: int):
+        self.compiled_graph = compiled_graph
+        self.settings = settings
+        self.start_node = start_node
+        self.pheromone = np.ones(compiled_graph.num_edges, dtype=float)
+        self.swarm = AntSwarm(compiled_graph, settings, self.pheromone, HeuristicTables(compiled_graph, settings))
+        self.entropy = np.random.SeedSequence(settings.seed).entropy
+        self.iteration = 0
+        self.local_searcher = None
+
+    def run_ants(self):
+        rngs = [ant_rng(self.entropy, self.iteration, i) for i in range(self.settings.num_ants)]
+        self.iteration += 1
+        return [RunResult(route, total_length, newly_traveled_length, None, edge_path)
+                for route, edge_path, total_length, newly_traveled_length in self.swarm.walk(self.start_node, rngs=rngs)]
+
+    def score(self, route_result: RunResult):
+        return route_result.newly_traveled_length
+
+    def local_search(self, route_result: RunResult):
+        if self.local_searcher is None:
+            self.local_searcher = LocalSearch(self.compiled_graph)
+        route, edge_path, total_length, newly_traveled_length = self.local_searcher.improve(self.start_node, route_result.edge_path, self.settings.target_length)
+        return RunResult(route, total_length, newly_traveled_length, None, edge_path)
+
+    def evaporate(self):
+        self.pheromone *= (1-self.settings.evaporation)
+
+    def deposit(self, results: list[RunResult], amounts):
+        if results:
+            edges = [result.edge_ids for result in results]
+            np.add.at(self.pheromone, np.concatenate(edges), np.repeat(np.asarray(amounts, dtype=float), [len(e) for e in edges]))
+
+    def reset(self, level: float = 1):
+        self.pheromone.fill(level)
+
+    # Islands aren't instrumented (the orchestrator's colony is)
+    instruments = NULL_INSTRUMENTS
+
+    def record_iteration(self, results: list[RunResult], scores: np.ndarray, **extra):
+        pass
+
+
+def island_main(connection, graph_specs, settings: ACOSettings, start_node: int, optimizer_settings: OptimizerSettings):
+    """
+    The main loop of an island's process.
+    Each request is a number of iterations to run and (maybe) a migrant route to take in first.
+    The reply is the island's best walk and its best score after each of those iterations.
+    """
+    compiled_graph = CompiledGraph.from_arrays({name: attach_array(spec) for name, spec in graph_specs.items()})
+    optimizer = ColonyOptimizer(Island(compiled_graph, settings, start_node), optimizer_settings)
+    while True:
+        request = connection.recv()
+        if request is None:
+            break
+        iterations, migrant = request
+        if migrant is not None:
+            route, edge_path, total_length, newly_traveled_length = migrant
+            optimizer.inject(RunResult(route, total_length, newly_traveled_length, None, edge_path))
+        for _ in range(iterations):
+            optimizer.step()
+        best = optimizer.best_result
+        best_walk = None if best is None else (best.route, best.edge_path, best.total_length, best.newly_traveled_length)
+        connection.send((best_walk, optimizer.history[-iterations:] if iterations > 0 else []))
+    connection.close()
+
+def release(processes, connections, blocks):
+    for connection in connections:
+        try:
+            connection.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+    for process in processes:
+        process.join(timeout=1)
+        if process.is_alive():
+            process.terminate()
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+class IslandColonies():
+    def __init__(self, network_graph: nx.MultiGraph, settings: ACOSettings, num_islands: int | None = None,
+                 optimizer_settings: OptimizerSettings | None = None, migration_interval: int = 10,
+                 perturbation: float = 0.2, seed: int | None = None, deadendness: DeadendnessProvider | None = None):
+        """
+        Several independent colonies ("islands"), each in its own process, that share their best routes every so often.
+        The graph is prepared once (by an AntColony in this process) and its compiled arrays are put in shared memory,
+          so the islands only have their own pheromones, settings, and random state.
+        Every island but the first gets its coefficients scaled by a random factor within +/- perturbation,
+          so between them they explore more than one big colony would.
+        Every migration_interval iterations, the best route of all the islands is injected into the others (see ColonyOptimizer.inject).
+        Has the same best-route interface as a ColonyOptimizer: step, run, done, best_result, best_score, and history.
+        """
+        self.colony = AntColony(network_graph, settings, mode="sequential", deadendness=deadendness)
+        self.settings = self.colony.settings
+        self.optimizer_settings = optimizer_settings or OptimizerSettings()
+        self.num_islands = num_islands or multiprocessing.cpu_count()
+        self.migration_interval = migration_interval
+
+        # Without a seed of its own, the islands' seeds come from the settings' seed (if any)
+        seed = self.settings.seed if seed is None else seed
+        rng = np.random.default_rng(seed)
+        self.island_settings = [self.settings] + [self.perturb(self.settings, perturbation, rng) for _ in range(self.num_islands - 1)]
+        if seed is not None:
+            # Each island gets its own seed for its ants
+            self.island_settings = [replace(island_settings, seed=int(island_seed))
+                                    for island_settings, island_seed in zip(self.island_settings, rng.integers(2**32, size=self.num_islands))]
+
+        compiled_graph = self.colony.compiled_graph
+        self.blocks = []
+        graph_specs = {}
+        for name, array in compiled_graph.arrays().items():
+            block, _ = share_array(array)
+            self.blocks.append(block)
+            graph_specs[name] = (block.name, array.dtype, array.shape)
+        start_node = compiled_graph.node_index[self.settings.start_node]
+
+        self.connections = []
+        self.processes = []
+        for island_settings in self.island_settings:
+            parent_end, child_end = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=island_main, daemon=True,
+                                              args=(child_end, graph_specs, island_settings, start_node, self.optimizer_settings))
+            process.start()
+            self.connections.append(parent_end)
+            self.processes.append(process)
+        # Make sure the processes and shared memory get cleaned up, even if close() is never called
+        self.finalizer = weakref.finalize(self, release, self.processes, self.connections, self.blocks)
+
+        self.best_result: RunResult | None = None
+        self.best_score = float("-inf")
+        self.best_walk = None
+        # The island the best walk came from (which doesn't need it sent back)
+        self.best_island = None
+        # The best score after each iteration (of every island)
+        self.history = []
+        self.iteration = 0
+        self.start_time = time.monotonic()
+
+    @staticmethod
+    def perturb(settings: ACOSettings, perturbation: float, rng: np.random.Generator):
+        """A copy of the settings with each of the perturbed_fields scaled by a random factor within +/- perturbation"""
+        changes = {}
+        for field in fields(settings):
+            if field.name in perturbed_fields:
+                changes[field.name] = getattr(settings, field.name) * rng.uniform(1 - perturbation, 1 + perturbation)
+        # A discount of more than 1 would make traveled edges undesireable in the negative
+        changes["traveled_discount"] = min(changes["traveled_discount"], 1)
+        return replace(settings, **changes)
+
+    def step(self):
+        """
+        Run every island for one migration interval (in parallel), then collect their best routes.
+        The best of all of them gets sent out to the other islands with the next step.
+        Returns each island's best RunResult.
+        """
+        # The island the best walk came from already has it, and taking it in again would deposit it twice
+        for island, connection in enumerate(self.connections):
+            connection.send((self.migration_interval, None if island == self.best_island else self.best_walk))
+        replies = [connection.recv() for connection in self.connections]
+
+        compiled_graph = self.colony.compiled_graph
+        results = []
+        for island, (walk, _) in enumerate(replies):
+            if walk is None:
+                continue
+            result = compiled_graph.make_result(*walk)
+            results.append(result)
+            score = self.colony.score(result)
+            if score > self.best_score:
+                self.best_result = result
+                self.best_score = float(score)
+                self.best_walk = walk
+                self.best_island = island
+
+        # Every island has taken in the best route so far, so the best of their histories is the overall history
+        histories = np.array([history for _, history in replies], dtype=float)
+        if histories.size > 0:
+            self.history.extend(histories.max(axis=0).tolist())
+        self.iteration += self.migration_interval
+        return results
+
+    def converged(self):
+        """Whether the best route has stopped getting (meaningfully) better"""
+        window = self.optimizer_settings.convergence_iterations
+        if window <= 0 or len(self.history) <= window:
+            return False
+        if self.best_score <= 0:
+            # Nothing new within reach (say, everything's traveled), so there's no relative threshold to go by.
+            # Not improving at all over the window counts as converged, or this would never stop.
+            return self.history[-1] <= self.history[-1 - window]
+        improvement = self.history[-1] - self.history[-1 - window]
+        return improvement < self.optimizer_settings.convergence_threshold * self.best_score
+
+    def done(self):
+        """Whether it's time to stop: converged, or out of iterations or time"""
+        settings = self.optimizer_settings
+        if settings.max_iterations is not None and self.iteration >= settings.max_iterations:
+            return True
+        if settings.time_budget is not None and time.monotonic() - self.start_time >= settings.time_budget:
+            return True
+        return self.converged()
+
+    def run(self):
+        """Step until done, then return the best route found. The time budget counts from here."""
+        self.start_time = time.monotonic()
+        while not self.done():
+            self.step()
+        return self.best_result
+
+    def close(self):
+        """Shut down the island processes"""
+        self.finalizer()
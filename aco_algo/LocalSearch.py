@@ -0,0 +1,153 @@
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from .CompiledGraph import CompiledGraph
+
+
+class LocalSearch():
+    def __init__(self, compiled_graph: CompiledGraph):
+        """
+        Cheap touch-ups for ant routes, scored the same way the colony scores them (new length).
+        Ant routes wander: they double back, loop around, and take the long way over roads that are already traveled.
+        improve() runs three moves over a route (as edge ids in a compiled graph), none of which ever lose new length:
+        - cut_loops: cut out loops back to the same node that don't cover any new road of their own
+        - shortcut: swap stretches of traveled road for the shortest way between their ends, if that's shorter
+        - add_spurs: with whatever length is left under the target, go out and back along untraveled dead ends next to the route
+        Everything works off the compiled graph's arrays, so it works on islands' (label-less) compiled graphs too.
+        """
+        self.compiled_graph = compiled_graph
+        graph = compiled_graph
+        # The node each slot leaves from, and the two ends of every edge
+        self.slot_owner = np.repeat(np.arange(graph.num_nodes), np.diff(graph.offsets))
+        self.edge_ends = np.zeros((graph.num_edges, 2), dtype=np.int64)
+        self.edge_ends[graph.edge_ids] = np.stack([self.slot_owner, graph.neighbors], axis=1)
+        self.degree = np.diff(graph.offsets)
+
+        # For shortcuts: the cheapest edge between each pair of (real, not finish) nodes, as a sparse matrix for dijkstra
+        usable = ~graph.slot_is_finish & ~graph.is_finish_node[self.slot_owner] & (self.slot_owner != graph.neighbors)
+        owners, neighbors = self.slot_owner[usable], graph.neighbors[usable]
+        lengths, edges = graph.slot_length[usable], graph.edge_ids[usable]
+        order = np.lexsort((lengths, neighbors, owners))
+        owners, neighbors, lengths, edges = owners[order], neighbors[order], lengths[order], edges[order]
+        cheapest = np.ones(len(owners), dtype=bool)
+        cheapest[1:] = (owners[1:] != owners[:-1]) | (neighbors[1:] != neighbors[:-1])
+        owners, neighbors, lengths, edges = owners[cheapest], neighbors[cheapest], lengths[cheapest], edges[cheapest]
+        self.pair_edge = dict(zip((owners * graph.num_nodes + neighbors).tolist(), edges.tolist()))
+        # (Zero-length edges would read as missing to scipy)
+        self.shortcut_graph = csr_matrix((np.maximum(lengths, 1e-9), (owners, neighbors)), shape=(graph.num_nodes, graph.num_nodes))
+
+    def route(self, start: int, edge_path: np.ndarray):
+        """The nodes a walk along edge_path from start passes through"""
+        route = np.empty(len(edge_path) + 1, dtype=np.int64)
+        route[0] = start
+        for i, (u, v) in enumerate(self.edge_ends[edge_path].tolist()):
+            route[i + 1] = v if route[i] == u else u
+        return route
+
+    def new_length(self, edge_path: np.ndarray):
+        return float(self.compiled_graph.untraveled_length[np.unique(edge_path)].sum())
+
+    def improve(self, start: int, edge_path: np.ndarray, target_length: float):
+        """
+        Run all the moves over a walk from start along edge_path.
+        Returns the improved walk, the same way an Ant does: route, edge path, total length, and newly traveled length.
+        """
+        edge_path = np.asarray(edge_path, dtype=np.int64)
+        route = self.route(start, edge_path)
+        if len(edge_path) > 0:
+            route, edge_path = self.cut_loops(route, edge_path)
+            route, edge_path = self.shortcut(route, edge_path)
+            # Shortcuts can run back through the route, making new loops
+            route, edge_path = self.cut_loops(route, edge_path)
+            route, edge_path = self.add_spurs(route, edge_path, target_length)
+        return route, edge_path, float(self.compiled_graph.length[edge_path].sum()), self.new_length(edge_path)
+
+    def cut_loops(self, route: np.ndarray, edge_path: np.ndarray):
+        """Cut out every loop (from a node back to itself) that covers no new road that isn't covered elsewhere too"""
+        untraveled = self.compiled_graph.untraveled_length
+        i = 0
+        while i < len(edge_path):
+            cut = False
+            # The biggest loop from here first
+            for j in (np.flatnonzero(route[i + 1:] == route[i])[::-1] + i + 1).tolist():
+                loop = edge_path[i:j]
+                rest = np.concatenate((edge_path[:i], edge_path[j:]))
+                if len(np.setdiff1d(loop[untraveled[loop] > 0], rest)) == 0:
+                    route = np.concatenate((route[:i], route[j:]))
+                    edge_path = rest
+                    cut = True
+                    break
+            if not cut:
+                i += 1
+        return route, edge_path
+
+    def shortcut(self, route: np.ndarray, edge_path: np.ndarray):
+        """Swap each stretch of traveled road for the shortest way between its ends (all the stretches' searches go in one batch)"""
+        graph = self.compiled_graph
+        # (The finish edge is free too, but finish nodes aren't in the shortcut graph, so runs have to end before it)
+        free = (graph.untraveled_length[edge_path] == 0) & ~graph.is_finish_node[route[:-1]] & ~graph.is_finish_node[route[1:]]
+        # The [start, end) positions of each run of at least two traveled edges
+        changes = np.diff(np.concatenate(([0], free.astype(np.int8), [0])))
+        starts, ends = np.flatnonzero(changes == 1), np.flatnonzero(changes == -1)
+        long_enough = ends - starts >= 2
+        starts, ends = starts[long_enough], ends[long_enough]
+        if len(starts) == 0:
+            return route, edge_path
+
+        run_lengths = np.array([graph.length[edge_path[s:e]].sum() for s, e in zip(starts, ends)])
+        sources, rows = np.unique(route[starts], return_inverse=True)
+        distances, predecessors = dijkstra(self.shortcut_graph, indices=sources, return_predecessors=True, limit=run_lengths.max())
+
+        # From the back, so the earlier positions stay put
+        for k in range(len(starts) - 1, -1, -1):
+            s, e, row = starts[k], ends[k], rows[k]
+            a, b = route[s], route[e]
+            if distances[row, b] >= run_lengths[k] - 1e-6:
+                continue
+            shortcut = []
+            node = b
+            while node != a:
+                previous = predecessors[row, node]
+                shortcut.append(self.pair_edge[int(previous) * graph.num_nodes + int(node)])
+                node = previous
+            shortcut = np.array(shortcut[::-1], dtype=np.int64)
+            edge_path = np.concatenate((edge_path[:s], shortcut, edge_path[e:]))
+            route = np.concatenate((route[:s], self.route(a, shortcut), route[e + 1:]))
+        return route, edge_path
+
+    def add_spurs(self, route: np.ndarray, edge_path: np.ndarray, target_length: float):
+        """
+        Go out and back along untraveled dead ends that branch off the route, best new length per meter first,
+          for as long as the route stays under the target length.
+        """
+        graph = self.compiled_graph
+        budget = target_length - graph.length[edge_path].sum()
+        if budget <= 0:
+            return route, edge_path
+
+        # Every slot leaving every (real) node along the route, all at once
+        positions = np.flatnonzero(~graph.is_finish_node[route])
+        counts = self.degree[route[positions]]
+        slots = np.repeat(graph.offsets[route[positions]], counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(positions, counts)
+        edges, ends = graph.edge_ids[slots], graph.neighbors[slots]
+        candidates = (self.degree[ends] == 1) & ~graph.is_finish_node[ends] & (graph.untraveled_length[edges] > 0) & ~np.isin(edges, edge_path)
+        # Each spur only once (from the first place the route passes it)
+        edges, first = np.unique(edges[candidates], return_index=True)
+        positions, ends = positions[candidates][first], ends[candidates][first]
+
+        costs = 2 * graph.length[edges]
+        gains = graph.untraveled_length[edges]
+        chosen = []
+        for k in np.argsort(-gains / np.maximum(costs, 1e-9)).tolist():
+            if costs[k] <= budget:
+                chosen.append(k)
+                budget -= costs[k]
+
+        # From the back, so the earlier positions stay put
+        for k in sorted(chosen, key=lambda k: -positions[k]):
+            p = positions[k]
+            edge_path = np.insert(edge_path, p, [edges[k], edges[k]])
+            route = np.insert(route, p + 1, [ends[k], route[p]])
+        return route, edge_path
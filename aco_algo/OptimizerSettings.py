@@ -0,0 +1,16 @@
+from dataclasses import dataclass
+
+@dataclass
+class OptimizerSettings():
+    deposit: str = "iteration_best" # Who deposits pheromone: "all" ants, the "iteration_best", the "global_best", or "elitist" (iteration best plus a weighted global best)
+    elitist_weight: float = 1.0 # How much the global best deposits (relative to the iteration best) for "elitist"
+    bounded: bool = True # Whether to clamp pheromones between the Max-Min bounds
+    p_best: float = 0.05 # Chance that a fully converged colony builds the best route again (sets how far apart the bounds are)
+
+    stagnation_iterations: int = 25 # Restart the pheromones after this many iterations without a better route (0 = never)
+    convergence_iterations: int = 100 # Stop once the best route has improved by less than convergence_threshold over this many iterations
+    convergence_threshold: float = 0.01 # (as a fraction of the best score)
+    max_iterations: int | None = None
+    time_budget: float | None = None # seconds
+
+    local_search: int = 0 # How many of each iteration's best routes get touched up by LocalSearch before they deposit (0 = off)
@@ -0,0 +1,217 @@
+from dataclasses import asdict
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+from .AntColony import AntColony
+from .ColonyOptimizer import ColonyOptimizer
+from .RunResult import RunResult
+
+# The settings left out of the coefficients' fingerprint.
+# The start, goals, and target length describe the query itself, so they're matched on separately (see describe).
+# The seed and the number of ants only change how a run goes, not what a good route is, so they're left out of the key
+#   altogether: a cached run is just as good a starting point (or answer) whatever they were.
+query_fields = ["start_node", "goal_nodes", "target_length", "seed", "num_ants"]
+
+
+class PheromoneCache():
+    def __init__(self, directory: str = ".pheromone_cache", max_bytes: int = 256 * 2**20, max_distance: float = 1.0):
+        """
+        An on-disk cache of finished colony runs: their pheromones and best routes.
+        Entries are keyed on the map (its structure and traveled statuses), the start and goal nodes,
+          the target length, and a fingerprint of the ants' coefficients.
+        - An exact repeat of a cached query gets its best route back without running anything (see run).
+        - Otherwise, the closest cached run on the same map (see distance) seeds the new colony's pheromones,
+          and its best route too if it starts and ends at the same places.
+        Entries further than max_distance away aren't used. The least recently used entries are evicted
+          once the cache is bigger than max_bytes.
+        Pheromones are stored against edge keys, so they carry over to colonies whose graphs were compiled in another order
+          (or lost a few edges to a map update).
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, "index.json")
+        self.index = self.load_index()
+
+    def load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path) as f:
+            index = json.load(f)
+        # Forget entries whose arrays went missing
+        return {key: entry for key, entry in index.items() if os.path.exists(self.entry_path(key))}
+
+    def save_index(self):
+        # Write-then-rename, so a crash never leaves half an index behind
+        staging = self.index_path + ".partial"
+        with open(staging, "w") as f:
+            json.dump(self.index, f)
+        os.replace(staging, self.index_path)
+
+    def entry_path(self, key: str):
+        return os.path.join(self.directory, key + ".npz")
+
+    @staticmethod
+    def describe(colony: AntColony):
+        """What a colony's query is, in the terms the cache matches on"""
+        compiled_graph = colony.compiled_graph
+        finish_nodes = colony.finish_nodes
+        # The finish edges depend on the goals (which are matched on separately), so they're left out of the map's hashes.
+        # The edges are sorted (with each edge's ends in a set order too), so the hashes don't depend on the compile order.
+        edges = sorted((tuple(sorted((u, v), key=repr)) + (key,), length, traveled)
+                       for (u, v, key), length, traveled in zip(compiled_graph.edge_keys, compiled_graph.length.tolist(), compiled_graph.traveled.tolist())
+                       if u not in finish_nodes and v not in finish_nodes)
+        structure = hashlib.sha256(repr([(edge, length) for edge, length, _ in edges]).encode())
+        traveled = hashlib.sha256(repr([traveled for _, _, traveled in edges]).encode())
+        settings = asdict(colony.settings)
+        coefficients = {name: value for name, value in settings.items() if name not in query_fields}
+        return {
+            "structure": structure.hexdigest()[:16],
+            "traveled": traveled.hexdigest()[:16],
+            "start_node": settings["start_node"],
+            "goal_nodes": list(settings["goal_nodes"]),
+            "target_length": float(settings["target_length"]),
+            "fingerprint": hashlib.sha256(json.dumps(coefficients, sort_keys=True).encode()).hexdigest()[:16],
+        }
+
+    @staticmethod
+    def key(query: dict):
+        return hashlib.sha256(json.dumps(query, sort_keys=True, default=str).encode()).hexdigest()[:24]
+
+    @staticmethod
+    def distance(query: dict, cached: dict):
+        """
+        How far apart two queries are (0 = the same query, inf = not on the same map).
+        The target lengths count by their relative difference; a different start, goals, coefficients,
+          or traveled roads each add a fixed penalty.
+        """
+        if query["structure"] != cached["structure"]:
+            return np.inf
+        distance = abs(query["target_length"] - cached["target_length"]) / query["target_length"]
+        distance += 0.5 * (query["start_node"] != cached["start_node"])
+        distance += 0.5 * (query["goal_nodes"] != cached["goal_nodes"])
+        distance += 0.25 * (query["fingerprint"] != cached["fingerprint"])
+        distance += 0.25 * (query["traveled"] != cached["traveled"])
+        return distance
+
+    def closest(self, query: dict):
+        """The key of the closest cached query (within max_distance), and how far away it is. (None, inf) if there isn't one."""
+        best_key, best_distance = None, np.inf
+        for key, entry in self.index.items():
+            distance = self.distance(query, entry["query"])
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+        if best_distance > self.max_distance:
+            return None, np.inf
+        return best_key, best_distance
+
+    def load(self, key: str):
+        self.index[key]["last_used"] = time.time()
+        self.save_index()
+        with np.load(self.entry_path(key)) as arrays:
+            return {name: arrays[name] for name in arrays.files}
+
+    @staticmethod
+    def rebuild_result(colony: AntColony, route_keys: np.ndarray):
+        """
+        Turn a cached route (its edge keys, in order) back into a RunResult on the colony's compiled graph,
+          scored against the colony's current traveled statuses. None if the route doesn't fit the graph any more.
+        """
+        compiled_graph = colony.compiled_graph
+        edge_index = compiled_graph.edge_index
+        edge_path = []
+        nodes = [colony.settings.start_node]
+        for u, v, key in route_keys.tolist():
+            e = edge_index.get((u, v, key))
+            if e is None or nodes[-1] not in (u, v):
+                return None
+            edge_path.append(e)
+            nodes.append(v if nodes[-1] == u else u)
+        edge_path = np.array(edge_path, dtype=np.int64)
+        route = np.array([compiled_graph.node_index[node] for node in nodes], dtype=np.int64)
+        unique = np.unique(edge_path)
+        return compiled_graph.make_result(route, edge_path, float(compiled_graph.length[edge_path].sum()),
+                                          float(compiled_graph.untraveled_length[unique].sum()))
+
+    def lookup(self, colony: AntColony):
+        """The cached best route for exactly this query (rebuilt on the colony's graph), or None"""
+        key = self.key(self.describe(colony))
+        if key not in self.index:
+            return None
+        return self.rebuild_result(colony, self.load(key)["route_keys"])
+
+    def warm_start(self, optimizer: ColonyOptimizer):
+        """
+        Seed a (freshly reset) optimizer's colony from the closest cached run: its pheromones on the edges they both have
+          (clamped to the optimizer's bounds), and its best route if the start and goals match and it fits under the target length.
+        Returns the distance to the cached run it used (inf if none).
+        """
+        colony = optimizer.colony
+        query = self.describe(colony)
+        key, distance = self.closest(query)
+        if key is None:
+            return distance
+        cached = self.load(key)
+        edge_index = colony.compiled_graph.edge_index
+        for (u, v, edge_key), pheromone in zip(cached["edge_keys"].tolist(), cached["pheromone"].tolist()):
+            e = edge_index.get((u, v, edge_key))
+            if e is not None:
+                colony.pheromone[e] = pheromone
+        cached_query = self.index[key]["query"]
+        if cached_query["start_node"] == query["start_node"] and cached_query["goal_nodes"] == query["goal_nodes"]:
+            result = self.rebuild_result(colony, cached["route_keys"])
+            # (A route cached for a longer target would be over-length here)
+            if result is not None and result.total_length <= colony.settings.target_length:
+                optimizer.inject(result)
+        if optimizer.settings.bounded:
+            np.clip(colony.pheromone, optimizer.pheromone_min(), optimizer.pheromone_max(), out=colony.pheromone)
+        print(f"Warm started from a cached run {distance:.2f} away")
+        return distance
+
+    def store(self, optimizer: ColonyOptimizer):
+        """Cache an optimizer's pheromones and best route under its colony's query"""
+        if optimizer.best_result is None:
+            return
+        colony = optimizer.colony
+        compiled_graph = colony.compiled_graph
+        query = self.describe(colony)
+        key = self.key(query)
+        staging = self.entry_path(key) + ".partial.npz"
+        np.savez(staging,
+                 edge_keys=np.array(compiled_graph.edge_keys).reshape(-1, 3),
+                 pheromone=np.asarray(colony.pheromone, dtype=float),
+                 route_keys=np.array([compiled_graph.edge_keys[e] for e in optimizer.best_result.edge_path]).reshape(-1, 3))
+        os.replace(staging, self.entry_path(key))
+        self.index[key] = {"query": query, "best_score": optimizer.best_score, "size": os.path.getsize(self.entry_path(key)),
+                           "last_used": time.time()}
+        self.evict()
+        self.save_index()
+
+    def evict(self):
+        """Drop the least recently used entries until the cache fits in max_bytes"""
+        total = sum(entry["size"] for entry in self.index.values())
+        for key in sorted(self.index, key=lambda key: self.index[key]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self.index.pop(key)["size"]
+            os.remove(self.entry_path(key))
+
+    def run(self, optimizer: ColonyOptimizer) -> RunResult | None:
+        """
+        Run an optimizer through the cache: an exact repeat returns the cached best route straight away,
+          anything else is warm started, run until done, and then cached.
+        """
+        cached = self.lookup(optimizer.colony)
+        if cached is not None:
+            print("Cache hit")
+            optimizer.inject(cached)
+            return optimizer.best_result
+        self.warm_start(optimizer)
+        result = optimizer.run()
+        self.store(optimizer)
+        return result
@@ -0,0 +1,16 @@
+import numpy as np
+
+
+class RunResult:
+    def __init__(self, route, total_length, newly_traveled_length, traveled_edges, edge_path=None):
+        self.route = route
+        self.total_length = total_length
+        self.newly_traveled_length = newly_traveled_length
+        self.traveled_edges = traveled_edges
+        # The edge ids (in the colony's compiled graph) of each step of the route, in order
+        self.edge_path = edge_path
+
+    @property
+    def edge_ids(self):
+        """The unique edge ids traveled by this route"""
+        return np.unique(self.edge_path)
@@ -0,0 +1,47 @@
+from .ExplorationGraph import ExplorationPath
+
+
+class DominanceIndex():
+    """
+    Keeps track of the best paths seen for each search state, so dominated paths can be dropped.
+    A path's state is its head node plus the untraveled pairs it has been along (ExplorationPath.new_pairs).
+    Two paths in the same state can be continued in exactly the same ways and score those continuations the same,
+      except that the shorter one has more target length left to score with.
+    So a path is dominated if another path in its state is no longer and scores at least as well.
+    (This also catches duplicates: the same arcs in a different order, or different traveled arcs to the same place.)
+
+    Paths that are already on the frontier when they become dominated are flagged rather than dug out of the heap;
+      the search skips them when they come off the frontier.
+    """
+
+    def __init__(self):
+        self.states = {}
+        self.pruned = 0
+        self.invalidated = 0
+
+    def __len__(self):
+        return len(self.states)
+
+    def add(self, path: ExplorationPath):
+        """Record a new path. Returns False (and drops it) if it is dominated by a path already seen."""
+        state = (path.head, path.new_pairs)
+        best_paths = self.states.get(state)
+        if best_paths is None:
+            self.states[state] = [path]
+            return True
+
+        for other in best_paths:
+            if other.total_length <= path.total_length and other.score >= path.score:
+                self.pruned += 1
+                return False
+
+        still_best = []
+        for other in best_paths:
+            if path.total_length <= other.total_length and path.score >= other.score:
+                other.dominated = True
+                self.invalidated += 1
+            else:
+                still_best.append(other)
+        still_best.append(path)
+        self.states[state] = still_best
+        return True
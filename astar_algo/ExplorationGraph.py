@@ -1,15 +1,25 @@
 from collections import namedtuple
+import networkx as nx
 from networkx import MultiDiGraph
-import pyproj
+import numpy as np
+from shapely import Polygon
+
+from map_data.ChainContraction import expand_route, untraveled_length, untraveled_within
+from map_data.SpatialIndex import SpatialIndex
 
 
 class ExplorationGraphSettings():
-    def __init__(self, target_length: float, overlength_penalty: float, outregion_penalty: float, start_nodes: list[int], goal_nodes: list[int]):
+    def __init__(self, target_length: float, overlength_penalty: float, outregion_penalty: float, start_nodes: list[int], goal_nodes: list[int], region: Polygon | None = None):
+        """
+        The region is an optional lon/lat polygon. Distance traveled on edges that leave it is penalized
+          by outregion_penalty (per meter).
+        """
         self.target_length = target_length
         self.overlength_penalty = overlength_penalty
         self.outregion_penalty = outregion_penalty
         self.start_nodes = start_nodes
         self.goal_nodes = goal_nodes
+        self.region = region
     
 # class ExplorationNode():
 #     def __init__(self, node: str, traveled: bool, length: float):
@@ -21,25 +31,57 @@ class ExplorationArc(namedtuple("ExplorationArc", ["tail", "head", "key", "attri
     pass
 
 class ExplorationPath():
-    def __init__(self, arcs: list[ExplorationArc], total_length: float, new_length: float, score: float, node_pairs: set[tuple[int, int]] | None = None):
-        self.arcs = arcs
+    """
+    A path through the network graph, stored as its last arc plus a pointer to the path it continues.
+    Continuing a path is constant-size: the arcs are shared with every other path that branched off the same parent,
+      and the full arc list is only built when somebody asks for it (like when a path comes out of the search).
+    The arcs traveled so far are kept as a bitset (a python int) over the graph's pair ids (see ExplorationGraph.pair_id).
+    new_pairs is the part of that bitset that can still change a score (pairs with an untraveled arc between them).
+    dominated is set by the search's DominanceIndex when a better path with the same state turns up.
+    """
+    __slots__ = ["parent", "arc", "total_length", "new_length", "score", "traveled_pairs", "new_pairs", "dominated"]
+
+    def __init__(self, parent: "ExplorationPath | None", arc: ExplorationArc, total_length: float, new_length: float, score: float, traveled_pairs: int = 0, new_pairs: int = 0):
+        self.parent = parent
+        self.arc = arc
         self.total_length = total_length
         self.new_length = new_length
         self.score = score
-        self.node_pairs = node_pairs or set((arc.tail, arc.head) for arc in arcs)
-
-    def has_traveled_arc(self, arc: ExplorationArc):
-        return (arc.tail, arc.head) in self.node_pairs or (arc.head, arc.tail) in self.node_pairs
+        self.traveled_pairs = traveled_pairs
+        self.new_pairs = new_pairs
+        self.dominated = False
+
+    @property
+    def head(self):
+        return self.arc.head
+
+    @property
+    def arcs(self) -> list[ExplorationArc]:
+        arcs = []
+        path = self
+        while path is not None:
+            arcs.append(path.arc)
+            path = path.parent
+        return arcs[::-1]
+
+    def has_traveled_pair(self, pair_id: int):
+        """Whether this path has been along the (unordered) pair of nodes with this id already"""
+        return (self.traveled_pairs >> pair_id) & 1 == 1
     
 class ExplorationGraph():
     """This is a concrete subclass of Graph where vertices and edges
      are explicitly enumerated. Objects of this type are useful for
      testing graph algorithms."""
 
-    def __init__(self, network_graph: MultiDiGraph, settings: ExplorationGraphSettings, crs="WSG84"):
+    def __init__(self, network_graph: MultiDiGraph, settings: ExplorationGraphSettings, crs="WGS84", spatial_index: SpatialIndex | None = None):
         """Initialises an explicit graph.
         Keyword arguments:
         network_graph - a MultiDiGraph of the network we're exploring. Must include length and traveled edge attributes.
+          It can be a contracted one (see map_data.ChainContraction), in which case part-traveled super-edges are scored
+          by their untraveled segments, and route() expands paths back into the original nodes.
+          Be aware that contracting changes the optimum: paths can't turn around partway along a chain any more.
+        spatial_index - a prebuilt SpatialIndex of the network graph (only needed for a region; built on demand otherwise)
+        crs - no longer used (the heuristic goes by road distance now, not geodesic distance); kept so existing callers still work
         """
 
         assert all(network_graph.has_node(n) for n in settings.start_nodes), "Start node must be in graph"
@@ -48,24 +90,51 @@ class ExplorationGraph():
 
         self.network_graph = network_graph
         self.settings = settings
-        self._goal_locs = [network_graph.nodes[g] for g in settings.goal_nodes]
+        # Shortest distance along the roads from each node to the nearest goal, as a flat array (see best_case_score)
+        self.node_index = {node: i for i, node in enumerate(network_graph.nodes)}
+        self.goal_distance = self.goal_distances(network_graph, settings.goal_nodes, self.node_index)
         # self._start_nodes = [settings.start]
-        self.geod = pyproj.Geod(ellps=crs)
-
-
-    def distance(self, node1, node2):
-        """Returns the distance between two nodes"""
-        return self.geod.inv(node1['x'], node1['y'], node2['x'], node2['y'])[2]
+        # Ids for the (unordered) node pairs that paths have traveled, handed out as the search reaches them.
+        # Handing them out lazily keeps the ids (and so the paths' traveled bitsets) small near the start.
+        # In a contracted graph, parallel super-edges are different roads, so they get their own ids.
+        self.contracted = network_graph.graph.get("contracted", False)
+        self.pair_ids = {}
+        self.pair_count = 0
+        # The pair ids with at least one untraveled arc between them (the only ones that matter for scoring)
+        self.untraveled_pair_ids = set()
+
+        # Look up which edges leave the region once, so scoring an arc is just a set lookup
+        self.outregion_arcs = set()
+        if settings.region is not None:
+            spatial_index = spatial_index or SpatialIndex(network_graph)
+            for u, v, key in spatial_index.edges_outside(settings.region):
+                self.outregion_arcs.update(((u, v, key), (v, u, key)))
+
+
+    @staticmethod
+    def goal_distances(network_graph: MultiDiGraph, goal_nodes: list, node_index: dict):
+        """The shortest path length from every node to any goal (inf if there's no way there), indexed by node_index"""
+        # Dijkstra out from the goals over the reversed graph gives the distances *to* the goals
+        reversed_graph = network_graph.reverse(copy=False) if network_graph.is_directed() else network_graph
+        lengths = nx.multi_source_dijkstra_path_length(reversed_graph, goal_nodes, weight='length')
+        goal_distance = np.full(len(node_index), np.inf)
+        for node, length in lengths.items():
+            goal_distance[node_index[node]] = length
+        return goal_distance
 
     def best_case_score(self, path: ExplorationPath):
         """Return the estimated (best-case) score to a goal node from the given node.
         This method is required for informed search.
         The "best-case" situation assumes that whatever has happened with this pass so far,
         from now on it is able to take new, untraveled roads directly away from/towards the goal as needed.
+        The distance to the goal is the shortest path along the roads, which is never more than what any path has to travel,
+          so this stays a true best case (and is a lot tighter than a straight line).
         """
 
-        head_loc = self.network_graph.nodes[path.arcs[-1].head]
-        dist_to_goal = min(self.distance(head_loc, goal_loc) for goal_loc in self._goal_locs)
+        dist_to_goal = self.goal_distance[self.node_index[path.head]]
+        if dist_to_goal == np.inf:
+            # There's no way to a goal from here
+            return -np.inf
         target_length = self.settings.target_length
 
         scored_dist = max(target_length - path.total_length, 0)
@@ -78,7 +147,7 @@ class ExplorationGraph():
 
     def reached_goal(self, path):
         """Returns true if the given node is a goal node."""
-        return path.arcs[-1].head in self.settings.goal_nodes
+        return path.head in self.settings.goal_nodes
 
     def outgoing_arcs(self, node):
         """Returns a sequence of Arc objects that go out from the given
@@ -88,32 +157,68 @@ class ExplorationGraph():
         arcs = [ExplorationArc(*edge) for edge in self.network_graph.edges(node, data=True, keys=True)]
         return arcs
 
+    def pair_id(self, arc: ExplorationArc):
+        """The id of the (unordered) pair of nodes an arc connects (or of the super-edge itself, in a contracted graph)"""
+        pair = (arc.tail, arc.head, arc.key) if self.contracted else (arc.tail, arc.head)
+        pair_id = self.pair_ids.get(pair)
+        if pair_id is None:
+            pair_id = self.pair_count
+            self.pair_count += 1
+            self.pair_ids[pair] = self.pair_ids[(arc.head, arc.tail, *pair[2:])] = pair_id
+            if self._pair_has_untraveled_arc(arc.tail, arc.head, arc.key if self.contracted else None):
+                self.untraveled_pair_ids.add(pair_id)
+        return pair_id
+
+    def _pair_has_untraveled_arc(self, u, v, key=None):
+        for tail, head in ((u, v), (v, u)):
+            edges = self.network_graph.get_edge_data(tail, head) or {}
+            if key is not None:
+                edges = {key: edges[key]} if key in edges else {}
+            if any(untraveled_length(attributes) > 0 for attributes in edges.values()):
+                return True
+        return False
+
     def continuing_paths(self, path: ExplorationPath):
         """Given a path, return a sequence of paths that continue from it.
         """
 
-        arcs = self.outgoing_arcs(path.arcs[-1].head)
-        return [ExplorationPath(
-                path.arcs + [arc], 
+        paths = []
+        for arc in self.outgoing_arcs(path.head):
+            pair_id = self.pair_id(arc)
+            paths.append(ExplorationPath(
+                path,
+                arc,
                 path.total_length + arc.attributes['length'],
-                path.new_length if arc.attributes["traveled"] else path.new_length + arc.attributes['length'],
-                path.score + self.score_arc(path, arc),
-                path.node_pairs | {(arc.tail, arc.head)}) 
-            for arc in arcs]
+                path.new_length + untraveled_length(arc.attributes),
+                path.score + self.score_arc(path, arc, pair_id),
+                path.traveled_pairs | (1 << pair_id),
+                path.new_pairs | (1 << pair_id) if pair_id in self.untraveled_pair_ids else path.new_pairs))
+        return paths
     
-    def score_arc(self, path: ExplorationPath, arc: ExplorationArc):
+    def score_arc(self, path: ExplorationPath, arc: ExplorationArc, pair_id: int | None = None):
         """Calculate change in a path's score when adding a new arc"""
         # This math is similar to the heuristic, but not quite the same.
         # The heuristic does not clamp the scored distance (it is whatever is optimal)
         # This one clamps scored_dist to the arc's length and considers whether the arc has been traveled
+        # (for a part-traveled super-edge, only its untraveled segments within the remaining distance score)
         length_to_add = arc.attributes['length']
         target_length = self.settings.target_length
 
         remaining_dist = max(target_length - path.total_length, 0)
-        scored_dist = min(length_to_add, remaining_dist)
+        scored_dist = untraveled_within(arc.attributes, arc.tail, remaining_dist)
         overlength_dist = max(length_to_add - remaining_dist, 0)
         overlength_penalty = - (overlength_dist * self.settings.overlength_penalty)
 
-        traveled = arc.attributes["traveled"] or path.has_traveled_arc(arc)
+        traveled = scored_dist == 0 or path.has_traveled_pair(self.pair_id(arc) if pair_id is None else pair_id)
+
+        if (arc.tail, arc.head, arc.key) in self.outregion_arcs:
+            overlength_penalty -= length_to_add * self.settings.outregion_penalty
 
         return overlength_penalty if traveled else scored_dist + overlength_penalty
+
+    def route(self, path: ExplorationPath):
+        """The nodes of a path in the original network graph (expanding any super-edges in a contracted graph)"""
+        arcs = path.arcs[1:]
+        if not arcs:
+            return [path.head]
+        return expand_route(self.network_graph, [(arc.tail, arc.head, arc.key) for arc in arcs])
@@ -1,37 +1,224 @@
+import time
+
+from .DominanceIndex import DominanceIndex
 from .ExplorationGraph import ExplorationArc, ExplorationGraph, ExplorationGraphSettings, ExplorationPath
 from .MaxHeap import MaxHeap
 from .MaxScoreFrontier import MaxScoreFrontier
 import networkx as nx
 
-def optimal_path_search_internal(graph: ExplorationGraph, frontier: MaxScoreFrontier):
+from instrumentation.Instruments import NULL_INSTRUMENTS, Instruments
+
+# How many expansions go by between progress reports to the instruments
+REPORT_EVERY = 1000
+
+
+class SearchStats():
+    """Counters for how much work a search did, updated as it runs"""
+    def __init__(self):
+        self.expanded = 0
+        self.pushed = 0
+        self.popped = 0
+        self.found = 0
+        self.frontier_size = 0
+        self.peak_frontier_size = 0
+        # Paths dropped because they were dominated when they were made
+        self.pruned = 0
+        # Paths already on the frontier that something better turned up for (skipped when popped)
+        self.invalidated = 0
+
+    def update(self, frontier: MaxScoreFrontier, dominance: DominanceIndex | None):
+        self.frontier_size = len(frontier)
+        self.peak_frontier_size = max(self.peak_frontier_size, self.frontier_size)
+        if dominance is not None:
+            self.pruned = dominance.pruned
+            self.invalidated = dominance.invalidated
+
+    def report(self, instruments: Instruments, event: str, **data):
+        """Copy the stats onto the instruments' gauges and emit an event"""
+        for name, value in vars(self).items():
+            instruments.gauge(f"astar_{name}", value)
+        instruments.emit(event, **data)
+
+    def __repr__(self):
+        return (f"SearchStats(expanded={self.expanded}, found={self.found}, frontier_size={self.frontier_size}, "
+                f"peak_frontier_size={self.peak_frontier_size}, pruned={self.pruned}, invalidated={self.invalidated})")
+
+
+class AnytimeResult():
+    """The state of an anytime search: the best route so far and how far from optimal it might be"""
+    def __init__(self, path: ExplorationPath | None, upper_bound: float, elapsed: float, finished: str | None = None):
+        self.path = path
+        self.score = path.score if path is not None else float("-inf")
+        # Nothing left unexplored can score better than this
+        self.upper_bound = upper_bound
+        self.elapsed = elapsed
+        # Why the search stopped ("optimal", "exhausted", "time", or "frontier"), or None if it is still going
+        self.finished = finished
+
+    @property
+    def gap(self):
+        """How much better than the best path so far the optimal path could be (0 once it's proven optimal)"""
+        if self.path is None:
+            return float("inf")
+        return max(self.upper_bound - self.score, 0)
+
+    def __repr__(self):
+        return f"AnytimeResult(score={self.score:.1f}, gap={self.gap:.1f}, elapsed={self.elapsed:.2f}s, finished={self.finished})"
+
+
+def optimal_path_search_internal(graph: ExplorationGraph, frontier: MaxScoreFrontier, dominance: DominanceIndex | None = None, stats: SearchStats | None = None,
+                                 instruments: Instruments | None = None):
     """
     Implements a spicy version of A* search.
     The key unique bit is that, when a goal is found, we don't stop.
     Instead, we keep going until we've explored all paths that could be better (according to the heuristics)
       than the best path found so far.
 
+    With a DominanceIndex, paths that can't do better than another path in the same state are never explored.
+    Since those paths are strictly worse than one that is, this doesn't change the best path,
+      but it does mean the less-optimal paths yielded later won't include them.
+
+    With instruments, the expansions are timed and the stats are reported every REPORT_EVERY expansions and with every path yielded.
     """
 
     found_paths = MaxHeap()
+    stats = stats or SearchStats()
+    instruments = instruments or NULL_INSTRUMENTS
+    expand_timer = instruments.timer("astar_expand")
 
     for starting_node in graph.starting_nodes():
         # Add some single-arc dummy paths to the frontier to start the search
-        frontier.add(ExplorationPath([ExplorationArc(None, starting_node, 0, None),], 0, 0, 0))
+        start_path = ExplorationPath(None, ExplorationArc(None, starting_node, 0, None), 0, 0, 0)
+        if dominance is None or dominance.add(start_path):
+            frontier.add(start_path)
     
     for path in frontier:
-        if graph.reached_goal(path):
-            found_paths.push(path.score, path)
+        stats.popped += 1
+        # Dominated paths are left on the frontier when they're invalidated, so skip them here
+        if not path.dominated:
+            stats.expanded += 1
+            with expand_timer:
+                if graph.reached_goal(path):
+                    found_paths.push(path.score, path)
+                    stats.found += 1
+
+                for cpath in graph.continuing_paths(path):
+                    if dominance is None or dominance.add(cpath):
+                        frontier.add(cpath) # add a new extended path
+                        stats.pushed += 1
 
-        for cpath in graph.continuing_paths(path):
-            frontier.add(cpath) # add a new extended path
+        stats.update(frontier, dominance)
+        if instruments.enabled and stats.expanded % REPORT_EVERY == 0:
+            stats.report(instruments, "astar_progress", found_heap_size=len(found_paths))
 
         if frontier.empty() or (not found_paths.empty() and frontier.best_f_score() < found_paths.peek_score()):
             # If the best available path (best-case) is worse than the best found path, we're done
             # (unless the user wants to keep generating less-optimal paths)
             # We need to check this after expanding the current path, because the best path might be a continuation of the current path
-            yield found_paths.pop()
+            best_path = found_paths.pop()
+            if instruments.enabled:
+                stats.report(instruments, "astar_path", score=best_path.score, total_length=best_path.total_length, found_heap_size=len(found_paths))
+            yield best_path
 
-def optimal_path_search(graph: nx.MultiDiGraph, settings: ExplorationGraphSettings, crs="WGS84"):
-    ex_graph = ExplorationGraph(graph, settings, crs=crs)
+def optimal_path_search(graph: nx.MultiDiGraph, settings: ExplorationGraphSettings, crs="WGS84", prune_dominated=True, stats: SearchStats | None = None,
+                        instruments: Instruments | None = None):
+    """
+    Yields paths from best to worst. Pass in a SearchStats to watch the frontier size and pruning counts as it goes.
+    """
+    instruments = instruments or NULL_INSTRUMENTS
+    with instruments.timer("astar_setup"):
+        ex_graph = ExplorationGraph(graph, settings, crs=crs)
     frontier = MaxScoreFrontier(ex_graph)
-    return optimal_path_search_internal(ex_graph, frontier)
\ No newline at end of file
+    dominance = DominanceIndex() if prune_dominated else None
+    return optimal_path_search_internal(ex_graph, frontier, dominance, stats, instruments)
+
+
+def anytime_path_search_internal(graph: ExplorationGraph, frontier: MaxScoreFrontier, dominance: DominanceIndex | None = None, stats: SearchStats | None = None,
+                                 time_budget: float | None = None, max_frontier_size: int | None = None, report_interval: float = 1.0,
+                                 instruments: Instruments | None = None):
+    """
+    The same search as optimal_path_search_internal, but it reports as it goes instead of waiting until it can prove a path is optimal.
+    Yields an AnytimeResult whenever a better path is found, and otherwise every report_interval seconds if the gap has closed some.
+    The search stops once its best path is proven optimal, the frontier runs dry, time_budget (seconds) runs out,
+      or the frontier grows past max_frontier_size. The last result it yields says which.
+    (Give the frontier a max_size instead of passing max_frontier_size to keep going as a beam search.)
+    """
+
+    start_time = time.monotonic()
+    stats = stats or SearchStats()
+    instruments = instruments or NULL_INSTRUMENTS
+    expand_timer = instruments.timer("astar_expand")
+    best_path = None
+    last_report = start_time
+    last_bound = float("inf")
+
+    for starting_node in graph.starting_nodes():
+        start_path = ExplorationPath(None, ExplorationArc(None, starting_node, 0, None), 0, 0, 0)
+        if dominance is None or dominance.add(start_path):
+            frontier.add(start_path)
+
+    finished = None
+    for path in frontier:
+        stats.popped += 1
+        improved = False
+        if not path.dominated:
+            stats.expanded += 1
+            with expand_timer:
+                if graph.reached_goal(path):
+                    stats.found += 1
+                    if best_path is None or path.score > best_path.score:
+                        best_path = path
+                        improved = True
+
+                for cpath in graph.continuing_paths(path):
+                    if dominance is None or dominance.add(cpath):
+                        frontier.add(cpath)
+                        stats.pushed += 1
+
+        stats.update(frontier, dominance)
+        if instruments.enabled and stats.expanded % REPORT_EVERY == 0:
+            stats.report(instruments, "astar_progress")
+
+        now = time.monotonic()
+        upper_bound = frontier.best_f_score()
+        if best_path is not None and upper_bound <= best_path.score:
+            finished = "optimal"
+        elif frontier.empty():
+            finished = "exhausted"
+        elif time_budget is not None and now - start_time >= time_budget:
+            finished = "time"
+        elif max_frontier_size is not None and len(frontier) > max_frontier_size:
+            finished = "frontier"
+        if finished is not None:
+            break
+
+        if improved or (now - last_report >= report_interval and upper_bound < last_bound):
+            result = AnytimeResult(best_path, upper_bound, now - start_time)
+            if instruments.enabled:
+                stats.report(instruments, "astar_anytime", score=result.score, gap=result.gap)
+            yield result
+            last_report = now
+            last_bound = upper_bound
+
+    if finished is None:
+        # The frontier ran dry straight away
+        finished = "exhausted"
+    result = AnytimeResult(best_path, frontier.best_f_score(), time.monotonic() - start_time, finished)
+    if instruments.enabled:
+        stats.report(instruments, "astar_anytime", score=result.score, gap=result.gap, finished=finished)
+    yield result
+
+def anytime_path_search(graph: nx.MultiDiGraph, settings: ExplorationGraphSettings, crs="WGS84", time_budget: float | None = None,
+                        max_frontier_size: int | None = None, heuristic_weight: float = 1.0, beam_width: int | None = None,
+                        prune_dominated=True, stats: SearchStats | None = None, instruments: Instruments | None = None):
+    """
+    Yields AnytimeResults with the best path so far and its optimality gap, until time_budget (seconds) or max_frontier_size runs out.
+    heuristic_weight below 1 (weighted A*) and beam_width (a capped frontier) find good routes sooner, at the cost of
+      possibly never proving one optimal. The gaps they report are still true bounds.
+    """
+    instruments = instruments or NULL_INSTRUMENTS
+    with instruments.timer("astar_setup"):
+        ex_graph = ExplorationGraph(graph, settings, crs=crs)
+    frontier = MaxScoreFrontier(ex_graph, weight=heuristic_weight, max_size=beam_width)
+    dominance = DominanceIndex() if prune_dominated else None
+    return anytime_path_search_internal(ex_graph, frontier, dominance, stats, time_budget, max_frontier_size, instruments=instruments)
@@ -36,6 +36,14 @@ class MaxHeap():
     def peek_score(self):
         return -self.container[0][0]
 
+    def truncate(self, size: int):
+        """Keep only the best size items. Returns the (score, item) pairs that were dropped, best first."""
+        # A sorted list is still a valid heap
+        self.container.sort()
+        dropped = [(-score, item) for score, _, item in self.container[size:]]
+        del self.container[size:]
+        return dropped
+
     def empty(self):
         return len(self.container) == 0
         
\ No newline at end of file
@@ -8,20 +8,71 @@ class MaxScoreFrontier():
         Additionally, unlike a classic frontier, the nodes are paths through the network (road) graph 
             and we don't keep track of the path-of-paths.
             
-        Pruning wouldn't do any good. The network graph has cycles, yes, 
-        but each node in this graph represents a built-up path through that graph (so there can't be cycles)"""
+        There can't be cycles (each node in this graph is a built-up path through the network graph),
+        but lots of paths end up in the same place having covered the same new roads.
+        optimal_path_search_internal prunes those with a DominanceIndex before they get here."""
 
-    def __init__(self, graph: ExplorationGraph):
-        """ Takes in an ExplorationGraph for calculating the heuristic"""
+    def __init__(self, graph: ExplorationGraph, weight: float = 1.0, max_size: int | None = None):
+        """ Takes in an ExplorationGraph for calculating the heuristic.
+        weight scales the heuristic part of the f-score (weighted A*). Below 1, paths that have already scored
+          are favoured over ones that only might, so the search dives for complete routes sooner.
+        max_size turns the frontier into a beam: when it grows past max_size, the worst paths are dropped
+          (down to 3/4 of max_size, so the sorting is spread over a good number of insertions).
+        Either way, best_f_score stays a true upper bound on any path that was ever on the frontier.
+        """
+        assert weight > 0, "Heuristic weight must be positive"
         self.heap = MaxHeap()
         self.graph = graph
+        self.weight = weight
+        self.max_size = max_size
+        self.dropped = 0
+        # The best f-score of anything dropped by the beam
+        self.dropped_bound = float("-inf")
+        if weight != 1:
+            # With a weight, the heap isn't ordered by the true f-scores anymore, so they get a heap of their own.
+            # Its entries are cleaned out lazily, when they reach the top after their path has left the frontier.
+            self.bound_heap = MaxHeap()
+            self.live = set()
 
     def add(self, path: ExplorationPath):
         heuristic = self.graph.best_case_score(path)
-        self.heap.push(heuristic, path)
-    
+        if heuristic == float("-inf"):
+            # This path can't reach a goal anymore
+            return
+        if self.weight == 1:
+            self.heap.push(heuristic, path)
+        else:
+            self.heap.push(path.score + (heuristic - path.score) * self.weight, path)
+            self.bound_heap.push(heuristic, path)
+            self.live.add(id(path))
+        if self.max_size is not None and len(self.heap) > self.max_size:
+            self.truncate(self.max_size * 3 // 4)
+
+    def truncate(self, size: int):
+        """Drop all but the best size paths"""
+        dropped = self.heap.truncate(size)
+        if not dropped:
+            return
+        self.dropped += len(dropped)
+        if self.weight == 1:
+            self.dropped_bound = max(self.dropped_bound, dropped[0][0])
+        else:
+            for _, path in dropped:
+                self.live.discard(id(path))
+                self.dropped_bound = max(self.dropped_bound, self.graph.best_case_score(path))
+
+    def __len__(self):
+        return len(self.heap)
+
     def best_f_score(self):
-        return self.heap.peek_score()
+        """The best score that any path on (or dropped from) the frontier could possibly reach"""
+        if self.weight == 1:
+            best = self.heap.peek_score() if len(self.heap) > 0 else float("-inf")
+        else:
+            while not self.bound_heap.empty() and id(self.bound_heap.peek()) not in self.live:
+                self.bound_heap.pop()
+            best = self.bound_heap.peek_score() if not self.bound_heap.empty() else float("-inf")
+        return max(best, self.dropped_bound)
     
     def empty(self):
         return len(self.heap) == 0
@@ -33,5 +84,8 @@ class MaxScoreFrontier():
         
     def __next__(self):
         if len(self.heap) > 0:
-            return self.heap.pop()
-        raise StopIteration   # don't change this one
\ No newline at end of file
+            path = self.heap.pop()
+            if self.weight != 1:
+                self.live.discard(id(path))
+            return path
+        raise StopIteration   # don't change this one
@@ -0,0 +1,32 @@
+import networkx as nx
+import numpy as np
+
+
+def city_grid(blocks: int = 30, block_length: float = 110, traveled_fraction: float = 0.5, seed: int = 0, dead_end_density: float = 0):
+    """
+    Make a synthetic city-block grid (like the ones that give the A* search nightmares).
+    Nodes get x/y and proj_pos like the graphs from load_geo.ipynb, edges get length and traveled.
+    dead_end_density is the fraction of intersections that get a dead-end street (half a block long) poking off of them.
+    Deterministic for a given seed, so it's handy for benchmarks without the (private) Wandrer KML.
+    """
+    rng = np.random.default_rng(seed)
+    graph = nx.MultiGraph()
+    for i in range(blocks):
+        for j in range(blocks):
+            proj_pos = np.array([i * block_length, j * block_length])
+            graph.add_node(i * blocks + j, x=proj_pos[0], y=proj_pos[1], proj_pos=proj_pos)
+    for i in range(blocks):
+        for j in range(blocks):
+            node = i * blocks + j
+            if i + 1 < blocks:
+                graph.add_edge(node, node + blocks, length=block_length, traveled=bool(rng.random() < traveled_fraction))
+            if j + 1 < blocks:
+                graph.add_edge(node, node + 1, length=block_length, traveled=bool(rng.random() < traveled_fraction))
+    # The dead ends come after the grid, so adding them doesn't change the grid's traveled statuses
+    dead_end_length = block_length / 2
+    for node in np.flatnonzero(rng.random(blocks * blocks) < dead_end_density).tolist():
+        proj_pos = graph.nodes[node]["proj_pos"] + np.array([dead_end_length, dead_end_length]) / np.sqrt(2)
+        dead_end = graph.number_of_nodes()
+        graph.add_node(dead_end, x=proj_pos[0], y=proj_pos[1], proj_pos=proj_pos)
+        graph.add_edge(node, dead_end, length=dead_end_length, traveled=bool(rng.random() < traveled_fraction))
+    return graph
@@ -0,0 +1,101 @@
+"""
+A quick check of the LocalSearch moves (cut_loops, shortcut, add_spurs) on hand-made walks over a small city grid,
+  where the right answer is easy to work out by hand.
+Exits with an error if any move doesn't do what it should.
+Run with: python -m benchmarks.LocalSearchCheck
+"""
+from dataclasses import replace
+
+import numpy as np
+
+from aco_algo.AntColony import AntColony
+from aco_algo.DeadendnessProvider import StructuralDeadendness
+from aco_algo.LocalSearch import LocalSearch
+from .CityGrid import city_grid
+from .Suite import colony_settings
+
+# A 4x4 grid (node i * 4 + j), all of it traveled except where a check says otherwise, plus an untraveled dead end off of node 1
+BLOCKS = 4
+BLOCK_LENGTH = 110
+DEAD_END = BLOCKS * BLOCKS
+START, GOAL = 0, 4
+
+
+def grid_colony(untraveled: list[tuple[int, int]]):
+    graph = city_grid(BLOCKS, block_length=BLOCK_LENGTH, traveled_fraction=1)
+    for u, v in untraveled:
+        graph.edges[u, v, 0]["traveled"] = False
+    proj_pos = graph.nodes[1]["proj_pos"] + np.array([-BLOCK_LENGTH / 2, 0])
+    graph.add_node(DEAD_END, x=proj_pos[0], y=proj_pos[1], proj_pos=proj_pos)
+    graph.add_edge(1, DEAD_END, length=BLOCK_LENGTH / 2, traveled=False)
+    settings = replace(colony_settings(START, num_ants=10, target_length=2000), goal_nodes=[GOAL])
+    return AntColony(graph, settings, deadendness=StructuralDeadendness())
+
+def walk(colony: AntColony, nodes: list):
+    """The route (node indices) and edge path of a walk through the given nodes, on the colony's compiled graph"""
+    graph = colony.compiled_graph
+    route = np.array([graph.node_index[node] for node in nodes], dtype=np.int64)
+    edge_path = np.array([graph.edge_index[(u, v, 0)] for u, v in zip(nodes[:-1], nodes[1:])], dtype=np.int64)
+    return route, edge_path
+
+def nodes_of(colony: AntColony, route: np.ndarray):
+    return colony.compiled_graph.node_ids[route].tolist()
+
+def check_cut_loops():
+    # A loop of nothing but traveled road gets cut
+    colony = grid_colony(untraveled=[(4, 8)])
+    searcher = LocalSearch(colony.compiled_graph)
+    route, _ = searcher.cut_loops(*walk(colony, [0, 1, 5, 4, 0, 4, 8]))
+    assert nodes_of(colony, route) == [0, 4, 8], f"cut_loops left {nodes_of(colony, route)}"
+    # Unless the loop covers new road of its own (the trip from 4 back to 4 after it still goes)
+    colony = grid_colony(untraveled=[(4, 8), (1, 5)])
+    searcher = LocalSearch(colony.compiled_graph)
+    route, _ = searcher.cut_loops(*walk(colony, [0, 1, 5, 4, 0, 4, 8]))
+    assert nodes_of(colony, route) == [0, 1, 5, 4, 8], f"cut_loops left {nodes_of(colony, route)}"
+    print("cut_loops: ok")
+
+def check_shortcut():
+    colony = grid_colony(untraveled=[])
+    finish = next(iter(colony.finish_nodes))
+    searcher = LocalSearch(colony.compiled_graph)
+    # The long way around from 0 to 4 is all traveled, so it gets swapped for the direct block,
+    #   even though the walk ends with the (free) finish edge right after it
+    route, edge_path = searcher.shortcut(*walk(colony, [0, 1, 5, 4, finish]))
+    assert nodes_of(colony, route) == [0, 4, finish], f"shortcut left {nodes_of(colony, route)}"
+    assert len(edge_path) == len(route) - 1
+    print("shortcut: ok")
+
+def check_add_spurs():
+    colony = grid_colony(untraveled=[])
+    finish = next(iter(colony.finish_nodes))
+    searcher = LocalSearch(colony.compiled_graph)
+    nodes = [0, 1, 5, 4, finish]
+    # Enough length left over for the dead end off of 1 (out and back)
+    route, edge_path = searcher.add_spurs(*walk(colony, nodes), target_length=3 * BLOCK_LENGTH + BLOCK_LENGTH)
+    assert nodes_of(colony, route) == [0, 1, DEAD_END, 1, 5, 4, finish], f"add_spurs made {nodes_of(colony, route)}"
+    assert searcher.new_length(edge_path) == BLOCK_LENGTH / 2
+    # And not enough
+    route, _ = searcher.add_spurs(*walk(colony, nodes), target_length=3 * BLOCK_LENGTH + BLOCK_LENGTH / 2)
+    assert nodes_of(colony, route) == nodes, f"add_spurs made {nodes_of(colony, route)}"
+    print("add_spurs: ok")
+
+def check_improve():
+    # All the moves together never lose new length
+    colony = grid_colony(untraveled=[(4, 8), (1, 5)])
+    finish = next(iter(colony.finish_nodes))
+    searcher = LocalSearch(colony.compiled_graph)
+    route, edge_path = walk(colony, [0, 1, 5, 4, 0, 4, 8, 9, 10, 6, 5, 4, finish])
+    _, _, total, new = searcher.improve(route[0], edge_path, target_length=2000)
+    assert new >= searcher.new_length(edge_path), "improve lost new length"
+    assert total <= 2000
+    print("improve: ok")
+
+def main():
+    check_cut_loops()
+    check_shortcut()
+    check_add_spurs()
+    check_improve()
+    print("LocalSearch checks passed")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""
+Compare the shared-memory worker pool against running the ants sequentially.
+Run with: python -m benchmarks.PoolBenchmark
+"""
+import argparse
+from timeit import timeit
+
+from aco_algo.ACOSettings import ACOSettings
+from aco_algo.AntColony import AntColony
+from .CityGrid import city_grid
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--blocks", type=int, default=40)
+    parser.add_argument("--ants", type=int, default=100)
+    parser.add_argument("--iterations", type=int, default=5)
+    args = parser.parse_args()
+
+    graph = city_grid(args.blocks)
+    start_node = (args.blocks // 2) * args.blocks + args.blocks // 2
+    settings = ACOSettings(
+        num_ants=args.ants, evaporation=0.1, pheromone_weight=0.5, heuristic_weight=0.5,
+        traveled_discount=0.5, deadendness_coeff=10, directional_coeff=1, directional_choosiness=1,
+        finish_boost=0.5, gohome_boost=2, gohome_start_coeff=0.8,
+        start_node=start_node, goal_nodes=[start_node], target_length=5000,
+    )
+
+    times = {}
+    for mode in ("sequential", "pool"):
+        colony = AntColony(graph, settings, mode=mode)
+        colony.run_iteration() # Warm up (the pool's first tasks include starting the workers)
+        times[mode] = timeit(colony.run_iteration, number=args.iterations) / args.iterations
+        colony.close()
+
+    for mode, seconds in times.items():
+        print(f"{mode}: {seconds:.3f}s per iteration")
+    print(f"Pool speedup: {times['sequential'] / times['pool']:.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Benchmarks for both engines: AntColony construction, run_iteration in each mode, Ant.desireabilities,
+and optimal_path_search at increasing target lengths.
+Results are written as JSON, so runs from different commits can be compared (see --compare).
+Runs on a synthetic city grid, so it works offline; pass --kml (and --start) to add a real Wandrer map.
+Run with: python -m benchmarks.Suite --output bench.json
+"""
+import argparse
+from dataclasses import asdict
+import json
+import platform
+import subprocess
+import time
+
+import networkx as nx
+import numpy as np
+
+from aco_algo.ACOSettings import ACOSettings
+from aco_algo.Ant import Ant
+from aco_algo.AntColony import AntColony
+from aco_algo.DeadendnessProvider import BetweennessDeadendness, StructuralDeadendness
+from astar_algo.ExplorationGraph import ExplorationGraphSettings
+from astar_algo.ExplorationSearch import SearchStats, optimal_path_search
+from .CityGrid import city_grid
+
+
+def colony_settings(start_node, num_ants: int, target_length: float, seed: int = 0):
+    return ACOSettings(
+        num_ants=num_ants, evaporation=0.1, pheromone_weight=0.5, heuristic_weight=0.5,
+        traveled_discount=0.5, deadendness_coeff=10, directional_coeff=1, directional_choosiness=1,
+        finish_boost=0.5, gohome_boost=2, gohome_start_coeff=0.8,
+        start_node=start_node, goal_nodes=[start_node], target_length=target_length, seed=seed,
+    )
+
+def measure(function, repeats: int):
+    """Run the function repeats times. Returns the best and mean time per run (in seconds)."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {"best": min(times), "mean": sum(times) / len(times), "repeats": repeats}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def fixtures(args):
+    """The (name, graph, start node) of each map to benchmark on"""
+    grid = city_grid(args.blocks, block_length=args.block_length, traveled_fraction=args.traveled_fraction, dead_end_density=args.dead_end_density)
+    maps = [(f"city_grid_{args.blocks}", grid, (args.blocks // 2) * args.blocks + args.blocks // 2)]
+    if args.kml is not None:
+        # Imported here, since only the KML map needs them (the rest of the suite pulls in shapely, pyproj, and scipy anyway)
+        from map_data.MapData import load_map
+        from map_data.SpatialIndex import SpatialIndex
+        graph = load_map(args.kml).to_graph()
+        lon, lat = args.start
+        maps.append(("kml", graph, SpatialIndex(graph).nearest_nodes([lon], [lat])[0]))
+    return maps
+
+def bench_colony(name, graph, start_node, args):
+    results = []
+    settings = colony_settings(start_node, args.ants, args.target_length)
+
+    for deadendness in (StructuralDeadendness(), BetweennessDeadendness(k=min(args.betweenness_k, graph.number_of_nodes()), seed=0)):
+        timing = measure(lambda: AntColony(graph, settings, deadendness=deadendness), args.construction_repeats)
+        results.append({"benchmark": "colony_construction", "map": name, "params": {"deadendness": deadendness.name}, **timing})
+
+    for mode in ("sequential", "vectorized", "pool"):
+        colony = AntColony(graph, settings, mode=mode, deadendness=StructuralDeadendness())
+        colony.run_iteration() # Warm up (the pool's first tasks include starting the workers)
+        timing = measure(colony.run_iteration, args.iterations)
+        colony.close()
+        results.append({"benchmark": "run_iteration", "map": name, "params": {"mode": mode, "num_ants": args.ants}, **timing})
+
+    colony = AntColony(graph, settings, deadendness=StructuralDeadendness())
+    compiled_graph = colony.compiled_graph
+    ant = Ant(compiled_graph, settings, colony.pheromone, colony.heuristic_tables)
+    start_index = compiled_graph.node_index[start_node]
+    start_slots = np.arange(compiled_graph.offsets[start_index], compiled_graph.offsets[start_index + 1])
+    calls = 1000
+    timing = measure(lambda: [ant.desireabilities(start_slots) for _ in range(calls)], 3)
+    results.append({"benchmark": "desireabilities", "map": name, "params": {"calls": calls}, **timing})
+    return results
+
+def bench_astar(name, graph, start_node, args):
+    """Time the first (optimal) path at each target length, stopping once one takes longer than the limit"""
+    results = []
+    directed = nx.MultiDiGraph(graph)
+    for target_length in args.astar_targets:
+        settings = ExplorationGraphSettings(target_length, overlength_penalty=2, outregion_penalty=0, start_nodes=[start_node], goal_nodes=[start_node])
+        stats = SearchStats()
+        start = time.perf_counter()
+        path = next(optimal_path_search(directed, settings, stats=stats))
+        seconds = time.perf_counter() - start
+        results.append({"benchmark": "optimal_path_search", "map": name, "params": {"target_length": target_length},
+                        "best": seconds, "mean": seconds, "repeats": 1, "score": path.score, "stats": vars(stats)})
+        if seconds > args.astar_limit:
+            break
+    return results
+
+
+def compare(old_path: str, results: list[dict]):
+    """Print how each benchmark's best time changed since an older results file"""
+    with open(old_path) as f:
+        old = {(r["benchmark"], r["map"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"]}
+    for result in results:
+        previous = old.get((result["benchmark"], result["map"], json.dumps(result["params"], sort_keys=True)))
+        if previous is not None:
+            print(f"{result['benchmark']} {result['map']} {result['params']}: {previous['best']:.4f}s -> {result['best']:.4f}s "
+                  f"({previous['best'] / result['best']:.2f}x)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--output", default="bench_output.json")
+    parser.add_argument("--compare", help="An earlier results file to compare against")
+    parser.add_argument("--blocks", type=int, default=30)
+    parser.add_argument("--block-length", type=float, default=110, help="The length of each block in the grid (meters)")
+    parser.add_argument("--traveled-fraction", type=float, default=0.5)
+    parser.add_argument("--dead-end-density", type=float, default=0.1)
+    parser.add_argument("--kml", help="A Wandrer KML export to benchmark on as well")
+    parser.add_argument("--start", type=float, nargs=2, metavar=("LON", "LAT"), help="Where to start on the KML map")
+    parser.add_argument("--ants", type=int, default=100)
+    parser.add_argument("--target-length", type=float, default=5000)
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--construction-repeats", type=int, default=1)
+    parser.add_argument("--betweenness-k", type=int, default=200)
+    parser.add_argument("--astar-targets", type=float, nargs="+", default=[500, 1000, 1500, 2000, 3000])
+    parser.add_argument("--astar-limit", type=float, default=30, help="Stop at the first target length whose search takes longer (seconds)")
+    args = parser.parse_args()
+    assert args.kml is None or args.start is not None, "A KML map needs a --start"
+
+    results = []
+    for name, graph, start_node in fixtures(args):
+        results += bench_colony(name, graph, start_node, args)
+        results += bench_astar(name, graph, start_node, args)
+    for result in results:
+        print(f"{result['benchmark']} {result['map']} {result['params']}: {result['best']:.4f}s")
+
+    meta = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "networkx": nx.__version__,
+        "machine": platform.machine(),
+        "args": vars(args),
+        "settings": asdict(colony_settings(None, args.ants, args.target_length)),
+    }
+    with open(args.output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2, default=str)
+    print(f"Wrote {args.output}")
+    if args.compare is not None:
+        compare(args.compare, results)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+from collections import defaultdict
+import json
+import time
+
+
+class Timer():
+    """Adds the time spent inside a with block to a named timer"""
+    __slots__ = ["instruments", "name", "start"]
+
+    def __init__(self, instruments: "Instruments", name: str):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instruments.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class NullTimer():
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class Instruments():
+    def __init__(self, jsonl_path: str | None = None):
+        """
+        Opt-in instrumentation for both engines: timers, counters, and gauges, plus events (like per-iteration stats)
+          that get passed on to subscribers and/or appended to a JSON lines file.
+        Timers and counters accumulate until reset; gauges hold their latest value.
+        Hot loops should check `enabled` before doing any work for the instruments (see NullInstruments).
+        """
+        self.enabled = True
+        self.subscribers = []
+        self.file = open(jsonl_path, "a") if jsonl_path is not None else None
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.timer_counts = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.gauges = {}
+
+    def timer(self, name: str):
+        """Time a with block"""
+        return Timer(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        self.times[name] += seconds
+        self.timer_counts[name] += 1
+
+    def count(self, name: str, amount: int = 1):
+        self.counters[name] += amount
+
+    def gauge(self, name: str, value):
+        self.gauges[name] = value
+
+    def subscribe(self, callback):
+        """Call callback(event) with every event from now on. Events are dicts with at least an "event" name and a "time"."""
+        self.subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        self.subscribers.remove(callback)
+
+    def snapshot(self):
+        """The current timers (total seconds and count), counters, and gauges"""
+        return {
+            "timers": {name: {"seconds": seconds, "count": self.timer_counts[name]} for name, seconds in self.times.items()},
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+        }
+
+    def emit(self, event: str, **data):
+        """Send an event (with the current snapshot) to the subscribers and the JSON lines file"""
+        record = {"event": event, "time": time.time(), **data, **self.snapshot()}
+        for callback in self.subscribers:
+            callback(record)
+        if self.file is not None:
+            self.file.write(json.dumps(record, default=float) + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class NullInstruments(Instruments):
+    """Instruments that do nothing, for when instrumentation is off (the default everywhere)"""
+    def __init__(self):
+        self.enabled = False
+        self.subscribers = []
+        self.file = None
+        self.null_timer = NullTimer()
+        self.reset()
+
+    def timer(self, name: str):
+        return self.null_timer
+
+    def add_time(self, name: str, seconds: float):
+        pass
+
+    def count(self, name: str, amount: int = 1):
+        pass
+
+    def gauge(self, name: str, value):
+        pass
+
+    def emit(self, event: str, **data):
+        pass
+
+# Shared by everything that isn't given instruments of its own
+NULL_INSTRUMENTS = NullInstruments()
@@ -0,0 +1,176 @@
+import networkx as nx
+import numpy as np
+import shapely
+
+
+def contract_chains(graph: nx.MultiGraph, keep=()):
+    """
+    Contract every maximal chain of pass-through (degree-2) nodes into a single super-edge.
+    Nodes in keep (like the start and goal nodes) are never contracted away.
+    A super-edge carries:
+    - length, traveled_length, and untraveled_length (summed over the chain), with traveled meaning untraveled_length is 0
+    - segments: the (length, traveled) of each original edge, in order from chain_nodes[0]
+    - chain_nodes and chain_edges: the original nodes and (u, v, key) edges, in order from one end to the other
+    - geometry: the chain's geometries joined up (if every edge has one)
+    Edges that aren't part of a longer chain (and rings with nothing to anchor them) are copied over as they are.
+    Use expand_route to turn routes through the contracted graph back into original nodes, and apply_traveled_changes
+      to patch traveled statuses of original edges.
+    Caveat: this changes results, not just speed. A route can't turn around partway along a super-edge any more,
+      so out-and-backs into the middle of a chain are gone (on a subdivided grid, that lowered the A* optimum).
+      That's why it's opt-in everywhere.
+    """
+    keep = set(keep)
+
+    def is_interior(node):
+        return node not in keep and graph.degree(node) == 2 and not graph.has_edge(node, node)
+
+    contracted = nx.MultiGraph(**graph.graph)
+    contracted.graph["contracted"] = True
+    # Where each original edge ended up: (super-edge, segment index), in either direction
+    chain_index = {}
+    contracted.graph["chain_index"] = chain_index
+    contracted.add_nodes_from((node, data) for node, data in graph.nodes(data=True) if not is_interior(node))
+
+    visited = set()
+    chains = []
+    for start in list(contracted.nodes):
+        for _, nbr, key, data in graph.edges(start, keys=True, data=True):
+            if (start, nbr, key) in visited:
+                continue
+            nodes = [start, nbr]
+            edges = [(start, nbr, key, data)]
+            visited.update(((start, nbr, key), (nbr, start, key)))
+            while is_interior(nodes[-1]):
+                current = nodes[-1]
+                # Leave the pass-through node by the edge we didn't come in on
+                _, after, after_key, after_data = next(edge for edge in graph.edges(current, keys=True, data=True)
+                                                       if (current, edge[1], edge[2]) not in visited)
+                visited.update(((current, after, after_key), (after, current, after_key)))
+                nodes.append(after)
+                edges.append((current, after, after_key, after_data))
+
+            if len(edges) == 1:
+                contracted.add_edge(start, nbr, key, **data)
+            else:
+                chains.append((nodes, edges))
+
+    # The super-edges go in after the plain edges, so their (fresh) keys can't clash with a plain edge's own key
+    for nodes, edges in chains:
+        super_key = contracted.add_edge(nodes[0], nodes[-1], **chain_attributes(graph, nodes, edges))
+        for i, (u, v, key, _) in enumerate(edges):
+            chain_index[(u, v, key)] = chain_index[(v, u, key)] = ((nodes[0], nodes[-1], super_key), i)
+
+    # Whatever's left over is rings of pass-through nodes, which stay as they are
+    for u, v, key, data in graph.edges(keys=True, data=True):
+        if (u, v, key) not in visited:
+            for node in (u, v):
+                if node not in contracted:
+                    contracted.add_node(node, **graph.nodes[node])
+            contracted.add_edge(u, v, key, **data)
+    return contracted
+
+def chain_attributes(graph: nx.MultiGraph, nodes: list, edges: list):
+    """The attributes of the super-edge for a chain of nodes and the (u, v, key, data) edges between them"""
+    segments = [(data["length"], bool(data["traveled"])) for _, _, _, data in edges]
+    attributes = {
+        **segment_totals(segments),
+        "chain_nodes": nodes,
+        "chain_edges": [(u, v, key) for u, v, key, _ in edges],
+    }
+    if all("geometry" in data for _, _, _, data in edges):
+        coords = []
+        for (u, _, _, data) in edges:
+            line = np.asarray(data["geometry"].coords)[:, :2]
+            # Geometries run whichever way their edge was stored, so flip the ones that start at the far end
+            start = np.array([graph.nodes[u]["x"], graph.nodes[u]["y"]])
+            if np.linalg.norm(line[-1] - start) < np.linalg.norm(line[0] - start):
+                line = line[::-1]
+            coords.append(line if not coords else line[1:])
+        attributes["geometry"] = shapely.LineString(np.concatenate(coords))
+    return attributes
+
+def segment_totals(segments: list):
+    """A super-edge's length, traveled, and untraveled attributes, worked out from its (length, traveled) segments"""
+    lengths = np.array([length for length, _ in segments], dtype=float)
+    traveled = np.array([traveled for _, traveled in segments], dtype=bool)
+    return {
+        "length": float(lengths.sum()),
+        "traveled_length": float(lengths[traveled].sum()),
+        "untraveled_length": float(lengths[~traveled].sum()),
+        "traveled": not np.any(~traveled),
+        "segments": segments,
+    }
+
+def apply_traveled_changes(graph: nx.MultiGraph, traveled_changed):
+    """
+    Patch the traveled statuses of original edges ((u, v, key, traveled), like MapUpdate.traveled_changed) on a contracted graph.
+    Edges inside a chain update their segment, and the super-edge's totals are worked out again from its segments.
+    Returns the (contracted graph's) keys of the edges that changed.
+    """
+    chain_index = graph.graph.get("chain_index", {})
+    changed = set()
+    for u, v, key, traveled in traveled_changed:
+        if (u, v, key) in chain_index:
+            edge, i = chain_index[(u, v, key)]
+            data = graph.edges[edge]
+            segments = list(data["segments"])
+            segments[i] = (segments[i][0], bool(traveled))
+            data.update(segment_totals(segments))
+            changed.add(edge)
+        elif graph.has_edge(u, v, key):
+            graph.edges[u, v, key]["traveled"] = traveled
+            changed.add((u, v, key))
+    return changed
+
+def original_nodes(graph: nx.MultiGraph):
+    """Every node of the original graph, including the ones contracted away into chains"""
+    nodes = set(graph.nodes)
+    for _, _, chain in graph.edges(data="chain_nodes"):
+        if chain is not None:
+            nodes.update(chain)
+    return nodes
+
+def untraveled_length(data: dict):
+    """The untraveled length of an edge, whether or not it's a super-edge"""
+    return data.get("untraveled_length", 0 if data["traveled"] else data["length"])
+
+def orient_chain(nodes: list, tail):
+    """A super-edge's chain_nodes in the order they're passed when it's traveled from tail, not including tail itself"""
+    return nodes[1:] if nodes[0] == tail else nodes[-2::-1]
+
+def expand_route(graph: nx.MultiGraph, edges):
+    """
+    Turn a route through a contracted graph (a sequence of (tail, head, key) edges, in the order they were traveled)
+      back into the sequence of original nodes.
+    """
+    route = []
+    for tail, head, key in edges:
+        if not route:
+            route.append(tail)
+        nodes = graph.edges[tail, head, key].get("chain_nodes")
+        route.extend(orient_chain(nodes, tail) if nodes is not None else [head])
+    return route
+
+def expand_edges(graph: nx.MultiGraph, edges):
+    """The original (u, v, key) edges behind a collection of edges in a contracted graph"""
+    original = set()
+    for u, v, key in edges:
+        data = graph.edges[u, v, key]
+        original.update(data.get("chain_edges", [(u, v, key)]))
+    return original
+
+def untraveled_within(data: dict, tail, distance: float):
+    """The untraveled length within the first distance (meters) of an edge, when it's traveled from tail"""
+    segments = data.get("segments")
+    if segments is None:
+        return 0 if data["traveled"] else min(data["length"], distance)
+    if data["chain_nodes"][0] != tail:
+        segments = segments[::-1]
+    within = 0
+    for length, traveled in segments:
+        if distance <= 0:
+            break
+        if not traveled:
+            within += min(length, distance)
+        distance -= length
+    return within
@@ -0,0 +1,40 @@
+import xml.etree.ElementTree as ET
+
+import numpy as np
+
+KML_NAMESPACE = "{http://www.opengis.net/kml/2.2}"
+
+# Use this dictionary method so an error is thrown if there's some key I haven't seen at the time of programming
+TRAVEL_TAGS = {"#Traveled": True, "#TraveledUnpaved": True, "#Untraveled": False, "#UntraveledUnpaved": False}
+
+
+def read_linestrings(kml_path: str):
+    """
+    Stream the linestring placemarks out of a Wandrer KML export.
+    Placemarks are parsed one at a time and thrown away afterwards, so the whole document never sits in memory.
+    (The other placemarks are region polygons, which we skip.)
+
+    Returns:
+    - coords: an (n_points, 2) float array of (lon, lat) for every linestring, concatenated
+    - offsets: an (n_linestrings + 1) int array; linestring i is coords[offsets[i]:offsets[i+1]]
+    - traveled: an (n_linestrings) bool array
+    """
+    point_texts = []
+    counts = []
+    traveled = []
+    for _, element in ET.iterparse(kml_path, events=("end",)):
+        if element.tag != KML_NAMESPACE + "Placemark":
+            continue
+        coordinates = element.find(f"{KML_NAMESPACE}LineString/{KML_NAMESPACE}coordinates")
+        if coordinates is not None:
+            points = coordinates.text.split()
+            point_texts.extend(points)
+            counts.append(len(points))
+            traveled.append(TRAVEL_TAGS[element.findtext(KML_NAMESPACE + "styleUrl").strip()])
+        element.clear()
+
+    # Parse all the "lon,lat[,alt]" points in one go
+    values = np.array(",".join(point_texts).split(","), dtype=float) if point_texts else np.zeros(0)
+    coords = values.reshape(len(point_texts), -1)[:, :2] if point_texts else np.zeros((0, 2))
+    offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    return np.ascontiguousarray(coords), offsets, np.array(traveled, dtype=bool)
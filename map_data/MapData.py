@@ -0,0 +1,247 @@
+import hashlib
+import json
+import os
+import shutil
+
+import networkx as nx
+import numpy as np
+import pyproj
+from pyproj.aoi import AreaOfInterest
+from pyproj.database import query_utm_crs_info
+import shapely
+
+from .KMLReader import read_linestrings
+
+GLOBAL_CRS = "WGS84"
+
+
+class MapData():
+    """
+    The preprocessed road network from a Wandrer export, stored as flat arrays.
+    This replaces the KML-to-networkx pipeline from load_geo.ipynb. The arrays are what gets cached to disk
+      (memory-mapped on load), and to_graph() turns them into the networkx graph the algorithms expect.
+
+    Node arrays (one entry per node):
+    - node_ids: the node labels used in the graph (stable across crops)
+    - x, y: lon/lat
+    - proj_pos: (n, 2) position in a UTM projection, in meters
+    Edge arrays (one entry per edge):
+    - edge_u, edge_v, edge_key: the (u, v, key) of the edge in the graph
+    - length: geodesic length in meters
+    - traveled: whether Wandrer says we've been there
+    - coord_start, coord_end: the edge's geometry is coords[coord_start:coord_end]
+    """
+    node_arrays = ["node_ids", "x", "y", "proj_pos"]
+    edge_arrays = ["edge_u", "edge_v", "edge_key", "length", "traveled", "coord_start", "coord_end"]
+
+    def __init__(self, arrays: dict[str, np.ndarray], meta: dict):
+        for name in self.node_arrays + self.edge_arrays + ["coords"]:
+            setattr(self, name, arrays[name])
+        self.meta = meta
+        # Where this map is cached (set by load), so derived data can be cached alongside it
+        self.directory = None
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.edge_u)
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.node_arrays + self.edge_arrays + ["coords"]}
+
+    @classmethod
+    def from_kml(cls, kml_path: str):
+        """Parse and preprocess a Wandrer KML export"""
+        coords, offsets, traveled = read_linestrings(kml_path)
+        starts, ends = offsets[:-1], offsets[1:]
+        length = linestring_lengths(coords, offsets)
+
+        # Nodes are the unique linestring endpoints, numbered in order of first appearance
+        endpoints = np.stack([coords[starts], coords[ends - 1]], axis=1).reshape(-1, 2)
+        unique, first_index, inverse = np.unique(endpoints, axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first_index)
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        endpoint_nodes = rank[inverse.reshape(-1)]
+        edge_u, edge_v = endpoint_nodes[0::2], endpoint_nodes[1::2]
+        node_coords = unique[order]
+
+        arrays = {
+            "node_ids": np.arange(len(node_coords), dtype=np.int64),
+            "x": np.ascontiguousarray(node_coords[:, 0]),
+            "y": np.ascontiguousarray(node_coords[:, 1]),
+            "edge_u": edge_u,
+            "edge_v": edge_v,
+            "edge_key": parallel_edge_keys(edge_u, edge_v),
+            "length": length,
+            "traveled": traveled,
+            "coord_start": starts,
+            "coord_end": ends,
+            "coords": coords,
+        }
+        arrays["proj_pos"], proj_crs = project(arrays["x"], arrays["y"])
+        meta = {"source": os.path.basename(kml_path), "crs": GLOBAL_CRS, "proj_crs": proj_crs}
+        return cls(arrays, meta)
+
+    def save(self, directory: str):
+        """Write the arrays out as .npy files (so they can be memory-mapped) plus a little json metadata"""
+        staging = directory + ".partial"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        for name, array in self.arrays().items():
+            np.save(os.path.join(staging, name + ".npy"), array)
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(self.meta, f)
+        # Only swap the finished cache in at the end, so a crash never leaves half a cache behind
+        shutil.rmtree(directory, ignore_errors=True)
+        os.replace(staging, directory)
+
+    @classmethod
+    def load(cls, directory: str, mmap_mode="r"):
+        """Load a saved cache. By default, arrays are memory-mapped rather than read in."""
+        arrays = {name: np.load(os.path.join(directory, name + ".npy"), mmap_mode=mmap_mode)
+                  for name in cls.node_arrays + cls.edge_arrays + ["coords"]}
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        map_data = cls(arrays, meta)
+        map_data.directory = directory
+        return map_data
+
+    def select(self, node_mask: np.ndarray, edge_mask: np.ndarray):
+        """Returns a new MapData with just the masked nodes and edges (the coordinate array is shared)"""
+        arrays = {name: getattr(self, name)[node_mask] for name in self.node_arrays}
+        arrays.update({name: getattr(self, name)[edge_mask] for name in self.edge_arrays})
+        arrays["coords"] = self.coords
+        selected = MapData(arrays, dict(self.meta))
+        selected.directory = self.directory
+        return selected
+
+    def crop(self, north: float, south: float, east: float, west: float, retain_all=False):
+        """
+        Crop to a lat/lon bounding box, keeping the nodes inside it and the edges between them.
+        Just an array filter over the cached data. Like osmnx's truncate_graph_bbox, only the largest connected
+          component is kept unless retain_all is set. The bounds can be given in either order.
+        """
+        south, north = sorted((north, south))
+        west, east = sorted((east, west))
+        node_mask = (self.y >= south) & (self.y <= north) & (self.x >= west) & (self.x <= east)
+        kept_nodes = self.node_ids[node_mask]
+        edge_mask = np.isin(self.edge_u, kept_nodes) & np.isin(self.edge_v, kept_nodes)
+
+        if not retain_all and edge_mask.any():
+            connectivity = nx.Graph()
+            connectivity.add_edges_from(zip(self.edge_u[edge_mask].tolist(), self.edge_v[edge_mask].tolist()))
+            largest = np.fromiter(max(nx.connected_components(connectivity), key=len), dtype=np.int64)
+            node_mask &= np.isin(self.node_ids, largest)
+            edge_mask &= np.isin(self.edge_u, largest)
+
+        cropped = self.select(node_mask, edge_mask)
+        cropped.meta["bbox"] = [north, south, east, west]
+        return cropped
+
+    def structure_hash(self):
+        """A hash of the nodes and edges (not traveled status), to tell crops of the same map apart"""
+        digest = hashlib.sha256()
+        for name in ["node_ids", "edge_u", "edge_v", "edge_key"]:
+            digest.update(np.ascontiguousarray(getattr(self, name)).tobytes())
+        return digest.hexdigest()[:16]
+
+    def cached_node_values(self, name: str, compute):
+        """
+        A per-node value (like deadendness) that only depends on the structure of the graph, cached alongside the map.
+        compute() should return a {node: value} dict; it's only called if this map (or crop) hasn't been cached yet.
+        Maps that weren't loaded from a cache just compute it every time.
+        """
+        if self.directory is None:
+            return compute()
+        path = os.path.join(self.directory, "node_values", f"{name}-{self.structure_hash()}.npy")
+        if not os.path.exists(path):
+            values = compute()
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename, same as save()
+            staging = path + ".partial.npy"
+            np.save(staging, np.array([values.get(node, 0) for node in self.node_ids.tolist()], dtype=float))
+            os.replace(staging, path)
+        return dict(zip(self.node_ids.tolist(), np.load(path).tolist()))
+
+    def geometries(self):
+        """Build a shapely LineString for every edge (all at once)"""
+        counts = self.coord_end - self.coord_start
+        point_index = np.repeat(self.coord_start - np.concatenate(([0], np.cumsum(counts)[:-1])), counts) + np.arange(counts.sum())
+        return shapely.linestrings(self.coords[point_index], indices=np.repeat(np.arange(self.num_edges), counts))
+
+    def to_graph(self):
+        """Build the networkx graph that the rest of the project works with"""
+        graph = nx.MultiGraph(crs=self.meta["crs"], proj_crs=self.meta["proj_crs"])
+        if "bbox" in self.meta:
+            graph.graph["bbox"] = self.meta["bbox"]
+        graph.add_nodes_from(
+            (node, {"x": x, "y": y, "proj_pos": proj_pos})
+            for node, x, y, proj_pos in zip(self.node_ids.tolist(), self.x.tolist(), self.y.tolist(), np.array(self.proj_pos)))
+        graph.add_edges_from(
+            (u, v, key, {"length": length, "traveled": traveled, "geometry": geometry})
+            for u, v, key, length, traveled, geometry in zip(
+                self.edge_u.tolist(), self.edge_v.tolist(), self.edge_key.tolist(),
+                self.length.tolist(), self.traveled.tolist(), self.geometries()))
+        return graph
+
+
+def linestring_lengths(coords: np.ndarray, offsets: np.ndarray):
+    """Geodesic lengths of every segment, summed up per linestring"""
+    starts, ends = offsets[:-1], offsets[1:]
+    if len(coords) == 0:
+        return np.zeros(len(starts))
+    geod = pyproj.Geod(ellps=GLOBAL_CRS)
+    segment_lengths = np.asarray(geod.inv(coords[:-1, 0], coords[:-1, 1], coords[1:, 0], coords[1:, 1])[2], dtype=float)
+    # The "segments" that jump from the end of one linestring to the start of the next don't count
+    segment_lengths[ends[:-1] - 1] = 0
+    cumulative = np.concatenate(([0], np.cumsum(segment_lengths)))
+    return cumulative[ends - 1] - cumulative[starts]
+
+def parallel_edge_keys(edge_u: np.ndarray, edge_v: np.ndarray):
+    """Number parallel edges between the same (unordered) pair of nodes 0, 1, 2... in order of appearance"""
+    pairs = np.minimum(edge_u, edge_v) * (max(edge_u.max(initial=0), edge_v.max(initial=0)) + 1) + np.maximum(edge_u, edge_v)
+    order = np.argsort(pairs, kind="stable")
+    sorted_pairs = pairs[order]
+    group_starts = np.flatnonzero(np.concatenate(([True], sorted_pairs[1:] != sorted_pairs[:-1])))
+    group_sizes = np.diff(np.concatenate((group_starts, [len(pairs)])))
+    keys = np.empty(len(pairs), dtype=np.int64)
+    keys[order] = np.arange(len(pairs)) - np.repeat(group_starts, group_sizes)
+    return keys
+
+def project(x: np.ndarray, y: np.ndarray):
+    """
+    Find a UTM CRS that fits the data for a cartesian projection, and project the lon/lat points into it.
+    We need that projection to calculate heuristics using euclidean distance.
+    Returns the (n, 2) projected points and the CRS (as "EPSG:xxxxx").
+    """
+    if len(x) == 0:
+        return np.zeros((0, 2)), None
+    aoi = AreaOfInterest(
+        west_lon_degree=float(x.min()),
+        south_lat_degree=float(y.min()),
+        east_lon_degree=float(x.max()),
+        north_lat_degree=float(y.max()),
+    )
+    utm_crs = "EPSG:" + query_utm_crs_info(datum_name="WGS 84", area_of_interest=aoi)[0].code
+    transformer = pyproj.Transformer.from_crs(GLOBAL_CRS, utm_crs, always_xy=True)
+    proj_x, proj_y = transformer.transform(x, y, errcheck=True)
+    return np.stack([proj_x, proj_y], axis=1), utm_crs
+
+def file_hash(path: str):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def load_map(kml_path: str, cache_dir: str = ".map_cache"):
+    """
+    Load a Wandrer KML export, going through an on-disk cache keyed on the file's hash.
+    The first load parses and preprocesses the KML; later loads just memory-map the cached arrays.
+    """
+    directory = os.path.join(cache_dir, file_hash(kml_path)[:16])
+    if not os.path.exists(os.path.join(directory, "meta.json")):
+        print(f"Building map cache for {kml_path}")
+        MapData.from_kml(kml_path).save(directory)
+    return MapData.load(directory)
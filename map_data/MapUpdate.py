@@ -0,0 +1,170 @@
+import os
+
+import networkx as nx
+import numpy as np
+import pyproj
+import shapely
+
+from .KMLReader import read_linestrings
+from .MapData import GLOBAL_CRS, MapData, file_hash, linestring_lengths
+
+
+class MapUpdate():
+    def __init__(self, traveled_changed: list, added: list, removed: list, new_nodes: dict):
+        """
+        The difference between two Wandrer exports of the same area, in graph terms.
+        - traveled_changed: (u, v, key, traveled) for edges whose traveled status flipped
+        - added: (u, v, key, attributes) for new edges
+        - removed: (u, v, key) for edges that disappeared
+        - new_nodes: {node: attributes} for nodes that only the new edges touch
+        """
+        self.traveled_changed = traveled_changed
+        self.added = added
+        self.removed = removed
+        self.new_nodes = new_nodes
+
+    def structural(self):
+        """Whether the update changes the shape of the graph (and not just traveled statuses)"""
+        return bool(self.added or self.removed)
+
+    def __repr__(self):
+        return f"MapUpdate({len(self.traveled_changed)} traveled changes, {len(self.added)} added, {len(self.removed)} removed)"
+
+    def apply(self, graph: nx.MultiGraph):
+        """
+        Patch a graph built by MapData.to_graph (possibly cropped) in place.
+        Changes to edges that aren't in the graph are ignored, and new nodes outside a cropped graph's bbox are left out.
+        """
+        for u, v, key, traveled in self.traveled_changed:
+            if graph.has_edge(u, v, key):
+                graph.edges[u, v, key]["traveled"] = traveled
+
+        for u, v, key in self.removed:
+            if graph.has_edge(u, v, key):
+                graph.remove_edge(u, v, key)
+                graph.remove_nodes_from([node for node in (u, v) if graph.degree(node) == 0])
+
+        bbox = graph.graph.get("bbox")
+        for u, v, key, attributes in self.added:
+            for node in (u, v):
+                if node not in graph and node in self.new_nodes and in_bbox(self.new_nodes[node], bbox):
+                    graph.add_node(node, **self.new_nodes[node])
+            if u in graph and v in graph:
+                graph.add_edge(u, v, key, **attributes)
+
+
+def in_bbox(node: dict, bbox: list | None):
+    if bbox is None:
+        return True
+    north, south, east, west = bbox
+    return south <= node["y"] <= north and west <= node["x"] <= east
+
+def diff_kml(old_map: MapData, kml_path: str):
+    """
+    Compare a new Wandrer export against the (cached) map it's an update of.
+    Edges are matched up by their exact geometry, and nodes by their coordinates, so everything that
+      didn't change keeps its node ids and edge keys.
+    Returns the updated MapData and the MapUpdate describing the changes.
+    """
+    coords, offsets, traveled = read_linestrings(kml_path)
+    starts, ends = offsets[:-1], offsets[1:]
+
+    # Match up the new linestrings with the old edges
+    # (Several edges can share a geometry, e.g. both directions of a road exported separately, so each geometry keeps
+    #   a list of its old edges, and every new linestring with that geometry uses up one of them)
+    old_edges = {}
+    for i, (start, end) in enumerate(zip(old_map.coord_start.tolist(), old_map.coord_end.tolist())):
+        old_edges.setdefault(old_map.coords[start:end].tobytes(), []).append(i)
+    def match(geometry: bytes):
+        candidates = old_edges.get(geometry)
+        return candidates.pop(0) if candidates else -1
+    matches = np.array([match(coords[start:end].tobytes()) for start, end in zip(starts.tolist(), ends.tolist())], dtype=np.int64)
+    matched = np.flatnonzero(matches >= 0)
+    unmatched = np.flatnonzero(matches < 0)
+    removed = np.array(sorted(i for candidates in old_edges.values() for i in candidates), dtype=np.int64)
+
+    # The old edges that are still around get their new traveled status and geometry location
+    kept = matches[matched]
+    flipped = matched[old_map.traveled[kept] != traveled[matched]]
+    new_start = np.empty(old_map.num_edges, dtype=np.int64)
+    new_end = np.empty(old_map.num_edges, dtype=np.int64)
+    new_traveled = np.array(old_map.traveled)
+    new_start[kept], new_end[kept] = starts[matched], ends[matched]
+    new_traveled[kept] = traveled[matched]
+    # (Every old edge is either matched or removed, so the kept ones are exactly the ones with a new geometry location)
+    keep_mask = np.zeros(old_map.num_edges, dtype=bool)
+    keep_mask[kept] = True
+
+    # New edges reuse the existing nodes where their endpoints line up, and get fresh node ids elsewhere
+    node_lookup = {xy: node for node, xy in zip(old_map.node_ids.tolist(), zip(old_map.x.tolist(), old_map.y.tolist()))}
+    next_node = int(old_map.node_ids.max(initial=-1)) + 1
+    new_nodes = {}
+    added_u, added_v = [], []
+    for i in unmatched.tolist():
+        endpoints = []
+        for xy in (tuple(coords[starts[i]].tolist()), tuple(coords[ends[i] - 1].tolist())):
+            if xy not in node_lookup:
+                node_lookup[xy] = next_node
+                new_nodes[next_node] = xy
+                next_node += 1
+            endpoints.append(node_lookup[xy])
+        added_u.append(endpoints[0])
+        added_v.append(endpoints[1])
+
+    # Parallel edge keys for new edges carry on from the highest key already in use between the same nodes
+    used_keys = {}
+    for u, v, key in zip(old_map.edge_u[keep_mask].tolist(), old_map.edge_v[keep_mask].tolist(), old_map.edge_key[keep_mask].tolist()):
+        pair = (min(u, v), max(u, v))
+        used_keys[pair] = max(used_keys.get(pair, -1), key)
+    added_key = []
+    for u, v in zip(added_u, added_v):
+        pair = (min(u, v), max(u, v))
+        used_keys[pair] = used_keys.get(pair, -1) + 1
+        added_key.append(used_keys[pair])
+
+    # Project the new nodes the same way as the old ones
+    node_x = np.array([xy[0] for xy in new_nodes.values()], dtype=float)
+    node_y = np.array([xy[1] for xy in new_nodes.values()], dtype=float)
+    if new_nodes:
+        transformer = pyproj.Transformer.from_crs(GLOBAL_CRS, old_map.meta["proj_crs"], always_xy=True)
+        node_proj = np.stack(transformer.transform(node_x, node_y, errcheck=True), axis=1)
+    else:
+        node_proj = np.zeros((0, 2))
+
+    added_length = linestring_lengths(coords, offsets)[unmatched]
+    arrays = {
+        "node_ids": np.concatenate((old_map.node_ids, np.array(list(new_nodes), dtype=np.int64))),
+        "x": np.concatenate((old_map.x, node_x)),
+        "y": np.concatenate((old_map.y, node_y)),
+        "proj_pos": np.concatenate((old_map.proj_pos, node_proj)),
+        "edge_u": np.concatenate((old_map.edge_u[keep_mask], np.array(added_u, dtype=np.int64))),
+        "edge_v": np.concatenate((old_map.edge_v[keep_mask], np.array(added_v, dtype=np.int64))),
+        "edge_key": np.concatenate((old_map.edge_key[keep_mask], np.array(added_key, dtype=np.int64))),
+        "length": np.concatenate((old_map.length[keep_mask], added_length)),
+        "traveled": np.concatenate((new_traveled[keep_mask], traveled[unmatched])),
+        "coord_start": np.concatenate((new_start[keep_mask], starts[unmatched])),
+        "coord_end": np.concatenate((new_end[keep_mask], ends[unmatched])),
+        "coords": coords,
+    }
+    new_map = MapData(arrays, dict(old_map.meta, source=os.path.basename(kml_path)))
+
+    # And describe it all in graph terms
+    old_index = matches[flipped]
+    traveled_changed = list(zip(old_map.edge_u[old_index].tolist(), old_map.edge_v[old_index].tolist(),
+                                old_map.edge_key[old_index].tolist(), traveled[flipped].tolist()))
+    geometries = [shapely.LineString(coords[starts[i]:ends[i]]) for i in unmatched.tolist()]
+    added = [(u, v, key, {"length": length, "traveled": is_traveled, "geometry": geometry})
+             for u, v, key, length, is_traveled, geometry in zip(added_u, added_v, added_key, added_length.tolist(), traveled[unmatched].tolist(), geometries)]
+    removed = list(zip(old_map.edge_u[removed].tolist(), old_map.edge_v[removed].tolist(), old_map.edge_key[removed].tolist()))
+    new_nodes = {node: {"x": x, "y": y, "proj_pos": proj_pos} for node, x, y, proj_pos in zip(new_nodes, node_x.tolist(), node_y.tolist(), node_proj)}
+    return new_map, MapUpdate(traveled_changed, added, removed, new_nodes)
+
+def update_map(old_map: MapData, kml_path: str, cache_dir: str = ".map_cache"):
+    """
+    Refresh a cached map from a new Wandrer export (e.g. after a ride) without rebuilding it from scratch.
+    The updated map is cached under the new file's hash, so loading the new export later reuses it (and its node ids).
+    Returns the updated MapData and the MapUpdate, which can be applied to graphs and colonies built from the old map.
+    """
+    new_map, update = diff_kml(old_map, kml_path)
+    new_map.save(os.path.join(cache_dir, file_hash(kml_path)[:16]))
+    return new_map, update
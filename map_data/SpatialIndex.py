@@ -0,0 +1,77 @@
+import networkx as nx
+import numpy as np
+import pyproj
+from scipy.spatial import cKDTree
+import shapely
+from shapely import Polygon
+
+from .MapData import GLOBAL_CRS
+
+
+class SpatialIndex():
+    def __init__(self, graph: nx.MultiGraph):
+        """
+        Spatial lookups for a road graph (as built by MapData.to_graph): a KD-tree over the nodes' projected
+          positions, and an STRtree over the edge geometries (in lon/lat).
+        Build it once per graph; every query after that is cheap.
+        Coordinates going in are always lon/lat. Distances are in meters.
+        """
+        self.node_ids = np.empty(graph.number_of_nodes(), dtype=object)
+        self.node_ids[:] = list(graph.nodes)
+        nodes = graph.nodes
+        self.x = np.array([nodes[n]["x"] for n in self.node_ids], dtype=float)
+        self.y = np.array([nodes[n]["y"] for n in self.node_ids], dtype=float)
+        self.proj_pos = np.array([nodes[n]["proj_pos"] for n in self.node_ids], dtype=float).reshape(-1, 2)
+        self.kdtree = cKDTree(self.proj_pos)
+
+        self.edge_keys = list(graph.edges(keys=True))
+        # Edges without a geometry are treated as straight lines between their nodes
+        self.geometries = np.array([
+            data.get("geometry") or shapely.LineString([(nodes[u]["x"], nodes[u]["y"]), (nodes[v]["x"], nodes[v]["y"])])
+            for u, v, data in graph.edges(data=True)], dtype=object)
+        self.strtree = shapely.STRtree(self.geometries)
+
+        proj_crs = graph.graph.get("proj_crs")
+        self.transformer = pyproj.Transformer.from_crs(GLOBAL_CRS, proj_crs, always_xy=True) if proj_crs else None
+
+    def project(self, lons, lats):
+        """Project lon/lat points into the graph's projected (proj_pos) coordinates"""
+        assert self.transformer is not None, "Graph has no proj_crs to project into"
+        proj_x, proj_y = self.transformer.transform(np.asarray(lons, dtype=float), np.asarray(lats, dtype=float))
+        return np.stack([np.atleast_1d(proj_x), np.atleast_1d(proj_y)], axis=1)
+
+    def nearest_nodes(self, lons, lats):
+        """Snap a batch of lon/lat points to their nearest nodes. Returns a list of nodes."""
+        _, indices = self.kdtree.query(self.project(lons, lats))
+        return self.node_ids[indices].tolist()
+
+    def nodes_within(self, lon: float, lat: float, radius: float):
+        """All the nodes within radius meters of a lon/lat point"""
+        indices = self.kdtree.query_ball_point(self.project([lon], [lat])[0], radius)
+        return self.node_ids[np.array(indices, dtype=np.int64)].tolist()
+
+    def node_mask(self, polygon: Polygon):
+        """A boolean mask (over self.node_ids) of the nodes inside a lon/lat polygon"""
+        return shapely.contains_xy(polygon, self.x, self.y)
+
+    def nodes_in_polygon(self, polygon: Polygon):
+        return self.node_ids[self.node_mask(polygon)].tolist()
+
+    def edges_in_polygon(self, polygon: Polygon, predicate="intersects"):
+        """
+        The (u, v, key) of the edges matching a lon/lat polygon.
+        The predicate is applied as predicate(polygon, edge), so use predicate="contains" for edges entirely inside it.
+        """
+        return [self.edge_keys[i] for i in sorted(self.strtree.query(polygon, predicate=predicate))]
+
+    def edges_outside(self, polygon: Polygon):
+        """The (u, v, key) of the edges that aren't entirely inside a lon/lat polygon"""
+        inside = np.zeros(len(self.edge_keys), dtype=bool)
+        inside[self.strtree.query(polygon, predicate="contains")] = True
+        return [key for key, is_inside in zip(self.edge_keys, inside) if not is_inside]
+
+    def crop(self, graph: nx.MultiGraph, north: float, south: float, east: float, west: float):
+        """Crop a graph to a lat/lon bounding box (the nodes inside it and the edges between them)"""
+        south, north = sorted((north, south))
+        west, east = sorted((east, west))
+        return graph.subgraph(self.nodes_in_polygon(shapely.box(west, south, east, north))).copy()
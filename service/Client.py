@@ -0,0 +1,71 @@
+"""
+A little client for the RouteService (and a stand-in for whatever UI ends up talking to it).
+Run with: python -m service.Client LON LAT [--goal LON LAT] [--target-length 20000] [--format gpx] [--output route.gpx]
+"""
+import argparse
+import json
+import urllib.error
+import urllib.request
+
+
+class RouteClient():
+    def __init__(self, host: str = "127.0.0.1", port: int = 8765, timeout: float = 120):
+        self.url = f"http://{host}:{port}"
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: dict | None = None):
+        """Make a request. Returns the status and the response body (parsed if it's JSON)."""
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                status, content_type, content = response.status, response.headers.get("Content-Type", ""), response.read()
+        except urllib.error.HTTPError as e:
+            status, content_type, content = e.code, e.headers.get("Content-Type", ""), e.read()
+        return status, json.loads(content) if content_type == "application/json" else content.decode()
+
+    def route(self, start: tuple[float, float], goal: tuple[float, float] | None = None, engine: str = "aco",
+              settings: dict | None = None, budget: float | None = None, format: str = "geojson", region: str | None = None):
+        body = {"start": list(start), "engine": engine, "format": format, "settings": settings or {}}
+        if goal is not None:
+            body["goal"] = list(goal)
+        if budget is not None:
+            body["budget"] = budget
+        if region is not None:
+            body["region"] = region
+        return self.request("POST", "/route", body)
+
+    def metrics(self):
+        return self.request("GET", "/metrics")[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("start", type=float, nargs=2, metavar=("LON", "LAT"))
+    parser.add_argument("--goal", type=float, nargs=2, metavar=("LON", "LAT"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--engine", default="aco", choices=["aco", "astar"])
+    parser.add_argument("--target-length", type=float, default=20000)
+    parser.add_argument("--budget", type=float)
+    parser.add_argument("--format", default="geojson", choices=["geojson", "gpx"])
+    parser.add_argument("--output", help="Where to write the route (printed otherwise)")
+    args = parser.parse_args()
+
+    client = RouteClient(args.host, args.port)
+    status, route = client.route(args.start, args.goal, args.engine, {"target_length": args.target_length}, args.budget, args.format)
+    if status != 200:
+        print(f"Error {status}: {route}")
+        return
+    if args.format == "geojson":
+        print(json.dumps(route["properties"], indent=2))
+        route = json.dumps(route)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            f.write(route)
+        print(f"Wrote {args.output}")
+    else:
+        print(route)
+
+if __name__ == "__main__":
+    main()
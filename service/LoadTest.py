@@ -0,0 +1,56 @@
+"""
+Load test a running RouteService: fire off requests from a bunch of client threads at once, and report
+  the latencies, how many got turned away (503s), and the service's own metrics afterwards.
+Starts are jittered around a point, so the requests aren't all exact repeats.
+Run with: python -m service.LoadTest LON LAT --requests 50 --concurrency 8
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter
+import json
+import time
+
+import numpy as np
+
+from .Client import RouteClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("start", type=float, nargs=2, metavar=("LON", "LAT"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--jitter", type=float, default=0.01, help="How far to move the starts around (degrees)")
+    parser.add_argument("--engine", default="aco", choices=["aco", "astar"])
+    parser.add_argument("--target-length", type=float, default=10000)
+    parser.add_argument("--budget", type=float, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    client = RouteClient(args.host, args.port)
+    rng = np.random.default_rng(args.seed)
+    starts = np.asarray(args.start) + rng.uniform(-args.jitter, args.jitter, size=(args.requests, 2))
+
+    def one_request(start):
+        begin = time.perf_counter()
+        status, _ = client.route(tuple(start), engine=args.engine, settings={"target_length": args.target_length}, budget=args.budget)
+        return status, time.perf_counter() - begin
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        replies = list(executor.map(one_request, starts.tolist()))
+    elapsed = time.perf_counter() - begin
+
+    statuses = Counter(status for status, _ in replies)
+    latencies = np.array([latency for status, latency in replies if status == 200])
+    print(f"{args.requests} requests in {elapsed:.1f}s ({args.requests / elapsed:.2f}/s), statuses: {dict(statuses)}")
+    if len(latencies):
+        print("Latency (successful requests): " + ", ".join(f"p{p} {np.percentile(latencies, p):.2f}s" for p in (50, 95, 99))
+              + f", max {latencies.max():.2f}s")
+    print("Service metrics:")
+    print(json.dumps(client.metrics(), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,383 @@
+"""
+A long-running local route planning service.
+It loads a cached Wandrer map once and keeps warm colonies (and the A* search's graphs) for each region,
+  so a route request only pays for the search itself.
+Run with: python -m service.RouteService --kml wandrer.kml [--region NAME NORTH SOUTH EAST WEST ...]
+
+Endpoints (plain HTTP over TCP, or a Unix socket with --socket):
+- POST /route with a JSON body:
+    {"start": [lon, lat], "goal": [lon, lat] (default: back to the start), "region": name (default: the first one containing the start),
+     "engine": "aco" or "astar", "settings": {ACOSettings overrides, like "target_length"}, "budget": seconds, "format": "geojson" or "gpx"}
+  Returns the route as a GeoJSON Feature (with the score and lengths in its properties) or as a GPX track.
+- GET /metrics: request latencies, queue depth, and the instruments' timers and counters
+- GET /health
+Requests beyond --max-pending (queued plus running) are turned away with a 503, so a burst can't pile up forever.
+"""
+import argparse
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields, replace
+import json
+import threading
+import time
+from xml.sax.saxutils import escape
+
+import networkx as nx
+import numpy as np
+import shapely
+
+from aco_algo.ACOSettings import ACOSettings
+from aco_algo.AntColony import AntColony
+from aco_algo.ColonyOptimizer import ColonyOptimizer
+from aco_algo.DeadendnessProvider import BetweennessDeadendness
+from aco_algo.OptimizerSettings import OptimizerSettings
+from aco_algo.PheromoneCache import PheromoneCache
+from astar_algo.DominanceIndex import DominanceIndex
+from astar_algo.ExplorationGraph import ExplorationGraph, ExplorationGraphSettings
+from astar_algo.ExplorationSearch import MaxScoreFrontier, anytime_path_search_internal
+from instrumentation.Instruments import Instruments
+from map_data.MapData import MapData, load_map
+from map_data.SpatialIndex import SpatialIndex
+
+# The settings a request doesn't get to override (they come from its start and goal)
+fixed_settings = ["start_node", "goal_nodes"]
+
+
+def default_settings(start_node, target_length: float = 20000):
+    return ACOSettings(
+        num_ants=100, evaporation=0.1, pheromone_weight=0.5, heuristic_weight=0.5,
+        traveled_discount=0.5, deadendness_coeff=10, directional_coeff=1, directional_choosiness=1,
+        finish_boost=0.5, gohome_boost=2, gohome_start_coeff=0.8,
+        start_node=start_node, goal_nodes=[start_node], target_length=target_length,
+    )
+
+
+class RequestError(Exception):
+    """A bad request, reported back to the client with a status code"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def is_number(value):
+    # (JSON true/false come through as bools, which Python would happily count as 1 and 0)
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and bool(np.isfinite(value))
+
+def coerce_setting(name: str, value, field_type):
+    """A settings override as its ACOSettings field's type, or a 400 if it isn't one"""
+    if value is None and field_type == (int | None):
+        return None
+    if not is_number(value):
+        raise RequestError(400, f"Setting {name} should be a number")
+    if field_type in (int, int | None):
+        if value != int(value):
+            raise RequestError(400, f"Setting {name} should be a whole number")
+        return int(value)
+    return float(value)
+
+
+class Region():
+    def __init__(self, name: str, graph: nx.MultiGraph, num_colonies: int, contract_chains: bool = False):
+        """
+        One region's worth of warm state: its graph (undirected for the ants, directed for the A* search), a spatial index
+          for snapping coordinates, and a pool of idle AntColonies (each request checks one out while it runs).
+        The graph should already carry a betweenness_centrality for every node, so the colonies reuse it (see from_map).
+        With contract_chains, the colonies walk a chain-contracted graph (see AntColony's contract). The A* search never does.
+        """
+        print(f"Preparing region {name}")
+        self.name = name
+        self.graph = graph
+        self.directed_graph = nx.MultiDiGraph(self.graph)
+        self.spatial_index = SpatialIndex(self.graph)
+        x = [x for _, x in graph.nodes(data="x")]
+        y = [y for _, y in graph.nodes(data="y")]
+        self.bounds = shapely.box(min(x), min(y), max(x), max(y))
+
+        start_node = next(iter(self.graph.nodes))
+        self.colonies = asyncio.Queue()
+        for _ in range(num_colonies):
+            self.colonies.put_nowait(AntColony(self.graph, default_settings(start_node), contract=contract_chains))
+
+    @classmethod
+    def from_map(cls, name: str, map_data: MapData, num_colonies: int, deadendness: BetweennessDeadendness, contract_chains: bool = False):
+        """A region for a (cropped) map, with its deadendness computed once and cached alongside the map"""
+        graph = map_data.to_graph()
+        betweenness = map_data.cached_node_values(deadendness.name, lambda: deadendness.centrality(graph))
+        nx.set_node_attributes(graph, betweenness, 'betweenness_centrality')
+        return cls(name, graph, num_colonies, contract_chains)
+
+    def contains(self, lon: float, lat: float):
+        return shapely.contains_xy(self.bounds, lon, lat)
+
+
+class RouteService():
+    def __init__(self, regions: dict[str, Region], workers: int = 4, max_pending: int = 16, default_budget: float = 10,
+                 max_budget: float = 60, cache: PheromoneCache | None = None):
+        """
+        Routes requests to their region's warm colonies (or the A* search), running them on a pool of worker threads.
+        The numpy-heavy parts of both engines run alongside each other well enough; give the colonies mode="pool"
+          (or run several services) to get past the GIL for big colonies.
+        With a PheromoneCache, colony runs are warm started from (and exact repeats answered by) earlier runs.
+        """
+        self.regions = regions
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.default_budget = default_budget
+        self.max_budget = max_budget
+        self.cache = cache
+        # The cache's index isn't safe to share between threads
+        self.cache_lock = threading.Lock()
+
+        self.instruments = Instruments()
+        self.pending = 0
+        self.running = 0
+        # The latencies of the most recent requests, for percentiles
+        self.latencies = deque(maxlen=1000)
+
+    def update_gauges(self):
+        self.instruments.gauge("queue_depth", self.pending - self.running)
+        self.instruments.gauge("running", self.running)
+
+    def pick_region(self, request: dict, lon: float, lat: float):
+        name = request.get("region")
+        if name is not None:
+            if name not in self.regions:
+                raise RequestError(404, f"Unknown region {name}")
+            return self.regions[name]
+        for region in self.regions.values():
+            if region.contains(lon, lat):
+                return region
+        raise RequestError(404, "The start isn't in any region")
+
+    def request_settings(self, request: dict, start_node, goal_node):
+        overrides = request.get("settings", {})
+        if not isinstance(overrides, dict):
+            raise RequestError(400, "settings should be an object")
+        types = {field.name: field.type for field in fields(ACOSettings) if field.name not in fixed_settings}
+        unknown = set(overrides) - set(types)
+        if unknown:
+            raise RequestError(400, f"Unknown settings: {', '.join(sorted(unknown))}")
+        overrides = {name: coerce_setting(name, value, types[name]) for name, value in overrides.items()}
+        settings = replace(default_settings(start_node), **overrides)
+        return replace(settings, start_node=start_node, goal_nodes=[goal_node])
+
+    async def plan(self, request: dict):
+        """Snap a route request to its region's nodes and run it. Returns the planned route's nodes, region, and stats."""
+        try:
+            start = [float(x) for x in request["start"]]
+            goal = [float(x) for x in request.get("goal", start)]
+        except (KeyError, TypeError, ValueError):
+            raise RequestError(400, "start (and goal) should be [lon, lat]")
+        engine = request.get("engine", "aco")
+        if engine not in ("aco", "astar"):
+            raise RequestError(400, f"Unknown engine {engine}")
+        budget = request.get("budget", self.default_budget)
+        if not is_number(budget) or not budget > 0:
+            raise RequestError(400, "budget should be a positive number of seconds")
+        budget = min(float(budget), self.max_budget)
+
+        region = self.pick_region(request, *start)
+        start_node, goal_node = region.spatial_index.nearest_nodes([start[0], goal[0]], [start[1], goal[1]])
+        settings = self.request_settings(request, start_node, goal_node)
+
+        loop = asyncio.get_running_loop()
+        if engine == "aco":
+            colony = await region.colonies.get()
+            try:
+                self.running += 1
+                self.update_gauges()
+                route, stats = await loop.run_in_executor(self.executor, self.run_colony, colony, settings, budget)
+            finally:
+                self.running -= 1
+                region.colonies.put_nowait(colony)
+        else:
+            self.running += 1
+            self.update_gauges()
+            try:
+                route, stats = await loop.run_in_executor(self.executor, self.run_astar, region, settings, budget)
+            finally:
+                self.running -= 1
+        # The colonies' finish nodes aren't real places
+        route = [node for node in route if node in region.graph]
+        return route, region, {"engine": engine, "region": region.name, "start_node": start_node, "goal_node": goal_node, **stats}
+
+    def run_colony(self, colony: AntColony, settings: ACOSettings, budget: float):
+        colony.update_settings(settings)
+        optimizer = ColonyOptimizer(colony, OptimizerSettings(time_budget=budget))
+        cached = None
+        if self.cache is not None:
+            with self.cache_lock:
+                cached = self.cache.lookup(colony)
+                if cached is None:
+                    self.cache.warm_start(optimizer)
+        if cached is not None:
+            optimizer.inject(cached)
+            self.instruments.count("cache_hits")
+        else:
+            optimizer.run()
+            if self.cache is not None:
+                with self.cache_lock:
+                    self.cache.store(optimizer)
+        best = optimizer.best_result
+        if best is None:
+            raise RequestError(500, "The colony didn't find a route")
+        return best.route, {"score": optimizer.best_score, "length": best.total_length,
+                            "new_length": best.newly_traveled_length, "iterations": optimizer.iteration, "cached": cached is not None}
+
+    def run_astar(self, region: Region, settings: ACOSettings, budget: float):
+        ex_settings = ExplorationGraphSettings(settings.target_length, overlength_penalty=2, outregion_penalty=0,
+                                               start_nodes=[settings.start_node], goal_nodes=settings.goal_nodes)
+        ex_graph = ExplorationGraph(region.directed_graph, ex_settings, crs="WGS84", spatial_index=region.spatial_index)
+        result = None
+        for result in anytime_path_search_internal(ex_graph, MaxScoreFrontier(ex_graph), DominanceIndex(), time_budget=budget):
+            pass
+        if result is None or result.path is None:
+            raise RequestError(500, "The search didn't find a route in time")
+        return ex_graph.route(result.path), {"score": result.score, "length": result.path.total_length,
+                                             "new_length": result.path.new_length, "gap": result.gap, "finished": result.finished}
+
+    async def handle_route(self, request: dict):
+        if self.pending >= self.max_pending:
+            self.instruments.count("rejected")
+            raise RequestError(503, "Too many requests queued, try again later")
+        self.pending += 1
+        self.update_gauges()
+        start_time = time.monotonic()
+        try:
+            route, region, stats = await self.plan(request)
+        finally:
+            self.pending -= 1
+            self.update_gauges()
+        latency = time.monotonic() - start_time
+        self.latencies.append(latency)
+        self.instruments.add_time("request", latency)
+        coords = route_coordinates(region.graph, route)
+        stats["latency"] = latency
+        if request.get("format", "geojson") == "gpx":
+            return 200, "application/gpx+xml", to_gpx(coords, stats)
+        return 200, "application/json", json.dumps(to_geojson(coords, stats), default=float)
+
+    def metrics(self):
+        latencies = np.array(self.latencies, dtype=float)
+        percentiles = {f"p{p}": float(np.percentile(latencies, p)) for p in (50, 95, 99)} if len(latencies) else {}
+        return {"queue_depth": self.pending - self.running, "running": self.running, "pending": self.pending,
+                "latency": {**percentiles, "count": len(latencies)}, **self.instruments.snapshot()}
+
+    async def respond(self, method: str, path: str, body: bytes):
+        """Route an HTTP request to its handler. Returns (status, content type, body)."""
+        if method == "GET" and path == "/health":
+            return 200, "application/json", json.dumps({"ok": True, "regions": list(self.regions)})
+        if method == "GET" and path == "/metrics":
+            return 200, "application/json", json.dumps(self.metrics())
+        if method == "POST" and path == "/route":
+            try:
+                request = json.loads(body or b"{}")
+            except json.JSONDecodeError:
+                raise RequestError(400, "The body should be JSON")
+            self.instruments.count("requests")
+            return await self.handle_route(request)
+        raise RequestError(404, f"Nothing at {method} {path}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Just enough HTTP/1.1: one request per connection"""
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            if len(request_line) < 2:
+                raise RequestError(400, "Bad request line")
+            status, content_type, content = await self.respond(request_line[0], request_line[1], body)
+        except RequestError as e:
+            status, content_type, content = e.status, "application/json", json.dumps({"error": str(e)})
+        except Exception as e:
+            self.instruments.count("errors")
+            status, content_type, content = 500, "application/json", json.dumps({"error": repr(e)})
+        content = content.encode()
+        writer.write(f"HTTP/1.1 {status} {status_reasons.get(status, '')}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode() + content)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8765, socket_path: str | None = None):
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle_connection, path=socket_path)
+            print(f"Listening on {socket_path}")
+        else:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"Listening on http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+status_reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def route_coordinates(graph: nx.MultiGraph, route: list):
+    """The lon/lat points along a route, following the edges' geometries where they have them"""
+    nodes = graph.nodes
+    if len(route) == 1:
+        return [(nodes[route[0]]["x"], nodes[route[0]]["y"])]
+    coords = []
+    for u, v in zip(route, route[1:]):
+        data = min(graph.get_edge_data(u, v).values(), key=lambda data: data["length"])
+        start = np.array([nodes[u]["x"], nodes[u]["y"]])
+        geometry = data.get("geometry")
+        line = np.asarray(geometry.coords)[:, :2] if geometry is not None else np.array([start, (nodes[v]["x"], nodes[v]["y"])])
+        # Geometries run whichever way their edge was stored
+        if np.linalg.norm(line[-1] - start) < np.linalg.norm(line[0] - start):
+            line = line[::-1]
+        coords.extend(line.tolist() if not coords else line[1:].tolist())
+    return coords
+
+def to_geojson(coords: list, properties: dict):
+    return {"type": "Feature", "geometry": {"type": "LineString", "coordinates": coords}, "properties": properties}
+
+def to_gpx(coords: list, properties: dict):
+    points = "\n".join(f'      <trkpt lat="{lat:.7f}" lon="{lon:.7f}"/>' for lon, lat in coords)
+    description = escape(json.dumps(properties, default=float))
+    return (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<gpx version="1.1" creator="Wandrer Planner" xmlns="http://www.topografix.com/GPX/1/1">\n'
+            f'  <trk>\n    <name>Wandrer Planner route</name>\n    <desc>{description}</desc>\n    <trkseg>\n{points}\n    </trkseg>\n  </trk>\n</gpx>\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--kml", required=True, help="The Wandrer KML export to plan on")
+    parser.add_argument("--region", nargs=5, action="append", metavar=("NAME", "NORTH", "SOUTH", "EAST", "WEST"),
+                        help="A region to keep warm (can be repeated). Without any, the whole map is one region.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--socket", help="Listen on this Unix socket instead")
+    parser.add_argument("--colonies", type=int, default=2, help="Warm colonies per region")
+    parser.add_argument("--workers", type=int, default=4, help="Requests that run at once")
+    parser.add_argument("--max-pending", type=int, default=16, help="Requests (queued plus running) before new ones get a 503")
+    parser.add_argument("--budget", type=float, default=10, help="Default latency budget per request (seconds)")
+    parser.add_argument("--betweenness-k", type=int, default=1000)
+    parser.add_argument("--pheromone-cache", help="A directory to cache colony runs in (see PheromoneCache)")
+    parser.add_argument("--contract-chains", action="store_true",
+                        help="Have the colonies walk a chain-contracted graph: faster, but routes can't turn around partway along a chain")
+    args = parser.parse_args()
+
+    async def run():
+        map_data = load_map(args.kml)
+        deadendness = BetweennessDeadendness(k=args.betweenness_k, seed=0)
+        if args.region:
+            regions = {name: Region.from_map(name, map_data.crop(*map(float, bbox)), args.colonies, deadendness, args.contract_chains)
+                       for name, *bbox in args.region}
+        else:
+            regions = {"all": Region.from_map("all", map_data, args.colonies, deadendness, args.contract_chains)}
+        cache = PheromoneCache(args.pheromone_cache) if args.pheromone_cache else None
+        service = RouteService(regions, workers=args.workers, max_pending=args.max_pending, default_budget=args.budget, cache=cache)
+        await service.serve(args.host, args.port, args.socket)
+
+    asyncio.run(run())
+
+if __name__ == "__main__":
+    main()
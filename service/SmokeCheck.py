@@ -0,0 +1,69 @@
+"""
+A quick end-to-end check of the RouteService, without a Wandrer map or a server:
+  a synthetic city grid (placed on the map near Wellington) goes in as a region, and route requests for both engines
+  (in both formats) go through the service's request handling, snapping included.
+Exits with an error if any request fails.
+Run with: python -m service.SmokeCheck
+"""
+import argparse
+import asyncio
+import json
+
+import networkx as nx
+import numpy as np
+import pyproj
+
+from aco_algo.DeadendnessProvider import StructuralDeadendness
+from benchmarks.CityGrid import city_grid
+from map_data.MapData import GLOBAL_CRS
+from .RouteService import Region, RouteService
+
+# Where the grid goes: its corner, in NZGD2000 / New Zealand Transverse Mercator 2000 (meters)
+PROJ_CRS = "EPSG:2193"
+ORIGIN = np.array([1748000.0, 5427000.0])
+
+
+def grid_region(blocks: int):
+    """A city grid with real lon/lat coordinates and projected positions, so snapping works like on a real map"""
+    graph = city_grid(blocks, dead_end_density=0.1)
+    graph.graph["crs"] = GLOBAL_CRS
+    graph.graph["proj_crs"] = PROJ_CRS
+    to_lon_lat = pyproj.Transformer.from_crs(PROJ_CRS, GLOBAL_CRS, always_xy=True)
+    for node, data in graph.nodes(data=True):
+        data["proj_pos"] = ORIGIN + data["proj_pos"]
+        data["x"], data["y"] = to_lon_lat.transform(*data["proj_pos"])
+    nx.set_node_attributes(graph, StructuralDeadendness().centrality(graph), 'betweenness_centrality')
+    return Region("grid", graph, num_colonies=1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=8)
+    parser.add_argument("--target-length", type=float, default=800)
+    parser.add_argument("--budget", type=float, default=2)
+    args = parser.parse_args()
+
+    async def check():
+        region = grid_region(args.blocks)
+        service = RouteService({"grid": region}, workers=2, default_budget=args.budget)
+        middle = region.graph.nodes[(args.blocks // 2) * args.blocks + args.blocks // 2]
+        for engine in ("aco", "astar"):
+            for format in ("geojson", "gpx"):
+                request = {"start": [middle["x"], middle["y"]], "engine": engine, "format": format,
+                           "settings": {"target_length": args.target_length, "num_ants": 20}}
+                status, content_type, content = await service.respond("POST", "/route", json.dumps(request).encode())
+                assert status == 200, f"{engine} {format} request failed with {status}: {content}"
+                if format == "geojson":
+                    route = json.loads(content)
+                    assert len(route["geometry"]["coordinates"]) > 1, f"{engine} returned an empty route"
+                    print(f"{engine}: {json.dumps(route['properties'], default=float)}")
+                else:
+                    assert "<trkpt" in content, f"{engine} returned an empty GPX track"
+        status, _, content = await service.respond("GET", "/metrics", b"")
+        assert status == 200
+        print(f"metrics: {content}")
+
+    asyncio.run(check())
+    print("Service checks passed")
+
+if __name__ == "__main__":
+    main()